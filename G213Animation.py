@@ -0,0 +1,294 @@
+'''
+  *  Software animations for the G213 zones (and the single G203 zone).
+  *
+  *  The device hardware only knows static, breathe and cycle. Everything else is
+  *  rendered here frame by frame and pushed with send_color_command, writing only
+  *  the zones whose color actually changed since the previous frame. Looping effects
+  *  render their whole loop once when the animation starts (G213Pipeline), so a frame
+  *  is then just a list index.
+'''
+
+import colorsys
+import logging
+import math
+import threading
+import time
+
+import G213Pipeline
+
+logger = logging.getLogger(__name__)
+
+# Zones addressed by send_color_command(color, field) per product. Field 0 is the whole device.
+PRODUCT_ZONES = {
+    "G213": (1, 2, 3, 4, 5),
+    "G203": (0,),
+}
+
+
+def hex_to_rgb(color_hex):
+    return tuple(bytes.fromhex(color_hex))
+
+
+def rgb_to_hex(rgb):
+    return f"{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
+
+
+def lerp_rgb(a, b, f):
+    return (
+        int(a[0] + (b[0] - a[0]) * f + 0.5),
+        int(a[1] + (b[1] - a[1]) * f + 0.5),
+        int(a[2] + (b[2] - a[2]) * f + 0.5),
+    )
+
+
+def hue_to_rgb(hue, saturation=1.0, value=1.0):
+    r, g, b = colorsys.hsv_to_rgb(hue % 1.0, saturation, value)
+    return (int(r * 255 + 0.5), int(g * 255 + 0.5), int(b * 255 + 0.5))
+
+
+def _as_rgb(color):
+    return hex_to_rgb(color) if isinstance(color, str) else tuple(color)
+
+
+class Effect:
+    """Base class: colors_at(t, zone_count) returns one (r, g, b) tuple per zone at t seconds."""
+
+    def prepare(self, fps, zone_count):
+        """Called before an Animator starts, and by G213Offload.plan(); effects may precompute their frames here.
+
+        Both may prepare the same effect, so a second call with the same arguments should reuse the work.
+        """
+
+    def colors_at(self, t, zone_count):
+        raise NotImplementedError
+
+
+class LoopEffect(Effect):
+    """An effect repeating every period seconds; render() draws one loop at a time."""
+
+    def __init__(self, period):
+        self.period = period
+        self._timeline = None # (fps, zone_count, frames) once prepared
+
+    def render(self, frame_count, zone_count):
+        """Returns frame_count frames of zone colors covering one loop."""
+        raise NotImplementedError
+
+    def prepare(self, fps, zone_count):
+        frame_count = max(1, round(self.period * fps))
+        if self._timeline is not None and self._timeline[:2] == (fps, zone_count) and len(self._timeline[2]) == frame_count:
+            return # Already rendered, e.g. by G213Offload.plan() before the Animator took over
+        self._timeline = (fps, zone_count, self.render(frame_count, zone_count))
+
+    def _rendered_frame(self, t, zone_count):
+        """The precomputed frame for t, or None if the effect was not prepared for zone_count."""
+        if self._timeline is None or self._timeline[1] != zone_count:
+            return None
+        fps, _, frames = self._timeline
+        return frames[round(t * fps) % len(frames)]
+
+
+class WaveEffect(LoopEffect):
+    """A rainbow travelling across the zones; each zone is phase shifted by spread/zone_count."""
+
+    def __init__(self, period=4.0, spread=1.0, reverse=False, value=1.0):
+        super().__init__(period)
+        self.spread = spread
+        self.direction = -1 if reverse else 1
+        self.value = value
+
+    def render(self, frame_count, zone_count):
+        # At full saturation the hue circle is linear between the six rainbow stops
+        return G213Pipeline.gradient_timeline(
+            G213Pipeline.RAINBOW_STOPS, zone_count, frame_count, self.direction * self.spread / zone_count, self.value
+        )
+
+    def colors_at(self, t, zone_count):
+        frame = self._rendered_frame(t, zone_count)
+        if frame is not None:
+            return frame
+        base = t / self.period
+        step = self.spread / zone_count
+        return [hue_to_rgb(base + self.direction * i * step, value=self.value) for i in range(zone_count)]
+
+
+class GradientScrollEffect(LoopEffect):
+    """A looping gradient through the given color stops, scrolled across the zones."""
+
+    def __init__(self, stops, period=4.0):
+        if len(stops) < 2:
+            raise ValueError("A gradient needs at least two color stops")
+        super().__init__(period)
+        self.stops = [_as_rgb(c) for c in stops]
+
+    def render(self, frame_count, zone_count):
+        return G213Pipeline.gradient_timeline(self.stops, zone_count, frame_count)
+
+    def sample(self, position):
+        position = (position % 1.0) * len(self.stops)
+        index = int(position)
+        return lerp_rgb(self.stops[index], self.stops[(index + 1) % len(self.stops)], position - index)
+
+    def colors_at(self, t, zone_count):
+        frame = self._rendered_frame(t, zone_count)
+        if frame is not None:
+            return frame
+        offset = t / self.period
+        return [self.sample(offset + i / zone_count) for i in range(zone_count)]
+
+
+class PulseEffect(Effect):
+    """One color on every zone, fading from floor (0-1) up to full brightness and back each period."""
+
+    def __init__(self, color, period=4.0, floor=0.0):
+        self.color = _as_rgb(color)
+        self.period = period
+        self.floor = floor
+
+    def colors_at(self, t, zone_count):
+        level = self.floor + (1.0 - self.floor) * (0.5 - 0.5 * math.cos(2 * math.pi * t / self.period))
+        return [tuple(int(channel * level + 0.5) for channel in self.color)] * zone_count
+
+
+class ChaseEffect(Effect):
+    """A block of width lit zones running across a background color."""
+
+    def __init__(self, color, background="000000", period=1.0, width=1, bounce=False):
+        self.color = _as_rgb(color)
+        self.background = _as_rgb(background)
+        self.period = period
+        self.width = width
+        self.bounce = bounce
+
+    def colors_at(self, t, zone_count):
+        steps = zone_count if not self.bounce else max(1, 2 * (zone_count - 1))
+        head = int(t / self.period * steps) % steps
+        if self.bounce and head >= zone_count:
+            head = steps - head
+        lit = {(head + i) % zone_count for i in range(self.width)}
+        return [self.color if i in lit else self.background for i in range(zone_count)]
+
+
+class KeyframeEffect(Effect):
+    """Linear interpolation between keyframes [(time, color or [color per zone]), ...]."""
+
+    def __init__(self, keyframes, loop=True):
+        if not keyframes:
+            raise ValueError("At least one keyframe is required")
+        # A list holds one color per zone, anything else is one color for every zone
+        self.keyframes = sorted(
+            (t, [_as_rgb(c) for c in colors] if isinstance(colors, list) else _as_rgb(colors))
+            for t, colors in keyframes
+        )
+        self.duration = self.keyframes[-1][0]
+        self.loop = loop
+
+    @staticmethod
+    def _zone_colors(colors, zone_count):
+        if isinstance(colors, list):
+            return [colors[i % len(colors)] for i in range(zone_count)]
+        return [colors] * zone_count
+
+    def colors_at(self, t, zone_count):
+        if self.loop and self.duration > 0:
+            t %= self.duration
+        previous = self.keyframes[0]
+        if t <= previous[0]:
+            return self._zone_colors(previous[1], zone_count)
+        for current in self.keyframes[1:]:
+            if t <= current[0]:
+                f = (t - previous[0]) / (current[0] - previous[0])
+                a = self._zone_colors(previous[1], zone_count)
+                b = self._zone_colors(current[1], zone_count)
+                return [lerp_rgb(x, y, f) for x, y in zip(a, b)]
+            previous = current
+        return self._zone_colors(previous[1], zone_count)
+
+
+class ZoneWriter:
+    """Writes zone colors to a connected device, skipping zones whose color did not change."""
+
+    def __init__(self, device, zones=None):
+        self.device = device
+        self.zones = zones or PRODUCT_ZONES[device.product_name]
+        self.current = [None] * len(self.zones)
+        self.usb_writes = 0
+        self.writes_skipped = 0
+
+    def invalidate(self):
+        self.current = [None] * len(self.zones)
+
+    def write(self, colors):
+        """Sends the changed zones; returns False as soon as a write fails."""
+        for i, (zone, color) in enumerate(zip(self.zones, colors)):
+            if self.current[i] == color:
+                self.writes_skipped += 1
+                continue
+            if not self.device.send_color_command(color, zone):
+                self.current[i] = None
+                return False
+            self.current[i] = color
+            self.usb_writes += 1
+        return True
+
+
+class Animator:
+    """Renders an Effect at a fixed frame rate onto one open device handle.
+
+    Frames are scheduled on absolute deadlines; when rendering or USB writes overrun,
+    the missed deadlines are skipped and counted in frames_dropped.
+    """
+
+    def __init__(self, device, effect, fps=30):
+        self.writer = ZoneWriter(device)
+        self.effect = effect
+        self.fps = fps
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "frames_rendered": self.frames_rendered,
+            "frames_dropped": self.frames_dropped,
+            "usb_writes": self.writer.usb_writes,
+            "writes_skipped": self.writer.writes_skipped,
+        }
+
+    def run(self, duration=None):
+        """Blocks until stop() is called, duration seconds pass, or a write fails."""
+        interval = 1.0 / self.fps
+        zone_count = len(self.writer.zones)
+        self.effect.prepare(self.fps, zone_count)
+        start = time.monotonic()
+        deadline = start
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+            if not self.writer.write(self.effect.colors_at(deadline - start, zone_count)):
+                logger.error(f"Animation on {self.writer.device.product_name} stopped after a failed write.")
+                return False
+            self.frames_rendered += 1
+            deadline += interval
+            now = time.monotonic()
+            if now > deadline:
+                missed = int((now - deadline) / interval) + 1
+                self.frames_dropped += missed
+                deadline += missed * interval
+            self._stop_event.wait(deadline - now)
+        logger.info(f"Animation finished: {self.stats()}")
+        return True
+
+    def start(self, duration=None):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, args=(duration,), name="Animator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,207 @@
+'''
+  *  asyncio front end for LogitechDevice.
+  *
+  *  USB calls stay blocking underneath; they are offloaded to a thread pool so
+  *  several products can be driven concurrently and a GUI main loop never waits.
+'''
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import G213Colors
+
+logger = logging.getLogger(__name__)
+
+ApplyResult = G213Colors.ApplyResult
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """Shared executor with one worker per supported product."""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(
+                max_workers=len(G213Colors.LogitechDevice.PRODUCT_SPECS), thread_name_prefix="g213-usb"
+            )
+        return _default_executor
+
+
+class AsyncLogitechDevice:
+    """Awaitable wrapper around a pooled LogitechDevice; each call runs on an executor thread."""
+
+    def __init__(self, product_name, pool=None, executor=None):
+        if product_name not in G213Colors.LogitechDevice.PRODUCT_SPECS:
+            raise ValueError(f"Unsupported product: {product_name}")
+        self.product_name = product_name
+        self.pool = pool or G213Colors.DevicePool()
+        self.executor = executor or get_default_executor()
+
+    async def _call(self, func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self.pool.call, self.product_name, func))
+
+    async def send_color_command(self, color_hex, field=0):
+        return await self._call(lambda device: device.send_color_command(color_hex, field))
+
+    async def send_breathe_command(self, color_hex, speed):
+        return await self._call(lambda device: device.send_breathe_command(color_hex, speed))
+
+    async def send_cycle_command(self, speed):
+        return await self._call(lambda device: device.send_cycle_command(speed))
+
+    async def apply_frames(self, frames):
+        return await self._call(lambda device: device.apply_frames(frames))
+
+    async def apply(self, frames):
+        """Like apply_frames, but returns an ApplyResult with timing and never raises."""
+        start = time.perf_counter()
+        try:
+            ok = await self.apply_frames(frames)
+            error = None if ok else "Could not connect to or write to the device"
+        except Exception as e: # One product failing must not abort the others
+            logger.error(f"Unexpected error applying frames to {self.product_name}: {e}")
+            ok, error = False, str(e)
+        return ApplyResult(self.product_name, ok, time.perf_counter() - start, error)
+
+
+async def apply_all(frames_by_product, pool=None, executor=None):
+    """Applies {product_name: [frames]} to every product concurrently; returns {product_name: ApplyResult}."""
+    pool = pool or G213Colors.DevicePool()
+    devices = [AsyncLogitechDevice(product, pool, executor) for product in frames_by_product]
+    results = await asyncio.gather(*(device.apply(frames_by_product[device.product_name]) for device in devices))
+    return {result.product_name: result for result in results}
+
+
+async def run_blocking(func, executor=None):
+    """Awaits func() run on an executor thread; for blocking calls such as daemon requests."""
+    return await asyncio.get_running_loop().run_in_executor(executor or get_default_executor(), func)
+
+
+class BackgroundLoop:
+    """An asyncio event loop on a daemon thread, for callers (like GTK) that own the main thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="g213-asyncio", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro, callback=None):
+        """Schedules coro; callback(result_or_exception) runs when it finishes, a CancelledError if it was cancelled."""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(self._outcome(f)))
+        return future
+
+    @staticmethod
+    def _outcome(future):
+        if future.cancelled():
+            return CancelledError() # exception() and result() would raise it instead
+        return future.exception() or future.result()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class LatestWinsWriter(threading.Thread):
+    """Streams rapidly changing settings (a live preview) to devices without ever blocking the caller.
+
+    submit() only stores the newest frames for a product. The writer thread sends them at
+    most max_rate times per second per product through the pool's persistent handle,
+    dropping every intermediate value, and only the frames that differ from what it last
+    wrote. Writes go through send_batch, not apply_frames, so nothing is recorded as the
+    user's settings.
+    """
+    DEFAULT_MAX_RATE = 30.0
+    RETRY_AFTER = 2.0 # Seconds to leave a product alone after it could not be opened
+
+    def __init__(self, pool, max_rate=DEFAULT_MAX_RATE):
+        super().__init__(name="g213-preview", daemon=True)
+        self.pool = pool
+        self.interval = 1.0 / max_rate
+        self.submitted = 0
+        self.written = 0
+        self.frames_sent = 0
+        self._latest = {} # product_name -> frames waiting to be written
+        self._next_write_at = {} # product_name -> monotonic time
+        self._last_frames = {} # product_name -> {slot: frame} last written
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def submit(self, product_name, frames):
+        with self._condition:
+            self._latest[product_name] = frames
+            self.submitted += 1
+            self._condition.notify()
+
+    def discard(self, product_name=None):
+        """Drops pending frames (e.g. before a commit) and forgets what the device shows."""
+        with self._condition:
+            for product in ([product_name] if product_name else list(self._latest) + list(self._last_frames)):
+                self._latest.pop(product, None)
+                self._last_frames.pop(product, None)
+
+    def stats(self):
+        return {"submitted": self.submitted, "written": self.written, "coalesced": self.submitted - self.written,
+                "frames_sent": self.frames_sent}
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        while True:
+            with self._condition:
+                product_name = frames = None
+                while not self._stopping:
+                    now = time.monotonic()
+                    due = {product: self._next_write_at.get(product, 0) for product in self._latest}
+                    ready = [product for product, at in due.items() if at <= now]
+                    if ready:
+                        product_name = ready[0]
+                        frames = self._latest.pop(product_name)
+                        self._next_write_at[product_name] = now + self.interval
+                        break
+                    self._condition.wait(min(due.values()) - now if due else None)
+                if self._stopping:
+                    return
+            self._write(product_name, frames)
+
+    def _write(self, product_name, frames):
+        device = self.pool.acquire(product_name)
+        if device is None:
+            with self._condition:
+                self._next_write_at[product_name] = time.monotonic() + self.RETRY_AFTER
+            return
+        try:
+            last = self._last_frames.get(product_name, {})
+            changed = []
+            for frame in frames:
+                slot = device.frame_slot(frame)
+                if slot is None or slot == 0:
+                    if last != {slot: frame}:
+                        changed.append(frame)
+                    last = {slot: frame}
+                elif last.get(slot) != frame:
+                    changed.append(frame)
+                    last = {key: value for key, value in last.items() if key} # A zone write ends any whole-device effect
+                    last[slot] = frame
+            results = device.send_batch(changed) if changed else []
+            if all(result.sent for result in results):
+                self._last_frames[product_name] = last
+            else:
+                self._last_frames.pop(product_name, None)
+            self.written += 1
+            self.frames_sent += len(results)
+        finally:
+            self.pool.release(product_name)
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+'''
+  *  Headless command-line interface for G213Colors (installed as /usr/bin/g213colors).
+  *
+  *  Never imports GTK, and pyusb is only loaded once a command actually talks to a
+  *  device, so the systemd oneshot and login autostart start in a fraction of the
+  *  time the GUI binary needs.
+  *
+  *      g213colors apply --system              (what g213colors.service runs)
+  *      g213colors apply --user G213           (login autostart)
+  *      g213colors static G213 ff0000 --save
+  *      g213colors segments ff0000 00ff00 0000ff ffff00 00ffff
+  *      g213colors list
+  *      g213colors load G213 --interval 2      (system-load visualizer, see G213Load)
+  *      g213colors flash ff0000 --ttl 3        (transient overlay, see G213Compositor)
+  *      g213colors ingest                      (colors streamed over a FIFO/UDP, see G213Ingest)
+  *      g213colors profile save G213 evening 11ff0c3a...   (named profiles, see G213Profiles)
+  *      g213colors daemon                      (resident daemon, see G213Daemon)
+  *      g213colors watch                       (reapply settings on hotplug, see G213Hotplug)
+  *      g213colors schedule                    (time-of-day profiles, see G213Schedule)
+  *      g213colors --trace s.g2t static G213 ff0000   (record USB traffic, see G213Trace)
+  *      g213colors trace replay s.g2t --speed 10
+  *
+  *  When a daemon is running, set/animate commands are sent to it over its socket
+  *  instead of opening the device here (use --direct to bypass it).
+'''
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+
+import G213Colors
+
+logger = logging.getLogger("g213colors_cli")
+
+PRODUCTS = list(G213Colors.LogitechDevice.PRODUCT_SPECS)
+
+
+def apply_system_default():
+    """Applies /etc/G213Colors.conf; returns the process exit code."""
+    # Always written: it runs at boot and resume, when the device state is unknown anyway
+    success = G213Colors.LogitechDevice.apply_configuration_from_file(
+        G213Colors.LogitechDevice.SYSTEM_DEFAULT_CONF_FILE, force=True
+    )
+    if success:
+        logger.info("System default settings applied successfully.")
+        return 0
+    logger.error("Failed to apply system default settings.")
+    return 1
+
+
+def apply_user_config(product_name, config_dir=G213Colors.USER_CONFIG_DIR, force=False):
+    """Applies the user's saved settings to every unit of product_name; returns the exit code."""
+    import G213Profiles
+    logger.info(f"Attempting to load user settings for {product_name} from: {config_dir}")
+
+    # Per-unit profiles (default@<bus-port>) and files (G213@<bus-port>.conf) override the product's for that unit
+    store = G213Profiles.ProfileStore(os.path.join(config_dir, os.path.basename(G213Profiles.USER_PROFILE_STORE)))
+    try:
+        has_profiles = any(name == G213Profiles.DEFAULT_PROFILE or name.startswith(G213Profiles.DEFAULT_PROFILE + "@")
+                           for _, name in store.names(product_name))
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring profile store {store.path}: {e}")
+        has_profiles = False
+    if not has_profiles and not glob.glob(os.path.join(config_dir, f"{product_name}.conf")) \
+            and not glob.glob(os.path.join(config_dir, f"{product_name}@*.conf")):
+        logger.warning(f"No saved settings found for {product_name} in {config_dir}. Nothing to apply.")
+        return 0 # Not an error, just no config to apply
+
+    import G213Fleet
+    results = G213Fleet.apply_user_configurations(product_name, config_dir, force=force)
+    if results and all(result.ok for result in results.values()):
+        logger.info(f"User settings for {product_name} applied successfully to {len(results)} unit(s).")
+        return 0
+    logger.error(f"Failed to apply user settings for {product_name}.")
+    return 1
+
+
+def _daemon_request(args, op, **params):
+    """Sends a request to a running daemon; returns its response, or None if there is no daemon.
+
+    A daemon that takes the request but does not answer in time is an error response, not
+    None: it may still be applying, so the caller must not write the device itself.
+    """
+    if args.direct:
+        return None
+    import G213Daemon
+    client = G213Daemon.DaemonClient(args.socket)
+    try:
+        return client.request(op, **params)
+    except G213Daemon.DaemonUnavailable:
+        return None
+    except (OSError, ValueError) as e:
+        return {"ok": False, "error": f"no answer from the daemon to {op}: {e}"}
+    finally:
+        client.close()
+
+
+def _send(args, frames):
+    response = _daemon_request(
+        args, "apply_frames", product=args.product, unit=args.unit, frames=[frame.hex() for frame in frames], force=args.force
+    )
+    if response is not None:
+        if not response["ok"]:
+            logger.error(f"Daemon: {response['error']}")
+            return 1
+        if args.save:
+            _save(args, frames)
+        return 0
+
+    device = G213Colors.LogitechDevice(args.product, args.unit)
+    if not device.connect():
+        logger.error(f"Could not connect to {device.display_name}.")
+        return 1
+    try:
+        ok = device.apply_frames(frames, args.force)
+    finally:
+        device.disconnect()
+    if not ok:
+        logger.error(f"Failed to send command(s) to {device.display_name}.")
+        return 1
+    if args.save:
+        _save(args, frames)
+    return 0
+
+
+def _save(args, frames):
+    import G213Profiles
+    G213Profiles.save_user_profile(args.product, frames, args.unit)
+
+
+def cmd_apply(args):
+    if args.system:
+        return apply_system_default()
+    if args.user:
+        return apply_user_config(args.user, force=args.force)
+    if not args.direct:
+        # The daemon only reads files in the profile directory, so send it the frames
+        try:
+            product, commands = G213Colors.LogitechDevice.read_configuration(args.file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read {args.file}: {e}")
+            return 1
+        response = _daemon_request(args, "apply_frames", product=product, unit=args.unit, frames=commands, force=args.force)
+        if response is not None:
+            if not response["ok"]:
+                logger.error(f"Daemon: {response['error']}")
+            return 0 if response["ok"] else 1
+    return 0 if G213Colors.LogitechDevice.apply_configuration_from_file(args.file, args.unit, args.force) else 1
+
+
+def cmd_static(args):
+    return _send(args, [G213Colors.build_frame(args.product, "color", (0, args.color))])
+
+
+def cmd_breathe(args):
+    return _send(args, [G213Colors.build_frame(args.product, "breathe", (args.color, args.speed))])
+
+
+def cmd_cycle(args):
+    return _send(args, [G213Colors.build_frame(args.product, "cycle", (args.speed,))])
+
+
+def cmd_segments(args):
+    if len(args.colors) != 5:
+        logger.error("The G213 has five segments; give exactly five colors.")
+        return 2
+    args.product = "G213"
+    return _send(args, [G213Colors.build_frame("G213", "color", (i, color)) for i, color in enumerate(args.colors, 1)])
+
+
+def cmd_profile(args):
+    import G213Pipeline
+    import G213Profiles
+    store = G213Profiles.ProfileStore(args.store)
+    if args.action == "list":
+        try:
+            for product, name in store.names(args.product):
+                pipeline_version = store.pipeline_version(product, name)
+                built = "raw frames" if pipeline_version == G213Pipeline.RAW_FRAMES else f"color pipeline v{pipeline_version}"
+                print(f"{product}\t{name}\t{len(store.get(product, name))} frame(s)\t{built}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read {store.path}: {e}")
+            return 1
+        return 0
+    if args.action == "convert":
+        count = G213Profiles.convert_legacy_configs(args.config_dir, store, remove=args.remove)
+        print(f"Converted {count} configuration file(s) into {store.path}")
+        return 0
+    if args.product is None or args.name is None:
+        logger.error(f"profile {args.action} needs a product and a profile name.")
+        return 2
+    if args.action == "save":
+        if args.file:
+            try:
+                file_product, frames = G213Colors.LogitechDevice.read_configuration(args.file)
+            except (ValueError, IOError) as e:
+                logger.error(f"Cannot read {args.file}: {e}")
+                return 1
+            if file_product != args.product:
+                logger.error(f"{args.file} is for {file_product}, not {args.product}.")
+                return 1
+        else:
+            frames = args.frames
+        return 0 if store.save(args.product, args.name, frames) else 1
+    if args.action == "delete":
+        if not store.delete(args.product, args.name):
+            logger.error(f"No profile {args.product}/{args.name}")
+            return 1
+        return 0
+    # apply
+    if args.direct:
+        return 0 if store.apply(args.product, args.name, args.unit, args.force) else 1
+    try:
+        frames = store.get(args.product, args.name)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read profile store {store.path}: {e}")
+        return 1
+    if frames is None:
+        logger.error(f"No profile {args.product}/{args.name} in {store.path}")
+        return 1
+    response = _daemon_request(args, "apply_frames", product=args.product, unit=args.unit,
+                               frames=[frame.hex() for frame in frames], force=args.force)
+    if response is not None:
+        if not response["ok"]:
+            logger.error(f"Daemon: {response['error']}")
+        return 0 if response["ok"] else 1
+    return 0 if store.apply(args.product, args.name, args.unit, args.force) else 1
+
+
+def cmd_list(args):
+    for product in PRODUCTS:
+        for unit in G213Colors.LogitechDevice.find_units(product):
+            print(f"{product}\t{unit}")
+    return 0
+
+
+def cmd_animate(args):
+    offload = not getattr(args, "no_offload", True)
+    response = _daemon_request(
+        args, "start_animation", product=args.product, unit=args.unit, effect=args.effect,
+        colors=args.colors, period=args.period, fps=args.fps, duration=args.duration, offload=offload
+    )
+    if response is not None:
+        if not response["ok"]:
+            logger.error(f"Daemon: {response['error']}")
+        elif response.get("offload"):
+            logger.info(f"Daemon: {response['offload']} ({response['reason']})")
+        return 0 if response["ok"] else 1
+
+    import G213Animation
+    import G213Load
+    effects = {
+        "wave": lambda: G213Animation.WaveEffect(period=args.period),
+        "gradient": lambda: G213Animation.GradientScrollEffect(args.colors or ["ff0000", "0000ff"], period=args.period),
+        "chase": lambda: G213Animation.ChaseEffect((args.colors or ["ffffff"])[0], period=args.period),
+        "pulse": lambda: G213Animation.PulseEffect((args.colors or ["ffffff"])[0], period=args.period),
+        "spectrum": lambda: G213Animation.WaveEffect(period=args.period, spread=0),
+        "load": lambda: G213Load.SystemLoadEffect(),
+    }
+    effect = effects[args.effect]()
+    device = G213Colors.LogitechDevice(args.product, args.unit)
+    if offload and args.duration is None:
+        # The device can run it on its own: one write, and the kernel driver goes straight back
+        import G213Offload
+        offload_plan = G213Offload.plan(effect, args.product, args.fps)
+        if offload_plan.frames is not None:
+            if not device.connect():
+                logger.error(f"Could not connect to {device.display_name}.")
+                return 1
+            try:
+                return 0 if device.apply_frames(offload_plan.frames) else 1
+            finally:
+                device.disconnect()
+    if not device.connect():
+        logger.error(f"Could not connect to {device.display_name}.")
+        return 1
+    device.start_ack_reader()
+    animator = G213Animation.Animator(device, effect, fps=args.fps)
+    try:
+        ok = animator.run(args.duration)
+    except KeyboardInterrupt:
+        ok = True
+    finally:
+        device.disconnect()
+    return 0 if ok else 1
+
+
+def cmd_load(args):
+    """The system-load visualizer is an animation sampled once per interval."""
+    if args.interval <= 0:
+        logger.error("The interval must be positive.")
+        return 2
+    args.effect, args.colors, args.period, args.fps = "load", None, args.interval, 1.0 / args.interval
+    return cmd_animate(args)
+
+
+def cmd_flash(args):
+    response = _daemon_request(args, "overlay", product=args.product, unit=args.unit, color=args.color, zones=args.zones,
+                               ttl=args.ttl, name=args.name)
+    if response is not None:
+        if not response["ok"]:
+            logger.error(f"Daemon: {response['error']}")
+        return 0 if response["ok"] else 1
+
+    # Without a daemon the overlay lives as long as this process: show it, then restore the user's settings
+    import time
+    import G213Compositor
+    import G213Profiles
+    compositor = G213Compositor.Compositor(args.product, args.unit)
+    _, frames = G213Profiles.user_frames(args.product, args.unit)
+    if frames:
+        compositor.assume_shown(frames)
+        compositor.set_layer(G213Compositor.BASE_LAYER, frames, G213Compositor.PRIORITY_BASE)
+    try:
+        if not compositor.set_layer(args.name, G213Compositor.flash_frames(args.product, args.color, args.zones)):
+            logger.error(f"Could not write to {args.product}.")
+            return 1
+        time.sleep(args.ttl)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ok = compositor.remove_layer(args.name)
+        compositor.close()
+        compositor.pool.close_all()
+    return 0 if ok else 1
+
+
+def cmd_stop_animation(args):
+    response = _daemon_request(args, "stop_animation", product=args.product, unit=args.unit)
+    if response is None:
+        logger.error("No daemon is running.")
+        return 1
+    print(json.dumps(response.get("stats")))
+    return 0 if response["ok"] else 1
+
+
+def cmd_state(args):
+    response = _daemon_request(args, "state")
+    if response is None:
+        logger.error("No daemon is running.")
+        return 1
+    print(json.dumps(response.get("devices"), indent=2))
+    return 0
+
+
+def cmd_metrics(args):
+    if args.direct:
+        import G213Metrics
+        print(G213Metrics.METRICS.to_prometheus() if args.prometheus else G213Metrics.METRICS.to_json())
+        return 0
+    response = _daemon_request(args, "metrics", format="prometheus" if args.prometheus else "json")
+    if response is None:
+        logger.error("No daemon is running.")
+        return 1
+    print(response["metrics"] if args.prometheus else json.dumps(response["metrics"], indent=2))
+    return 0
+
+
+def cmd_daemon(args):
+    import G213Daemon
+    try:
+        G213Daemon.serve(args.socket, int(args.socket_mode, 8), args.idle_timeout, hotplug=not args.no_hotplug,
+                         schedule=not args.no_schedule, ingest=args.ingest)
+    except G213Daemon.DaemonError as e:
+        logger.error(str(e))
+        return 1
+    return 0
+
+
+def cmd_ingest(args):
+    import G213Ingest
+    try:
+        server = G213Ingest.IngestServer(
+            fifo_path=None if args.no_fifo else args.fifo or G213Ingest.default_fifo_path(),
+            udp_port=None if args.no_udp else args.udp_port, queue_size=args.queue_size, max_rate=args.max_rate
+        )
+    except OSError as e:
+        logger.error(f"Cannot open the ingest endpoints: {e}")
+        return 1
+    server.start()
+    try:
+        server.join()
+    except KeyboardInterrupt:
+        server.stop()
+    finally:
+        server.close()
+        server.writer.pool.close_all()
+    logger.info(f"Ingest finished: {server.stats()}")
+    return 0
+
+
+def cmd_watch(args):
+    import G213Hotplug
+    group = G213Hotplug.KERNEL_GROUP if args.kernel_events else G213Hotplug.UDEV_GROUP
+    try:
+        source = G213Hotplug.NetlinkEventSource(group)
+    except OSError as e:
+        logger.error(f"Cannot open the uevent socket: {e}")
+        return 1
+    config_dir = None if args.system else args.config_dir
+    watcher = G213Hotplug.HotplugWatcher(source, config_dir=config_dir, debounce=args.debounce)
+    logger.info("Watching for G213/G203 hotplug events.")
+    watcher.start()
+    try:
+        watcher.join()
+    except KeyboardInterrupt:
+        watcher.stop()
+    finally:
+        source.close()
+    return 0
+
+
+def cmd_schedule(args):
+    import G213Schedule
+    rules = G213Schedule.read_schedule(args.file)
+    if not rules:
+        logger.error(f"No schedule rules in {args.file}.")
+        return 1
+    scheduler = G213Schedule.Scheduler(rules, store_path=args.store, catch_up=not args.no_catch_up)
+    apply_direct = scheduler.apply_func
+
+    def apply(product, unit, frames):
+        # A running daemon owns the device handles; only open them here without one
+        response = _daemon_request(args, "apply_frames", product=product, unit=unit, frames=[frame.hex() for frame in frames])
+        if response is None:
+            return apply_direct(product, unit, frames)
+        if not response["ok"]:
+            logger.error(f"Daemon: {response['error']}")
+        return response["ok"]
+    scheduler.apply_func = apply
+    logger.info(f"Running {len(rules)} schedule rule(s) from {args.file}.")
+    scheduler.start()
+    try:
+        scheduler.join()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 0
+
+
+def cmd_trace(args):
+    import G213Trace
+    try:
+        trace = G213Trace.read_trace(args.file)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read trace {args.file}: {e}")
+        return 1
+    if args.action == "show":
+        products = {device_id: G213Trace.product_of(device) for device_id, device in trace.devices.items()}
+        for event in trace.events:
+            print(G213Trace.describe(products.get(event.device_id), event))
+        return 0
+    print(json.dumps(G213Trace.replay(trace, args.speed), indent=2))
+    return 0
+
+
+def _color(value):
+    value = value.lstrip("#").lower()
+    try:
+        if len(value) == 6:
+            bytes.fromhex(value)
+            return value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"not an RRGGBB hex color: {value}")
+
+
+def _speed(value):
+    speed = int(value)
+    if not 500 <= speed <= 65535:
+        raise argparse.ArgumentTypeError("speed must be 500-65535 ms")
+    return speed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="g213colors", description="Set Logitech G213/G203 colors without the GUI.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--socket", help="Daemon socket (default: $XDG_RUNTIME_DIR/g213colors.sock)")
+    parser.add_argument("--direct", action="store_true", help="Talk to the device even if a daemon is running")
+    parser.add_argument("--trace", metavar="FILE", help="Record all USB traffic of this run to FILE (implies --direct)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    apply_parser = subparsers.add_parser("apply", help="Apply a saved configuration")
+    source = apply_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--system", action="store_true", help=f"Apply {G213Colors.LogitechDevice.SYSTEM_DEFAULT_CONF_FILE}")
+    source.add_argument("--user", metavar="PRODUCT", choices=PRODUCTS, help="Apply the user's saved config for PRODUCT")
+    source.add_argument("--file", help="Apply this .conf file")
+    apply_parser.add_argument("--unit", help="Unit id from 'list' (with --file)")
+    apply_parser.add_argument("--force", action="store_true", help="Send every frame even if the device already shows it")
+    apply_parser.set_defaults(func=cmd_apply)
+
+    def device_parser(name, help_text, func):
+        sub = subparsers.add_parser(name, help=help_text)
+        if name != "segments":
+            sub.add_argument("product", choices=PRODUCTS)
+        sub.add_argument("--unit", help="Unit id from 'list' (default: first found)")
+        sub.add_argument("--save", action="store_true", help="Also save as the user's configuration")
+        sub.add_argument("--force", action="store_true", help="Send even if the device already shows it")
+        sub.set_defaults(func=func)
+        return sub
+
+    device_parser("static", "Set one color", cmd_static).add_argument("color", type=_color)
+    breathe_parser = device_parser("breathe", "Hardware breathe effect", cmd_breathe)
+    breathe_parser.add_argument("color", type=_color)
+    breathe_parser.add_argument("speed", type=_speed, help="500-65535 ms")
+    device_parser("cycle", "Hardware color cycle", cmd_cycle).add_argument("speed", type=_speed, help="500-65535 ms")
+    device_parser("segments", "Set the five G213 segments", cmd_segments).add_argument("colors", type=_color, nargs="+")
+
+    animate_parser = subparsers.add_parser("animate", help="Run a software animation until interrupted")
+    animate_parser.add_argument("effect", choices=["wave", "gradient", "chase", "pulse", "spectrum"])
+    animate_parser.add_argument("product", choices=PRODUCTS, nargs="?", default="G213")
+    animate_parser.add_argument("--unit")
+    animate_parser.add_argument("--colors", type=_color, nargs="+")
+    animate_parser.add_argument("--period", type=float, default=4.0, help="Seconds per loop")
+    animate_parser.add_argument("--fps", type=float, default=30)
+    animate_parser.add_argument("--duration", type=float, help="Seconds (default: until Ctrl+C)")
+    animate_parser.add_argument("--no-offload", action="store_true",
+                                help="Stream every frame even if the device can run the effect itself")
+    animate_parser.set_defaults(func=cmd_animate)
+
+    load_parser = subparsers.add_parser("load", help="Show CPU, memory and load average as zone colors until interrupted")
+    load_parser.add_argument("product", choices=PRODUCTS, nargs="?", default="G213")
+    load_parser.add_argument("--unit")
+    load_parser.add_argument("--interval", type=float, default=2.0, help="Seconds between samples (default 2)")
+    load_parser.add_argument("--duration", type=float, help="Seconds (default: until Ctrl+C)")
+    load_parser.set_defaults(func=cmd_load)
+
+    flash_parser = subparsers.add_parser("flash", help="Show a color for a while, then return to the current lighting")
+    flash_parser.add_argument("color", type=_color)
+    flash_parser.add_argument("product", choices=PRODUCTS, nargs="?", default="G213")
+    flash_parser.add_argument("--unit")
+    flash_parser.add_argument("--zones", type=int, nargs="+", help="Zones to cover (default: the whole device)")
+    flash_parser.add_argument("--ttl", type=float, default=5.0, help="Seconds to show it (default 5)")
+    flash_parser.add_argument("--name", default="overlay", help="Overlay name; a newer flash with the same name replaces it")
+    flash_parser.set_defaults(func=cmd_flash)
+
+    subparsers.add_parser("list", help="List attached devices and their unit ids").set_defaults(func=cmd_list)
+
+    import G213Profiles
+    profile_parser = subparsers.add_parser("profile", help="Manage named profiles in the compiled profile store")
+    profile_parser.add_argument("action", choices=["list", "save", "apply", "delete", "convert"])
+    profile_parser.add_argument("product", choices=PRODUCTS, nargs="?")
+    profile_parser.add_argument("name", nargs="?")
+    profile_parser.add_argument("frames", nargs="*", help="Hex frames to save (or use --file)")
+    profile_parser.add_argument("--file", help="Save the frames of this legacy .conf file")
+    profile_parser.add_argument("--unit", help="Unit id from 'list' (with apply)")
+    profile_parser.add_argument("--force", action="store_true", help="Send every frame even if the device already shows it")
+    profile_parser.add_argument("--store", default=G213Profiles.USER_PROFILE_STORE)
+    profile_parser.add_argument("--config-dir", default=G213Colors.USER_CONFIG_DIR, help="Where convert looks for .conf files")
+    profile_parser.add_argument("--remove", action="store_true", help="Delete the .conf files convert imported")
+    profile_parser.set_defaults(func=cmd_profile)
+
+    stop_parser = subparsers.add_parser("stop-animation", help="Stop a daemon-run animation")
+    stop_parser.add_argument("product", choices=PRODUCTS, nargs="?", default="G213")
+    stop_parser.add_argument("--unit")
+    stop_parser.set_defaults(func=cmd_stop_animation)
+    subparsers.add_parser("state", help="Show the daemon's device state").set_defaults(func=cmd_state)
+    metrics_parser = subparsers.add_parser("metrics", help="Show the daemon's USB metrics")
+    metrics_parser.add_argument("--prometheus", action="store_true")
+    metrics_parser.set_defaults(func=cmd_metrics)
+
+    daemon_parser = subparsers.add_parser("daemon", help="Run the resident lighting daemon")
+    daemon_parser.add_argument("--socket-mode", default="600", help="Octal permissions of the socket (default 600)")
+    daemon_parser.add_argument("--idle-timeout", type=float, default=G213Colors.DevicePool.DEFAULT_IDLE_TIMEOUT,
+                               help="Seconds before an idle device gets its kernel driver back")
+    daemon_parser.add_argument("--no-hotplug", action="store_true", help="Do not reapply settings when a device is plugged in")
+    daemon_parser.add_argument("--no-schedule", action="store_true", help="Do not run the rules of schedule.conf")
+    daemon_parser.add_argument("--ingest", action="store_true", help="Also accept streamed colors (see 'ingest')")
+    daemon_parser.set_defaults(func=cmd_daemon)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Apply colors streamed by other programs over a FIFO or UDP")
+    # Defaults of G213Ingest, repeated so building the parser does not import it
+    ingest_parser.add_argument("--fifo", help="Named pipe to read (default: $XDG_RUNTIME_DIR/g213colors.fifo)")
+    ingest_parser.add_argument("--no-fifo", action="store_true")
+    ingest_parser.add_argument("--udp-port", type=int, default=21213, help="Port on 127.0.0.1 (default 21213)")
+    ingest_parser.add_argument("--no-udp", action="store_true")
+    ingest_parser.add_argument("--queue-size", type=int, default=64, help="Packets kept while the device is busy (default 64)")
+    ingest_parser.add_argument("--max-rate", type=float, default=60.0, help="Writes per second per unit (default 60)")
+    ingest_parser.set_defaults(func=cmd_ingest)
+
+    watch_parser = subparsers.add_parser("watch", help="Reapply saved settings whenever a device is plugged in")
+    watch_parser.add_argument("--config-dir", default=G213Colors.USER_CONFIG_DIR, help="User config directory to apply from")
+    watch_parser.add_argument("--system", action="store_true",
+                              help=f"Only apply {G213Colors.LogitechDevice.SYSTEM_DEFAULT_CONF_FILE}")
+    watch_parser.add_argument("--debounce", type=float, default=0.05, help="Seconds of quiet before reapplying (default 0.05)")
+    watch_parser.add_argument("--kernel-events", action="store_true",
+                              help="Listen to raw kernel uevents instead of udev's (for systems without udevd)")
+    watch_parser.set_defaults(func=cmd_watch)
+
+    schedule_parser = subparsers.add_parser("schedule", help="Apply profiles at the times given in schedule.conf")
+    # G213Schedule.SCHEDULE_FILE; not imported here to keep every other command's startup down
+    schedule_parser.add_argument("--file", default=os.path.join(G213Colors.USER_CONFIG_DIR, "schedule.conf"))
+    schedule_parser.add_argument("--store", default=G213Profiles.USER_PROFILE_STORE)
+    schedule_parser.add_argument("--no-catch-up", action="store_true",
+                                 help="Do not apply the profile that should be showing now at start")
+    schedule_parser.set_defaults(func=cmd_schedule)
+
+    trace_parser = subparsers.add_parser("trace", help="Show or replay a USB trace recorded with --trace")
+    trace_parser.add_argument("action", choices=["show", "replay"])
+    trace_parser.add_argument("file")
+    trace_parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (0 = no waiting)")
+    trace_parser.set_defaults(func=cmd_trace)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace:
+        os.environ["G213COLORS_TRACE"] = args.trace # Read when the USB backend is first created
+        args.direct = True
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
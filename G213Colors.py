@@ -22,20 +22,123 @@
   *  SOFTWARE.
 '''
 
-import usb.core
-import usb.util
 import binascii
 import logging
 import time # Added for sleep in apply_config_from_file
 import os # Added for path operations if needed within the class, though main.py will handle user paths
+import threading
+import atexit
+import errno
+import struct
+import functools
+from collections import namedtuple, deque
+from concurrent.futures import Future, InvalidStateError, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from G213Discovery import DISCOVERY_CACHE
+import G213Lock
+from G213Metrics import METRICS
+import G213Pipeline
+from G213State import STATE_CACHE, NO_STATE_CACHE
+import G213Replay
 
 logger = logging.getLogger(__name__)
 
+# Per-user saved settings (<PRODUCT>.conf, <PRODUCT>@<unit>.conf)
+USER_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "G213Colors")
+
+
+class UsbBackend:
+    """USB access used by LogitechDevice.
+
+    find() returns device handles shaped like pyusb's usb.core.Device: ctrl_transfer,
+    read, is_kernel_driver_active, detach_kernel_driver, attach_kernel_driver and the
+    bus, address and port_numbers attributes. Failures raise self.USBError, which must
+    carry an errno like usb.core.USBError does.
+
+    hardware is True only for backends driving real devices; writes through any other
+    backend (simulators, trace replays) leave no resume replay blob behind. state_cache
+    is the G213State.StateCache of the backend's units, none by default.
+    """
+    USBError = IOError
+    hardware = False
+    state_cache = NO_STATE_CACHE
+
+    def find(self, id_vendor, id_product, find_all=False):
+        raise NotImplementedError
+
+    def dispose(self, handle):
+        pass
+
+    def is_present(self, handle):
+        """Whether a handle from an earlier find() is still the attached device; False forces a new find()."""
+        return False
+
+
+class PyUsbBackend(UsbBackend):
+    """The real thing: pyusb on top of libusb. usb is only imported when this backend is created."""
+    hardware = True
+    state_cache = STATE_CACHE # Shared by every process driving the real devices
+
+    def __init__(self):
+        import usb.core
+        import usb.util
+        self._core = usb.core
+        self._util = usb.util
+        self.USBError = usb.core.USBError
+
+    def find(self, id_vendor, id_product, find_all=False):
+        return self._core.find(find_all=find_all, idVendor=id_vendor, idProduct=id_product)
+
+    def dispose(self, handle):
+        self._util.dispose_resources(handle)
+
+    def is_present(self, handle):
+        # A replugged or replaced device gets a new device number, so sysfs tells without touching the bus
+        if not getattr(handle, "port_numbers", None):
+            return False
+        sysfs_path = f"/sys/bus/usb/devices/{handle.bus}-{'.'.join(str(port) for port in handle.port_numbers)}"
+        try:
+            with open(os.path.join(sysfs_path, "devnum")) as f:
+                devnum = int(f.read())
+            with open(os.path.join(sysfs_path, "idProduct")) as f:
+                id_product = int(f.read(), 16)
+        except (OSError, ValueError):
+            return False
+        return devnum == handle.address and id_product == handle.idProduct
+
+
+_default_backend = None
+
+
+def get_default_backend():
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = PyUsbBackend()
+        trace_path = os.environ.get("G213COLORS_TRACE")
+        if trace_path:
+            import G213Trace
+            _default_backend = G213Trace.RecordingBackend(_default_backend, trace_path)
+    return _default_backend
+
+
+def set_default_backend(backend):
+    """Makes every LogitechDevice created without an explicit backend use backend (e.g. a simulator)."""
+    global _default_backend
+    _default_backend = backend
+
+
+def set_color_pipeline(product_name, pipeline):
+    """Changes the gamma, white balance and brightness correction of product_name (see G213Pipeline)."""
+    G213Pipeline.set_pipeline(product_name, pipeline)
+    build_frame.cache_clear() # Cached frames carry the old correction
+
 class LogitechDevice:
     ID_VENDOR = 0x046d
     USB_BM_REQUEST_TYPE = 0x21
     USB_BM_REQUEST = 0x09
     USB_W_INDEX = 0x0001
+    USB_ENDPOINT_IN = 0x82
 
     PRODUCT_SPECS = {
         "G213": {
@@ -43,53 +146,217 @@ class LogitechDevice:
             "colorCommand": "11ff0c3a{}01{}0200000000000000000000",
             "breatheCommand": "11ff0c3a0002{}{}006400000000000000",
             "cycleCommand": "11ff0c3a0003ffffff0000{}64000000000000",
-            "needs_receive_after_color": True
+            "needs_receive_after_color": True,
+            "minFrameGap": 0.0005 # Seconds between frames; the ack does the real pacing
         },
         "G203": {
             "idProduct": 0xc084, "wValue": 0x0210,
             "colorCommand": "11ff0e3c{}01{}0200000000000000000000",
             "breatheCommand": "11ff0e3c0003{}{}006400000000000000",
             "cycleCommand": "11ff0e3c00020000000000{}64000000000000",
-            "needs_receive_after_color": False
+            "needs_receive_after_color": False,
+            "minFrameGap": 0.01 # No ack to pace on, keep the original fixed gap
         }
     }
     
+    # Placeholders of each command template, in order: (name, width in bytes)
+    COMMAND_FIELDS = {
+        "color": ("colorCommand", (("zone", 1), ("rgb", 3))),
+        "breathe": ("breatheCommand", (("rgb", 3), ("speed", 2))),
+        "cycle": ("cycleCommand", (("speed", 2),)),
+    }
+
+    ACK_TIMEOUT_MS = 100
+    MAX_FRAME_GAP = 0.05
+    CONNECT_ATTEMPTS = 3 # For one-shot applies (apply_commands)
+    CONNECT_RETRY_DELAY = 0.5
+    # Per product gap learned by send_batch: grows when frames fail, decays back to minFrameGap
+    _learned_frame_gaps = {}
+
     # System-wide default config file (for -t option)
     SYSTEM_DEFAULT_CONF_FILE = "/etc/G213Colors.conf"
 
+    # errnos meaning the handle no longer points at a live device (unplugged, hub reset, ...)
+    STALE_ERRNOS = (errno.ENODEV, errno.ENOENT, errno.EIO, errno.ESHUTDOWN)
 
-    def __init__(self, product_name):
+
+    def __init__(self, product_name, unit=None, backend=None):
         if product_name not in self.PRODUCT_SPECS:
             raise ValueError(f"Unsupported product: {product_name}")
         self.product_name = product_name
         self.spec = self.PRODUCT_SPECS[product_name]
+        self.unit = unit # Unit id from find_units(), None means the first matching device
+        self._backend = backend
         self.device = None
         self.is_kernel_driver_detached = False
+        self.is_stale = False # Set when a transfer fails in a way that means the handle is dead
+        self.ack_reader = None # Optional AckReader draining endpoint 0x82 in the background
+        self.metric_labels = (("product", product_name),)
+        self._applying = False # Inside apply_frames, which keeps the state cache up to date itself
+        self._state_forgotten = False # The state cache entry was already dropped for writes outside apply_frames
+        self._device_lock = None # G213Lock.DeviceLock held from connect() to disconnect()
         logger.debug(f"LogitechDevice instance created for {self.product_name}")
 
+    @property
+    def backend(self):
+        return self._backend or get_default_backend()
+
+    def is_connected(self):
+        return self.device is not None and not self.is_stale
+
+    @staticmethod
+    def unit_id_of(usb_device):
+        """Stable id of a physical unit: bus and port path like '1-2.3' (bus:address if ports are unknown)."""
+        port_numbers = getattr(usb_device, "port_numbers", None)
+        if port_numbers:
+            return f"{usb_device.bus}-{'.'.join(str(port) for port in port_numbers)}"
+        return f"{usb_device.bus}:{usb_device.address}"
+
+    @classmethod
+    def find_units(cls, product_name, backend=None):
+        """Enumerates every attached unit of product_name; returns their unit ids in bus order."""
+        backend = backend or get_default_backend()
+        try:
+            devices = cls._enumerate(product_name, backend, "find_units")
+            return sorted(cls.unit_id_of(device) for device in devices)
+        except backend.USBError as e:
+            logger.error(f"USBError enumerating {product_name} units: {e}")
+            return []
+
+    @classmethod
+    def _enumerate(cls, product_name, backend, reason):
+        """Full bus enumeration for product_name; refreshes the discovery cache with every unit found."""
+        started = time.perf_counter()
+        devices = list(backend.find(cls.ID_VENDOR, cls.PRODUCT_SPECS[product_name]["idProduct"], find_all=True))
+        elapsed = time.perf_counter() - started
+        DISCOVERY_CACHE.store_all(backend, product_name, [(cls.unit_id_of(device), device) for device in devices], elapsed)
+        if METRICS.enabled:
+            labels = (("product", product_name),)
+            METRICS.observe("usb_enumeration", elapsed, labels)
+            METRICS.inc("usb_enumerations", labels + (("reason", reason),))
+        return devices
+
+    def _find_usb_device(self, reason="connect"):
+        device = DISCOVERY_CACHE.lookup(self.backend, self.product_name, self.unit)
+        if device is not None:
+            return device
+        devices = self._enumerate(self.product_name, self.backend, reason)
+        if self.unit is None:
+            return devices[0] if devices else None
+        return next((device for device in devices if self.unit_id_of(device) == self.unit), None)
+
+    def resolve_unit(self):
+        """Unit id of the physical unit this instance drives (the first match if unit is None); None if none is attached."""
+        if self.unit is not None:
+            return self.unit
+        device = self.device or self._find_usb_device("resolve_unit")
+        return self.unit_id_of(device) if device is not None else None
+
+    @property
+    def state_identity(self):
+        """State cache key of the physical unit, e.g. 'G213@1-2.3'; None until known."""
+        if self.device is not None:
+            return f"{self.product_name}@{self.unit_id_of(self.device)}"
+        if self.unit is not None:
+            return f"{self.product_name}@{self.unit}"
+        return None
+
+    @property
+    def display_name(self):
+        return self.product_name if self.unit is None else f"{self.product_name}@{self.unit}"
+
+    def _count_error(self, operation, e):
+        if METRICS.enabled:
+            METRICS.inc("usb_errors", self.metric_labels + (("operation", operation), ("errno", str(getattr(e, "errno", None)))))
+
+    def _mark_stale_on_error(self, e):
+        if getattr(e, "errno", None) in self.STALE_ERRNOS:
+            logger.warning(f"Handle for {self.product_name} looks stale (errno {e.errno}).")
+            self.is_stale = True
+            DISCOVERY_CACHE.invalidate(self.product_name, self.unit)
+
+    def _lock_device(self, timeout=G213Lock.DEFAULT_TIMEOUT):
+        """Takes the cross-process lock on the found unit, queueing behind other processes using it."""
+        if self._device_lock is not None and self._device_lock.identity != self.state_identity:
+            self._release_device_lock()
+        if self._device_lock is None:
+            self._device_lock = G213Lock.DeviceLock(self.state_identity)
+        return self._device_lock.acquire(timeout)
+
+    def _release_device_lock(self):
+        if self._device_lock is not None:
+            self._device_lock.release()
+            self._device_lock = None
+
+    def lock_wanted(self):
+        """True if another process is waiting for the unit this device holds."""
+        return self._device_lock is not None and self._device_lock.held and self._device_lock.others_waiting()
+
+    def queue_frames(self, frames, timeout=G213Lock.DEFAULT_TIMEOUT):
+        """Waits for the unit's lock as a one-shot writer of frames, coalescing with other waiting processes.
+
+        Returns the frames to send after connect() (these, or a newer queued request for the
+        same unit), None if a newer request was already applied, or False if the unit was
+        not found or stayed busy for timeout seconds.
+        """
+        try:
+            usb_device = self._find_usb_device()
+        except self.backend.USBError as e:
+            logger.error(f"USBError looking for {self.display_name}: {e}")
+            return False
+        if usb_device is None:
+            logger.error(f"USB device {self.display_name} not found!")
+            return False
+        self._device_lock = G213Lock.DeviceLock(f"{self.product_name}@{self.unit_id_of(usb_device)}")
+        queued = self._device_lock.submit(frames, timeout)
+        if queued is None or queued is False:
+            self._device_lock = None
+            return queued
+        valid = [frame for frame in queued if self.frame_slot(frame) is not None]
+        if len(valid) < len(queued):
+            logger.warning(f"Dropping {len(queued) - len(valid)} unrecognized frame(s) queued for {self.display_name}.")
+        return valid or frames
+
     # ... (connect, disconnect, _send_data, _receive_data methods remain the same as previously proposed) ...
     def connect(self):
-        logger.info(f"Attempting to connect to: {self.product_name}")
+        logger.info(f"Attempting to connect to: {self.display_name}")
+        started = time.perf_counter() if METRICS.enabled else None
         try:
-            self.device = usb.core.find(idVendor=self.ID_VENDOR, idProduct=self.spec["idProduct"])
+            self.device = self._find_usb_device()
+            if started is not None:
+                found = time.perf_counter()
+                METRICS.observe("device_lookup", found - started, self.metric_labels)
             if self.device is None:
-                logger.error(f"USB device {self.product_name} not found!")
+                logger.error(f"USB device {self.display_name} not found!")
+                return False
+            if not self._lock_device():
+                logger.error(f"{self.display_name} stayed busy in another process.")
+                self.device = None
                 return False
 
             if self.device.is_kernel_driver_active(self.USB_W_INDEX):
                 self.device.detach_kernel_driver(self.USB_W_INDEX)
                 self.is_kernel_driver_detached = True
+            self.is_stale = False
+            self._state_forgotten = False
+            if started is not None:
+                METRICS.observe("driver_detach", time.perf_counter() - found, self.metric_labels)
+                METRICS.inc("connects", self.metric_labels)
             logger.info(f"Connected to {self.product_name}")
             return True
-        except usb.core.USBError as e:
+        except self.backend.USBError as e:
             logger.error(f"USBError during connect for {self.product_name}: {e}")
+            self._count_error("connect", e)
+            DISCOVERY_CACHE.invalidate(self.product_name, self.unit)
             if "access" in str(e).lower() or "permission" in str(e).lower():
                 logger.error("This might be a permissions issue. Ensure udev rules are set or run with sufficient privileges if not using the GUI's Polkit method.")
             self.device = None
+            self._release_device_lock()
             return False
         except Exception as e:
             logger.error(f"Unexpected error during connect for {self.product_name}: {e}")
             self.device = None
+            self._release_device_lock()
             return False
 
     def disconnect(self):
@@ -98,76 +365,244 @@ class LogitechDevice:
             return # It's okay if disconnect is called without active device
 
         logger.info(f"Disconnecting from {self.product_name}")
+        self.stop_ack_reader()
+        started = time.perf_counter() if METRICS.enabled else None
         try:
-            usb.util.dispose_resources(self.device)
+            self.backend.dispose(self.device)
             if self.is_kernel_driver_detached:
                 # Re-finding explicitly to attach is safer if device handle got invalidated by dispose.
                 # However, attach_kernel_driver is a method of the device object itself.
-                # For robustness, let's try to re-find, but have a fallback.
+                # The discovery cache usually answers this without another bus enumeration.
                 try:
-                    temp_device_for_attach = usb.core.find(idVendor=self.ID_VENDOR, idProduct=self.spec["idProduct"])
+                    temp_device_for_attach = self._find_usb_device("reattach")
                     if temp_device_for_attach:
                         logger.info(f"Reattaching kernel driver for {self.product_name} (using re-found device instance)")
                         temp_device_for_attach.attach_kernel_driver(self.USB_W_INDEX)
                     else: # Fallback if not re-found (e.g. device unplugged right after dispose)
                          logger.warning(f"Could not re-find {self.product_name} to reattach kernel driver. Attempting with stored device handle.")
                          self.device.attach_kernel_driver(self.USB_W_INDEX) # Try with original handle
-                except usb.core.USBError as attach_err:
+                except self.backend.USBError as attach_err:
                      logger.error(f"USBError reattaching kernel driver (re-find attempt) for {self.product_name}: {attach_err}")
+                     self._count_error("reattach", attach_err)
                 self.is_kernel_driver_detached = False
-        except usb.core.USBError as e:
+                if started is not None:
+                    METRICS.observe("driver_reattach", time.perf_counter() - started, self.metric_labels)
+        except self.backend.USBError as e:
             logger.error(f"USBError during disconnect/reattach for {self.product_name}: {e}")
+            self._count_error("disconnect", e)
         except Exception as e:
             logger.error(f"Unexpected error during disconnect for {self.product_name}: {e}")
         finally:
             self.device = None
+            self.is_stale = False
+            self._release_device_lock() # Only after the reattach, so the next process finds the driver back
 
-    def _send_data(self, data_hex_string):
+    def build_frame(self, mode, *params):
+        """Returns the binary frame for mode ("color", "breathe" or "cycle") with the given parameters."""
+        return build_frame(self.product_name, mode, params)
+
+    def _send_data(self, data):
+        """Sends one frame; data is a binary frame or a hex string as stored in .conf files."""
         if not self.device:
             logger.error(f"Cannot send data to {self.product_name}, device not connected.")
             return False
-        logger.debug(f"Sending data to {self.product_name}: {data_hex_string}")
+        if isinstance(data, str):
+            data = binascii.unhexlify(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Sending data to {self.product_name}: {data.hex()}")
+        if not self._applying and not self._state_forgotten:
+            self.backend.state_cache.invalidate(self.state_identity) # Device state no longer matches what was recorded
+            self._state_forgotten = True
+        started = time.perf_counter() if METRICS.enabled else None
         try:
             self.device.ctrl_transfer(
                 self.USB_BM_REQUEST_TYPE, self.USB_BM_REQUEST,
                 self.spec["wValue"], self.USB_W_INDEX,
-                binascii.unhexlify(data_hex_string)
+                data
             )
+            if started is not None:
+                METRICS.observe("usb_transfer", time.perf_counter() - started, self.metric_labels)
+                METRICS.inc("frames_sent", self.metric_labels)
             return True
-        except usb.core.USBError as e:
+        except self.backend.USBError as e:
             logger.error(f"USBError sending data to {self.product_name}: {e}")
+            self._count_error("send", e)
+            self._mark_stale_on_error(e)
             return False
 
-    def _receive_data(self):
+    def _receive_data(self, timeout=ACK_TIMEOUT_MS):
         if not self.device:
             logger.error(f"Cannot receive data from {self.product_name}, device not connected.")
             return None
+        started = time.perf_counter() if METRICS.enabled else None
         try:
-            data = self.device.read(0x82, 64, timeout=100) 
-            logger.debug(f"Received data from {self.product_name}: {binascii.hexlify(data)}")
+            data = self.device.read(self.USB_ENDPOINT_IN, 64, timeout=timeout)
+            if started is not None:
+                METRICS.observe("ack_wait", time.perf_counter() - started, self.metric_labels)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received data from {self.product_name}: {binascii.hexlify(data)}")
             return data
-        except usb.core.USBError as e:
-            if e.errno == 110:
+        except self.backend.USBError as e:
+            if e.errno == errno.ETIMEDOUT:
                  logger.debug(f"Read from {self.product_name} timed out, this might be normal.")
+                 if started is not None:
+                     METRICS.inc("ack_timeouts", self.metric_labels)
                  return None
             logger.error(f"USBError receiving data from {self.product_name}: {e}")
+            self._count_error("receive", e)
+            self._mark_stale_on_error(e)
             return None
 
+    def start_ack_reader(self):
+        """Starts a background AckReader so sends never block on endpoint reads."""
+        if not self.spec["needs_receive_after_color"] or self.ack_reader is not None:
+            return
+        if not self.device:
+            logger.error(f"Cannot start ack reader for {self.product_name}, device not connected.")
+            return
+        self.ack_reader = AckReader(self)
+        self.ack_reader.start()
+
+    def stop_ack_reader(self):
+        if self.ack_reader is not None:
+            self.ack_reader.stop()
+            self.ack_reader = None
+
+    def _send_expecting_ack(self, frame, callback=None):
+        """Sends frame and returns (sent, future) where future resolves to the ack data or None.
+
+        With an AckReader running the future is resolved in the background; otherwise
+        the ack is read synchronously before returning.
+        """
+        ack_reader = self.ack_reader # Clears itself from another thread when it dies
+        if ack_reader is not None:
+            future = ack_reader.expect(frame, callback)
+            if self._send_data(frame):
+                return True, future
+            ack_reader.discard(future)
+            return False, future
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        if not self._send_data(frame):
+            future.cancel()
+            return False, future
+        future.set_result(self._receive_data())
+        return True, future
+
     def send_color_command(self, color_hex, field=0):
-        command_string = self.spec["colorCommand"].format(str(format(field, '02x')), color_hex)
-        if self._send_data(command_string):
-            if self.spec["needs_receive_after_color"]:
-                self._receive_data()
-            return True
-        return False
+        frame = build_frame(self.product_name, "color", (field, color_hex))
+        if self.spec["needs_receive_after_color"]:
+            return self._send_expecting_ack(frame)[0]
+        return self._send_data(frame)
 
     def send_breathe_command(self, color_hex, speed):
-        command_string = self.spec["breatheCommand"].format(color_hex, str(format(speed, '04x')))
-        return self._send_data(command_string)
+        return self._send_data(build_frame(self.product_name, "breathe", (color_hex, speed)))
 
     def send_cycle_command(self, speed):
-        command_string = self.spec["cycleCommand"].format(str(format(speed, '04x')))
-        return self._send_data(command_string)
+        return self._send_data(build_frame(self.product_name, "cycle", (speed,)))
+
+    def get_frame_gap(self):
+        return self._learned_frame_gaps.get(self.product_name, self.spec["minFrameGap"])
+
+    def _learn_frame_gap(self, ok):
+        minimum = self.spec["minFrameGap"]
+        gap = self.get_frame_gap()
+        if ok:
+            gap = max(minimum, gap * 0.9)
+        else:
+            gap = min(self.MAX_FRAME_GAP, gap * 2 + minimum)
+            logger.debug(f"Frame gap for {self.product_name} raised to {gap * 1000:.2f} ms")
+        self._learned_frame_gaps[self.product_name] = gap
+
+    def send_batch(self, frames, min_gap=None, stop_on_error=True):
+        """Sends frames back to back, paced by the device's ack rather than fixed sleeps.
+
+        frames are binary frames or hex strings. min_gap overrides the learned per-product
+        gap between frame starts. Returns one FrameResult per frame attempted.
+        """
+        needs_ack = self.spec["needs_receive_after_color"]
+        results = []
+        last_start = None
+        for frame in frames:
+            gap = self.get_frame_gap() if min_gap is None else min_gap
+            if last_start is not None:
+                remaining = gap - (time.perf_counter() - last_start)
+                if remaining > 0:
+                    time.sleep(remaining)
+            last_start = time.perf_counter()
+            acked = False
+            if needs_ack:
+                if isinstance(frame, str):
+                    frame = binascii.unhexlify(frame)
+                sent, future = self._send_expecting_ack(frame)
+                acked = sent and self._wait_for_ack(future)
+            else:
+                sent = self._send_data(frame)
+            ok = sent and (acked or not needs_ack)
+            if min_gap is None:
+                self._learn_frame_gap(ok)
+            results.append(FrameResult(frame, sent, acked, time.perf_counter() - last_start))
+            if not sent and stop_on_error:
+                break
+        return results
+
+    def _wait_for_ack(self, future):
+        """True if future resolved to an ack; gives up after ACK_TIMEOUT_MS, e.g. when the ack reader died."""
+        try:
+            return future.result(timeout=self.ACK_TIMEOUT_MS / 1000) is not None
+        except FutureTimeoutError:
+            ack_reader = self.ack_reader
+            if ack_reader is not None:
+                ack_reader.discard(future)
+            if METRICS.enabled:
+                METRICS.inc("ack_timeouts", self.metric_labels)
+            return False
+
+    def frame_slot(self, frame):
+        """State cache slot a frame sets: its zone, 0 for whole-device commands, None if unrecognised."""
+        for mode in ("color", "breathe", "cycle"):
+            template = get_frame_template(self.product_name, mode)
+            if template.matches(frame):
+                return template.fields(frame)["zone"][0] if mode == "color" else 0
+        return None
+
+    def is_applied(self, frames):
+        """True if the state cache says frames are already on the unit; needs no connection if unit is set."""
+        return self.state_identity is not None and not self.backend.state_cache.plan(self.state_identity, frames, self.frame_slot)[0]
+
+    def apply_frames(self, frames, force=False):
+        """Sends the frames that differ from the last applied state (all of them with force); True only if every one was sent."""
+        identity = self.state_identity
+        state_cache = self.backend.state_cache
+        to_send, slots = state_cache.plan(identity, frames, self.frame_slot, force)
+        if METRICS.enabled and len(to_send) < len(frames):
+            METRICS.inc("frames_skipped", self.metric_labels, len(frames) - len(to_send))
+        if not to_send:
+            logger.debug(f"{self.display_name} already shows these settings, nothing to send.")
+            return True
+        self._applying = True
+        try:
+            results = self.send_batch(to_send)
+        finally:
+            self._applying = False
+        ok = len(results) == len(to_send) and all(result.sent for result in results)
+        state_cache.record(identity, slots if ok else {})
+        self._state_forgotten = not ok
+        if ok and slots and self.backend.hardware:
+            self._update_replay_blob([bytes.fromhex(slots[slot]) for slot in sorted(slots)])
+        return ok
+
+    def _update_replay_blob(self, frames):
+        """Leaves the unit's full frame set where g213colors-replay finds it after a resume."""
+        port_numbers = getattr(self.device, "port_numbers", None)
+        if not port_numbers:
+            return # Without a port path the unit cannot be found again reliably
+        G213Replay.update_blob({
+            "idVendor": self.ID_VENDOR, "idProduct": self.spec["idProduct"], "wValue": self.spec["wValue"],
+            "needs_ack": self.spec["needs_receive_after_color"], "bus": self.device.bus, "ports": tuple(port_numbers),
+            "gap": self.spec["minFrameGap"], "frames": frames,
+        })
 
     def save_configuration(self, command_data_string, file_path):
         """Saves the product name and provided command string(s) to the specified file path."""
@@ -190,55 +625,89 @@ class LogitechDevice:
                 logger.error("This is a permission error. Ensure the application has rights to write to this file.")
             return False
 
+    @staticmethod
+    def read_configuration(conf_file_path):
+        """Returns (product_name, [hex command lines]) from a .conf file; ValueError if it is malformed."""
+        with open(conf_file_path, "r") as file:
+            first_line = file.readline().strip()
+            if not first_line.startswith("PRODUCT="):
+                raise ValueError(f"Invalid config file format in {conf_file_path}. Missing PRODUCT line.")
+            product_name = first_line.split("=", 1)[1]
+            return product_name, [line.strip() for line in file if line.strip()]
+
     @classmethod
-    def apply_configuration_from_file(cls, conf_file_path):
-        """Loads configuration from a file, determines product, and applies settings."""
+    def apply_configuration_from_file(cls, conf_file_path, unit=None, force=False):
+        """Loads configuration from a file, determines product, and applies settings.
+
+        Frames the device already shows (per the state cache) are skipped unless force is set.
+        """
+        started = time.perf_counter() if METRICS.enabled else None
+        success = cls._apply_configuration_from_file(conf_file_path, unit, force)
+        if started is not None:
+            METRICS.observe("config_apply", time.perf_counter() - started)
+            METRICS.inc("config_applies", (("result", "ok" if success else "failed"),))
+        return success
+
+    @classmethod
+    def apply_commands(cls, product_name, commands, unit=None, force=False, source="profile"):
+        """Connects, applies commands (binary frames or hex strings) and disconnects; source is only for logging."""
+        device_instance = cls(product_name, unit) # Create instance of the correct product
+        if not force and device_instance.is_applied(commands):
+            logger.info(f"{device_instance.display_name} already shows the settings from {source}.")
+            return True
+
+        commands = [bytes.fromhex(command) if isinstance(command, str) else bytes(command) for command in commands]
+        connected = False
+        for attempt in range(cls.CONNECT_ATTEMPTS):
+            if attempt:
+                time.sleep(cls.CONNECT_RETRY_DELAY)
+            queued = device_instance.queue_frames(commands) # Other processes writing this unit go first
+            if queued is None:
+                return True # Superseded by a newer request, which has been applied
+            if queued is False:
+                break
+            commands = queued
+            device_lock = device_instance._device_lock
+            connected = device_instance.connect()
+            if connected:
+                break
+            # Possibly another process's newer request: keep it pending for the next try or the next writer
+            device_lock.requeue(commands)
+            device_instance._release_device_lock()
+        if not connected:
+            device_instance._release_device_lock()
+            logger.error(f"Could not connect to {product_name} to apply settings.")
+            return False
+
+        logger.info(f"Applying {len(commands)} command(s) to {product_name}...")
+        success = device_instance.apply_frames(commands, force)
+        if not success:
+            logger.error(f"Failed to send commands to {product_name}")
+
+        device_instance.disconnect()
+        if success:
+            logger.info(f"Finished applying settings from {source} for {product_name}.")
+        else:
+            logger.warning(f"Settings from {source} for {product_name} were partially applied due to errors.")
+        return success
+
+    @classmethod
+    def _apply_configuration_from_file(cls, conf_file_path, unit, force):
         logger.info(f"Attempting to apply settings from configuration file: {conf_file_path}")
         try:
-            with open(conf_file_path, "r") as file:
-                first_line = file.readline().strip()
-                if not first_line.startswith("PRODUCT="):
-                    logger.error(f"Invalid config file format in {conf_file_path}. Missing PRODUCT line.")
-                    return False
-                
-                product_name_from_file = first_line.split("=", 1)[1]
-                logger.info(f"Product identified in config file: {product_name_from_file}")
-
-                commands_to_apply = [line.strip() for line in file if line.strip()]
+            product_name_from_file, commands_to_apply = cls.read_configuration(conf_file_path)
+            logger.info(f"Product identified in config file: {product_name_from_file}")
 
             if not commands_to_apply:
                 logger.warning(f"No commands found in {conf_file_path} for product {product_name_from_file}.")
                 return True # No commands to apply, but not an error per se
 
-            device_instance = cls(product_name_from_file) # Create instance of the correct product
-            
-            if not device_instance.connect():
-                logger.error(f"Could not connect to {product_name_from_file} to apply settings.")
-                return False
-
-            logger.info(f"Applying {len(commands_to_apply)} command(s) to {product_name_from_file}...")
-            success = True
-            for cmd_data in commands_to_apply:
-                if device_instance._send_data(cmd_data):
-                    if device_instance.spec["needs_receive_after_color"]:
-                         device_instance._receive_data()
-                    time.sleep(0.01) # Original sleep
-                else:
-                    logger.error(f"Failed to send command: {cmd_data} to {product_name_from_file}")
-                    success = False
-                    break # Stop on first error
-            
-            device_instance.disconnect()
-            if success:
-                logger.info(f"Finished applying settings from {conf_file_path} for {product_name_from_file}.")
-            else:
-                logger.warning(f"Settings from {conf_file_path} for {product_name_from_file} were partially applied due to errors.")
-            return success
+            return cls.apply_commands(product_name_from_file, commands_to_apply, unit, force, conf_file_path)
 
         except FileNotFoundError:
             logger.warning(f"Configuration file {conf_file_path} not found. Cannot apply settings.")
             return False # Indicate failure to apply
-        except ValueError as e: # Catches unsupported product from cls(product_name_from_file)
+        except ValueError as e: # Bad format, or unsupported product from cls(product_name_from_file)
             logger.error(f"Error processing configuration file {conf_file_path}: {e}")
             return False
         except (IOError, PermissionError) as e:
@@ -247,3 +716,343 @@ class LogitechDevice:
         except Exception as e: # Catch any other unexpected errors
             logger.error(f"Unexpected error applying settings from file {conf_file_path}: {e}")
             return False
+
+
+# Outcome of one frame sent by LogitechDevice.send_batch; latency is in seconds
+FrameResult = namedtuple("FrameResult", ["frame", "sent", "acked", "latency"])
+
+# Outcome of applying frames to one product or unit; elapsed is in seconds
+ApplyResult = namedtuple("ApplyResult", ["product_name", "ok", "elapsed", "error"])
+
+
+class FrameTemplate:
+    """A hex command template from PRODUCT_SPECS compiled once into a fixed-layout binary frame.
+
+    Placeholders become (offset, width) slots that fill() writes into a copy of the
+    preallocated base frame, so building a frame needs no string formatting.
+    """
+
+    def __init__(self, template, fields):
+        parts = template.split("{}")
+        if len(parts) != len(fields) + 1:
+            raise ValueError(f"Template {template} does not match fields {fields}")
+        base = bytearray()
+        self.slots = [] # (name, offset, width)
+        for part, (name, width) in zip(parts, fields):
+            base += binascii.unhexlify(part)
+            self.slots.append((name, len(base), width))
+            base += bytes(width)
+        base += binascii.unhexlify(parts[-1])
+        self.base = bytes(base)
+
+    def matches(self, frame):
+        """True if frame has this template's length and fixed bytes, whatever its field values."""
+        if len(frame) != len(self.base):
+            return False
+        position = 0
+        for _, offset, width in self.slots:
+            if frame[position:offset] != self.base[position:offset]:
+                return False
+            position = offset + width
+        return frame[position:] == self.base[position:]
+
+    def fields(self, frame):
+        """Returns {name: bytes} of the field values in a frame that matches this template."""
+        return {name: bytes(frame[offset:offset + width]) for name, offset, width in self.slots}
+
+    def fill(self, *values):
+        frame = bytearray(self.base)
+        for (name, offset, width), value in zip(self.slots, values):
+            if name == "rgb":
+                rgb = bytes.fromhex(value) if isinstance(value, str) else bytes(value)
+                if len(rgb) != width:
+                    raise ValueError(f"Invalid RGB value: {value!r}")
+                frame[offset:offset + width] = rgb
+            elif width == 1:
+                frame[offset] = value
+            else:
+                struct.pack_into(">H", frame, offset, value)
+        return bytes(frame)
+
+
+_compiled_templates = {} # (product_name, mode) -> FrameTemplate
+
+
+def get_frame_template(product_name, mode):
+    """Returns the compiled FrameTemplate for product_name/mode, compiling it on first use."""
+    key = (product_name, mode)
+    template = _compiled_templates.get(key)
+    if template is None:
+        spec_key, fields = LogitechDevice.COMMAND_FIELDS[mode]
+        template = FrameTemplate(LogitechDevice.PRODUCT_SPECS[product_name][spec_key], fields)
+        _compiled_templates[key] = template
+    return template
+
+
+@functools.lru_cache(maxsize=512)
+def build_frame(product_name, mode, params):
+    """Returns the finished binary frame for (product, mode, params), memoized in a bounded LRU cache.
+
+    RGB parameters are screen colors; they go through the product's color pipeline here.
+    """
+    template = get_frame_template(product_name, mode)
+    pipeline = G213Pipeline.pipeline_for(product_name)
+    if not pipeline.identity:
+        params = tuple(
+            pipeline.apply(value) if name == "rgb" else value
+            for (name, _, _), value in zip(template.slots, params)
+        )
+    try:
+        return template.fill(*params)
+    except (struct.error, OverflowError) as e:
+        raise ValueError(f"Invalid parameters {params} for {product_name} {mode} command: {e}")
+
+
+class AckReader(threading.Thread):
+    """Continuously drains a device's interrupt endpoint and matches replies to sent commands.
+
+    Replies land in a bounded ring buffer and resolve the Future of the oldest outstanding
+    command with the same header; a reply matching none is only counted. Commands whose
+    reply does not arrive within ack_timeout resolve to None and are counted as lost, and
+    so does everything outstanding once the reader stops, e.g. after a USB error.
+    """
+    RING_SIZE = 64
+    READ_TIMEOUT_MS = 50
+
+    def __init__(self, owner, ack_timeout=LogitechDevice.ACK_TIMEOUT_MS / 1000):
+        super().__init__(name=f"AckReader-{owner.product_name}", daemon=True)
+        self.owner = owner
+        self.handle = owner.device
+        self.ack_timeout = ack_timeout
+        self.replies = deque(maxlen=self.RING_SIZE)
+        self.acks_received = 0
+        self.acks_lost = 0
+        self.unmatched_replies = 0
+        self._pending = deque() # (header, future, deadline)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._closed = False # Set once run() has ended; no reply will be read any more
+
+    def expect(self, frame, callback=None):
+        """Registers an outstanding command; call before sending so a fast reply is not missed."""
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        with self._lock:
+            if not self._closed:
+                self._pending.append((bytes(frame[:4]), future, time.monotonic() + self.ack_timeout))
+                return future
+        self.acks_lost += 1
+        future.set_result(None)
+        return future
+
+    def discard(self, future):
+        with self._lock:
+            self._pending = deque(entry for entry in self._pending if entry[1] is not future)
+        future.cancel()
+
+    def stats(self):
+        return {
+            "acks_received": self.acks_received,
+            "acks_lost": self.acks_lost,
+            "unmatched_replies": self.unmatched_replies,
+            "outstanding": len(self._pending),
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self._fail_pending()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    data = self.handle.read(LogitechDevice.USB_ENDPOINT_IN, 64, timeout=self.READ_TIMEOUT_MS)
+                except self.owner.backend.USBError as e:
+                    if e.errno != errno.ETIMEDOUT:
+                        logger.error(f"Ack reader for {self.owner.product_name} stopping: {e}")
+                        self.owner._mark_stale_on_error(e)
+                        break
+                else:
+                    self.replies.append(bytes(data))
+                    self._resolve(bytes(data))
+                self._expire()
+        finally:
+            with self._lock:
+                self._closed = True
+            if self.owner.ack_reader is self:
+                self.owner.ack_reader = None # Later sends read their acks synchronously
+            self._fail_pending()
+
+    def _resolve(self, data):
+        with self._lock:
+            match = next((entry for entry in self._pending if entry[0] == data[:4]), None)
+            if match is not None:
+                self._pending.remove(match)
+        if match is None:
+            self.unmatched_replies += 1
+            return
+        self.acks_received += 1
+        if METRICS.enabled:
+            METRICS.observe("ack_wait", time.monotonic() - (match[2] - self.ack_timeout), self.owner.metric_labels)
+        self._settle(match[1], data)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._pending and self._pending[0][2] <= now:
+                expired.append(self._pending.popleft())
+        for _, future, _ in expired:
+            self.acks_lost += 1
+            if METRICS.enabled:
+                METRICS.inc("ack_timeouts", self.owner.metric_labels)
+            logger.debug(f"Ack for {self.owner.product_name} command lost after {self.ack_timeout * 1000:.0f} ms")
+            self._settle(future, None)
+
+    def _fail_pending(self):
+        with self._lock:
+            pending, self._pending = list(self._pending), deque()
+        for _, future, _ in pending:
+            if not future.done():
+                self.acks_lost += 1
+                self._settle(future, None)
+
+    @staticmethod
+    def _settle(future, data):
+        try:
+            future.set_result(data)
+        except InvalidStateError:
+            pass # The sender gave up on it meanwhile (see discard)
+
+
+class DevicePool:
+    """Keeps one open LogitechDevice per product (and unit) so repeated commands skip connect/disconnect.
+
+    A handle is closed (and the kernel driver reattached) once it has been idle for
+    idle_timeout seconds, and reopened transparently if it went stale. An open handle
+    holds the unit's cross-process lock, so it is closed as soon as it is released, or
+    within YIELD_CHECK_INTERVAL while idle, if another process is waiting for the unit.
+    """
+    DEFAULT_IDLE_TIMEOUT = 5.0
+    YIELD_CHECK_INTERVAL = 0.2
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, device_class=LogitechDevice, ack_reader=False):
+        self.idle_timeout = idle_timeout
+        self.device_class = device_class
+        self.ack_reader = ack_reader # Start an AckReader on every handle the pool opens
+        self._entries = {} # (product_name, unit) -> _PoolEntry
+        self._entries_lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def _entry(self, key):
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PoolEntry(self.device_class(*key))
+                self._entries[key] = entry
+            return entry
+
+    def acquire(self, product_name, unit=None):
+        """Returns a connected device for product_name/unit (holding its lock), or None on failure."""
+        entry = self._entry((product_name, unit))
+        entry.lock.acquire()
+        entry.holds += 1
+        entry.cancel_idle_timer()
+        device = entry.device
+        if device.is_stale:
+            logger.info(f"Reopening stale handle for {device.display_name}")
+            device.disconnect()
+        if not device.is_connected():
+            if not device.connect():
+                entry.holds -= 1
+                entry.lock.release()
+                return None
+            if self.ack_reader:
+                device.start_ack_reader()
+        return device
+
+    def release(self, product_name, unit=None):
+        key = (product_name, unit)
+        entry = self._entries[key]
+        entry.holds -= 1
+        if entry.holds == 0 and entry.device.lock_wanted():
+            logger.debug(f"Another process is waiting for {entry.device.display_name}, closing it now.")
+            entry.device.disconnect()
+        elif entry.holds == 0:
+            entry.idle_since = time.monotonic()
+            entry.start_idle_timer(min(self.idle_timeout, self.YIELD_CHECK_INTERVAL), self._check_idle, key)
+        entry.lock.release()
+
+    @contextmanager
+    def session(self, product_name, unit=None):
+        """Context manager yielding a connected device, or None if it could not be opened."""
+        device = self.acquire(product_name, unit)
+        try:
+            yield device
+        finally:
+            if device is not None:
+                self.release(product_name, unit)
+
+    def call(self, product_name, func, unit=None):
+        """Runs func(device) and retries once on a fresh handle if the first attempt hit a stale one."""
+        for attempt in range(2):
+            with self.session(product_name, unit) as device:
+                if device is None:
+                    return False
+                result = func(device)
+                if result or not device.is_stale:
+                    return result
+            logger.info(f"Retrying command for {device.display_name} on a reopened handle (attempt {attempt + 2}).")
+        return result
+
+    def _check_idle(self, key):
+        entry = self._entries.get(key)
+        if entry is None or not entry.lock.acquire(blocking=False):
+            return # In use again, whoever holds it will rearm the timer
+        try:
+            device = entry.device
+            if device.device is None:
+                return
+            idle = time.monotonic() - entry.idle_since
+            if idle >= self.idle_timeout or device.lock_wanted():
+                logger.debug(f"Closing idle handle for {device.display_name}")
+                device.disconnect()
+            else:
+                entry.start_idle_timer(min(self.idle_timeout - idle, self.YIELD_CHECK_INTERVAL), self._check_idle, key)
+        finally:
+            entry.lock.release()
+
+    def close(self, product_name, unit=None):
+        entry = self._entries.get((product_name, unit))
+        if entry is None:
+            return
+        with entry.lock:
+            entry.cancel_idle_timer()
+            entry.device.disconnect()
+
+    def close_all(self):
+        for key in list(self._entries):
+            self.close(*key)
+
+
+class _PoolEntry:
+    def __init__(self, device):
+        self.device = device
+        self.lock = threading.RLock()
+        self.holds = 0 # Nested acquire()s; the handle is only given up once the outermost is released
+        self.idle_since = None
+        self.idle_timer = None
+
+    def cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def start_idle_timer(self, timeout, callback, key):
+        self.cancel_idle_timer()
+        self.idle_timer = threading.Timer(timeout, callback, args=(key,))
+        self.idle_timer.daemon = True
+        self.idle_timer.start()
@@ -0,0 +1,227 @@
+'''
+  *  Layered lighting compositor for G213Colors.
+  *
+  *  Keeps the lighting of one unit as priority layers held in memory: the base profile
+  *  (PRIORITY_BASE), scheduled profiles (PRIORITY_SCHEDULE) and transient overlays
+  *  such as a build failure or pager alert flash (PRIORITY_OVERLAY), which may carry a
+  *  TTL. Every change recomputes the effective per-zone colors and writes only the
+  *  zones that differ from what the unit shows; when an overlay expires the layers
+  *  below it are restored from memory in one batch, with no file I/O or parsing.
+  *
+  *  Layers are lists of frames as everywhere else (build_frame, profiles, .conf lines).
+  *  A whole-device color counts as that color on every zone. A breathe or cycle layer
+  *  covers the whole device; once a higher layer sets some zones it cannot be shown in
+  *  part, so those zones show their own colors and the rest show what lies below it.
+'''
+
+import logging
+import threading
+import time
+
+import G213Colors
+from G213Animation import PRODUCT_ZONES
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_BASE = 0
+PRIORITY_SCHEDULE = 50
+PRIORITY_OVERLAY = 100
+BASE_LAYER = "base"
+SCHEDULE_LAYER = "schedule"
+
+
+class Layer:
+    """One layer's frames folded the way the device applies them: a mode frame or {zone: color frame}."""
+
+    def __init__(self, product_name, name, frames, priority, expires=None, sequence=0):
+        self.name = name
+        self.priority = priority
+        self.expires = expires # time.monotonic() deadline, None while it stays
+        self.sequence = sequence # Among equal priorities the newest layer is on top
+        self.mode, self.colors = split_frames(product_name, frames)
+
+    def describe(self, now):
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "ttl": None if self.expires is None else max(0.0, self.expires - now),
+            "mode": self.mode.hex() if self.mode is not None else None,
+            "zones": {zone: frame.hex() for zone, frame in sorted(self.colors.items())},
+        }
+
+
+def split_frames(product_name, frames):
+    """Returns (mode frame or None, {zone: color frame}) left on the unit after sending frames in order."""
+    zones = PRODUCT_ZONES[product_name]
+    template = G213Colors.get_frame_template(product_name, "color")
+    mode, colors = None, {}
+    for frame in frames:
+        frame = bytes.fromhex(frame) if isinstance(frame, str) else bytes(frame)
+        if not template.matches(frame):
+            mode, colors = frame, {} # Breathe, cycle or anything unknown replaces the whole device state
+            continue
+        fields = template.fields(frame)
+        mode = None
+        if fields["zone"][0] == 0 and zones != (0,):
+            for zone in zones:
+                colors[zone] = template.fill(zone, fields["rgb"])
+        else:
+            colors[fields["zone"][0]] = frame
+    return mode, colors
+
+
+class Compositor:
+    """Priority layers of one unit and what the unit currently shows.
+
+    write_func(frames) sends frames to the unit and returns True if all were sent; by
+    default they go through pool (a DevicePool, created if not given).
+    """
+
+    def __init__(self, product_name, unit=None, write_func=None, pool=None):
+        self.product_name = product_name
+        self.unit = unit
+        self.zones = PRODUCT_ZONES[product_name]
+        if write_func is None:
+            self.pool = pool or G213Colors.DevicePool()
+            write_func = self._write_through_pool
+        self.write_func = write_func
+        self.metric_labels = (("product", product_name),)
+        self._layers = {} # name -> Layer
+        self._sequence = 0
+        self._shown_mode = None
+        self._shown = {} # zone -> color frame on the unit; None/{} means unknown
+        self._lock = threading.RLock()
+        self._timer = None
+        self.frames_written = 0
+
+    def _write_through_pool(self, frames):
+        def send(device):
+            results = device.send_batch(frames)
+            return len(results) == len(frames) and all(result.sent for result in results)
+        return self.pool.call(self.product_name, send, self.unit)
+
+    def set_layer(self, name, frames, priority=PRIORITY_OVERLAY, ttl=None):
+        """Adds or replaces a layer and updates the unit; a layer with ttl removes itself after ttl seconds."""
+        with self._lock:
+            self._sequence += 1
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._layers[name] = Layer(self.product_name, name, frames, priority, expires, self._sequence)
+            if expires is not None:
+                self._arm_timer()
+            return self._update("set")
+
+    def remove_layer(self, name):
+        """Drops a layer and restores what it covered; True if the unit was updated (or nothing changed)."""
+        with self._lock:
+            if self._layers.pop(name, None) is None:
+                return True
+            return self._update("remove")
+
+    def assume_shown(self, frames):
+        """Tells the compositor the unit now shows frames, written by someone else (e.g. apply_frames)."""
+        with self._lock:
+            self._shown_mode, self._shown = split_frames(self.product_name, frames)
+
+    def redraw(self):
+        """Rewrites the whole effective state, e.g. after a replug or resume."""
+        with self._lock:
+            self._shown_mode, self._shown = None, {}
+            return self._update("redraw")
+
+    def has_overlays(self):
+        with self._lock:
+            return any(layer.priority >= PRIORITY_OVERLAY for layer in self._layers.values())
+
+    def layers(self):
+        """The layers from top to bottom as dicts, for state reports."""
+        now = time.monotonic()
+        with self._lock:
+            return [layer.describe(now) for layer in self._stack()]
+
+    def _stack(self):
+        return sorted(self._layers.values(), key=lambda layer: (layer.priority, layer.sequence), reverse=True)
+
+    def effective(self):
+        """(mode frame or None, {zone: color frame}) the layers add up to."""
+        with self._lock:
+            colors = {}
+            for layer in self._stack():
+                if layer.mode is not None:
+                    if not colors:
+                        return layer.mode, {}
+                    continue # Shadowed in part by a higher layer; the zones left show what is below
+                for zone, frame in layer.colors.items():
+                    colors.setdefault(zone, frame)
+                if len(colors) == len(self.zones):
+                    break
+            return None, colors
+
+    def _delta(self, mode, colors):
+        if mode is not None:
+            return [] if self._shown_mode == mode else [mode]
+        changed = [frame for zone, frame in sorted(colors.items()) if self._shown_mode is not None or self._shown.get(zone) != frame]
+        if len(changed) > 1 and len(colors) == len(self.zones) and self.zones != (0,):
+            # Every zone the same color: one whole-device frame instead of one per zone
+            template = G213Colors.get_frame_template(self.product_name, "color")
+            rgbs = {template.fields(frame)["rgb"] for frame in colors.values()}
+            if len(rgbs) == 1:
+                return [template.fill(0, rgbs.pop())]
+        return changed
+
+    def _update(self, reason):
+        started = time.perf_counter()
+        mode, colors = self.effective()
+        frames = self._delta(mode, colors)
+        if METRICS.enabled:
+            METRICS.inc("compositor_updates", self.metric_labels + (("reason", reason),))
+        if not frames:
+            return True
+        ok = bool(self.write_func(frames))
+        if ok:
+            self.frames_written += len(frames)
+            self._shown_mode = mode
+            self._shown = dict(colors) if mode is None else {}
+        else:
+            logger.error(f"Compositor could not write {len(frames)} frame(s) to {self.product_name}.")
+            self._shown_mode, self._shown = None, {} # Unknown now, the next update writes everything
+        if METRICS.enabled:
+            METRICS.inc("compositor_frames", self.metric_labels, len(frames))
+            METRICS.observe("compositor_update", time.perf_counter() - started, self.metric_labels)
+        logger.debug(f"Compositor {reason} on {self.product_name}: {len(frames)} frame(s), ok={ok}")
+        return ok
+
+    def _arm_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        deadlines = [layer.expires for layer in self._layers.values() if layer.expires is not None]
+        if not deadlines:
+            return
+        self._timer = threading.Timer(max(0.0, min(deadlines) - time.monotonic()), self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        with self._lock:
+            now = time.monotonic()
+            expired = [name for name, layer in self._layers.items() if layer.expires is not None and layer.expires <= now]
+            for name in expired:
+                del self._layers[name]
+            if expired:
+                logger.info(f"Overlay {', '.join(expired)} on {self.product_name} expired, restoring.")
+                self._update("expire")
+            self._arm_timer()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+def flash_frames(product_name, color, zones=None):
+    """Frames of a flash overlay: color on the given zones (default: the whole device)."""
+    if not zones:
+        return [G213Colors.build_frame(product_name, "color", (0, color))]
+    return [G213Colors.build_frame(product_name, "color", (zone, color)) for zone in zones]
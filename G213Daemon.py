@@ -0,0 +1,661 @@
+'''
+  *  Resident lighting daemon for G213Colors.
+  *
+  *  Owns the device handles (through a DevicePool) and serves newline-delimited JSON
+  *  requests on a Unix socket, so a color change costs one socket round trip plus the
+  *  USB write instead of a process start, a bus enumeration and a driver detach.
+  *
+  *  Request:  {"op": "set_color", "product": "G213", "color": "ff0000", "zone": 0}
+  *  Response: {"ok": true, ...} or {"ok": false, "error": "..."}
+  *
+  *  Ops: ping, apply_profile, apply_frames, set_color, set_breathe, set_cycle,
+  *  set_segments, start_animation, stop_animation, overlay, clear_overlay, preview,
+  *  state, metrics, shutdown. apply_profile only reads files in ~/.config/G213Colors (of the
+  *  user running the daemon); clients send anything else as frames with apply_frames.
+  *
+  *  overlay shows a transient layer (e.g. a build failure flash) above the current
+  *  lighting for "ttl" seconds; a G213Compositor then restores what was below it from
+  *  memory, writing only the zones that change. start_animation runs an effect the
+  *  device can do by itself (a single-color pulse, a full-spectrum rotation, ...) as
+  *  a hardware breathe or cycle instead; see G213Offload. preview streams a GUI's live
+  *  preview through the daemon's handles (newest frames win, nothing is recorded).
+  *
+  *  Unless disabled, a G213Hotplug watcher runs alongside and restores a unit's
+  *  lighting as soon as it is plugged back in, and the rules of
+  *  ~/.config/G213Colors/schedule.conf (see G213Schedule) are applied when due.
+  *  With ingest, colors streamed over a FIFO or UDP (see G213Ingest) are written
+  *  through the same handles.
+'''
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+import G213Colors
+import G213Compositor
+import G213Lock
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SOCKET_ENV = "G213COLORS_SOCKET"
+SOCKET_NAME = "g213colors.sock"
+CLIENT_TIMEOUT = G213Lock.DEFAULT_TIMEOUT + 5.0 # A request may queue for a device lock that long
+PING_TIMEOUT = 2.0
+DEFAULT_OVERLAY_TTL = 5.0
+
+
+def default_socket_path():
+    """$G213COLORS_SOCKET, else $XDG_RUNTIME_DIR/g213colors.sock (/run/g213colors.sock for root)."""
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    if os.geteuid() == 0:
+        return os.path.join("/run", SOCKET_NAME)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+class DaemonError(Exception):
+    """A request the daemon rejected; the message is sent back to the client."""
+
+
+class DaemonUnavailable(ConnectionError):
+    """No daemon took the request (nothing listens on the socket, or it went away before answering).
+
+    Only then may a client open the devices itself; any other error means the daemon may
+    still be applying the request.
+    """
+
+
+class LightingDaemon:
+    """Request handlers and device state; transport-independent so it can be driven directly."""
+
+    def __init__(self, pool=None):
+        self.pool = pool or G213Colors.DevicePool(ack_reader=True)
+        self.state = {} # (product, unit) -> {"frames": [hex], "animation": name or None}
+        self.animations = {} # (product, unit) -> (Animator, Thread)
+        self.compositors = {} # (product, unit) -> Compositor, while overlays are in use
+        self.preview_writer = None # G213Async.LatestWinsWriter, started by the first preview
+        self._lock = threading.Lock()
+        self.handlers = {
+            "ping": self.op_ping,
+            "apply_profile": self.op_apply_profile,
+            "apply_frames": self.op_apply_frames,
+            "set_color": self.op_set_color,
+            "set_breathe": self.op_set_breathe,
+            "set_cycle": self.op_set_cycle,
+            "set_segments": self.op_set_segments,
+            "start_animation": self.op_start_animation,
+            "stop_animation": self.op_stop_animation,
+            "overlay": self.op_overlay,
+            "clear_overlay": self.op_clear_overlay,
+            "preview": self.op_preview,
+            "state": self.op_state,
+            "metrics": self.op_metrics,
+        }
+
+    def handle(self, request):
+        """Dispatches one decoded request; always returns a response dict."""
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "A request must be a JSON object"}
+        op = request.get("op")
+        handler = self.handlers.get(op)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown op: {op}"}
+        try:
+            response = handler(request) or {}
+        except DaemonError as e:
+            return {"ok": False, "error": str(e)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {"ok": False, "error": f"Bad request for {op}: {e}"}
+        except OSError as e:
+            return {"ok": False, "error": f"{op} failed: {e}"}
+        except Exception as e:
+            logger.exception(f"Unexpected error handling {op}")
+            return {"ok": False, "error": f"{op} failed: {e}"}
+        response["ok"] = True
+        return response
+
+    @staticmethod
+    def _profile_path(path):
+        """path resolved, if it lies in the profile directory; the daemon reads no other files for its clients."""
+        directory = os.path.realpath(G213Colors.USER_CONFIG_DIR)
+        resolved = os.path.realpath(path)
+        if os.path.commonpath([resolved, directory]) != directory:
+            raise DaemonError(f"{path} is outside {G213Colors.USER_CONFIG_DIR}; send its frames with apply_frames instead")
+        return resolved
+
+    def _target(self, request):
+        product = request["product"]
+        if product not in G213Colors.LogitechDevice.PRODUCT_SPECS:
+            raise DaemonError(f"Unsupported product: {product}")
+        return product, self._canonical_unit(product, request.get("unit"))
+
+    def _canonical_unit(self, product, unit):
+        """The unit key this daemon already drives the physical unit under, so it gets one pool entry and one state.
+
+        Requests without a unit are kept under None; a unit id that names the unit the
+        product-wide entry resolves to is folded into it.
+        """
+        if unit is None:
+            return None
+        key, product_key = (product, unit), (product, None)
+        with self._lock:
+            tables = (self.state, self.compositors, self.animations)
+            if any(key in table for table in tables) or not any(product_key in table for table in tables):
+                return unit
+        return None if self.pool.device_class(product).resolve_unit() == unit else unit
+
+    def _apply(self, product, unit, frames, force=False, layer=G213Compositor.BASE_LAYER):
+        key = (product, unit)
+        self._stop_animation(key)
+        with self._lock:
+            compositor = self.compositors.get(key)
+            preview_writer = self.preview_writer
+        if preview_writer is not None:
+            preview_writer.discard(product) # A preview frame still queued must not land after these
+        if compositor is not None and compositor.has_overlays():
+            # Goes under the overlay: only the zones it leaves free change now, the rest when it expires
+            if layer == G213Compositor.BASE_LAYER:
+                compositor.remove_layer(G213Compositor.SCHEDULE_LAYER)
+            priority = G213Compositor.PRIORITY_SCHEDULE if layer == G213Compositor.SCHEDULE_LAYER else G213Compositor.PRIORITY_BASE
+            ok = compositor.set_layer(layer, frames, priority)
+        else:
+            self._drop_compositor(key) # Seeded again from self.state by the next overlay
+            ok = self.pool.call(product, lambda device: device.apply_frames(frames, force), unit)
+        if not ok:
+            raise DaemonError(f"Could not write to {product}" + (f"@{unit}" if unit else ""))
+        with self._lock:
+            self.state[(product, unit)] = {
+                "frames": [frame if isinstance(frame, str) else frame.hex() for frame in frames],
+                "animation": None,
+            }
+        return {"frames": len(frames)}
+
+    def _compositor(self, product, unit):
+        """The unit's Compositor, created with what the unit shows (last applied, else the user's profile) as its base."""
+        key = (product, unit)
+        with self._lock:
+            compositor = self.compositors.get(key)
+            state = self.state.get(key)
+        if compositor is not None:
+            return compositor
+        compositor = G213Compositor.Compositor(product, unit, pool=self.pool)
+        frames = state["frames"] if state and state["frames"] else None
+        if frames is None:
+            import G213Profiles
+            _, frames = G213Profiles.user_frames(product, unit)
+        if frames:
+            compositor.assume_shown(frames)
+            compositor.set_layer(G213Compositor.BASE_LAYER, frames, G213Compositor.PRIORITY_BASE)
+        with self._lock:
+            self.compositors[key] = compositor
+        return compositor
+
+    def _drop_compositor(self, key):
+        with self._lock:
+            compositor = self.compositors.pop(key, None)
+        if compositor is not None:
+            compositor.close()
+
+    def op_ping(self, request):
+        return {"pid": os.getpid()}
+
+    def op_apply_profile(self, request):
+        """Applies a legacy .conf file ("path") or a stored profile ("product" and "name"), both in the profile directory."""
+        if "path" in request:
+            product, commands = G213Colors.LogitechDevice.read_configuration(self._profile_path(request["path"]))
+        else:
+            import G213Profiles
+            product, _ = self._target(request)
+            store_path = self._profile_path(request.get("store") or G213Profiles.USER_PROFILE_STORE)
+            commands = G213Profiles.ProfileStore(store_path).get(product, request["name"])
+            if commands is None:
+                raise DaemonError(f"No profile {product}/{request['name']}")
+        return self._apply(product, request.get("unit"), commands, request.get("force", False))
+
+    def op_apply_frames(self, request):
+        product, unit = self._target(request)
+        return self._apply(product, unit, [bytes.fromhex(frame) for frame in request["frames"]], request.get("force", False))
+
+    def op_set_color(self, request):
+        product, unit = self._target(request)
+        frame = G213Colors.build_frame(product, "color", (request.get("zone", 0), request["color"]))
+        return self._apply(product, unit, [frame], request.get("force", False))
+
+    def op_set_breathe(self, request):
+        product, unit = self._target(request)
+        frame = G213Colors.build_frame(product, "breathe", (request["color"], request["speed"]))
+        return self._apply(product, unit, [frame], request.get("force", False))
+
+    def op_set_cycle(self, request):
+        product, unit = self._target(request)
+        return self._apply(product, unit, [G213Colors.build_frame(product, "cycle", (request["speed"],))], request.get("force", False))
+
+    def op_set_segments(self, request):
+        product, unit = self._target(request)
+        colors = request["colors"]
+        frames = [G213Colors.build_frame(product, "color", (i, c)) for i, c in enumerate(colors, 1)]
+        return self._apply(product, unit, frames, request.get("force", False))
+
+    def op_start_animation(self, request):
+        import G213Animation
+        import G213Load
+        product, unit = self._target(request)
+        period = request.get("period", 4.0)
+        colors = request.get("colors") or []
+        effects = {
+            "wave": lambda: G213Animation.WaveEffect(period=period),
+            "gradient": lambda: G213Animation.GradientScrollEffect(colors or ["ff0000", "0000ff"], period=period),
+            "chase": lambda: G213Animation.ChaseEffect((colors or ["ffffff"])[0], period=period),
+            "pulse": lambda: G213Animation.PulseEffect((colors or ["ffffff"])[0], period=period),
+            "spectrum": lambda: G213Animation.WaveEffect(period=period, spread=0),
+            "load": lambda: G213Load.SystemLoadEffect(),
+        }
+        if request["effect"] not in effects:
+            raise DaemonError(f"Unknown effect: {request['effect']}")
+        effect = effects[request["effect"]]()
+        key = (product, unit)
+        if request.get("offload", True) and request.get("duration") is None:
+            import G213Offload
+            offload_plan = G213Offload.plan(effect, product, request.get("fps", 30))
+            if offload_plan.frames is not None:
+                self._apply(product, unit, offload_plan.frames)
+                with self._lock:
+                    self.state[key]["animation"] = f"{request['effect']} ({offload_plan.path})"
+                return {"offload": offload_plan.path, "reason": offload_plan.reason,
+                        "writes_saved_per_second": offload_plan.host_writes_per_second}
+        self._stop_animation(key)
+        self._drop_compositor(key)
+        started = threading.Event()
+        animators = []
+
+        def run():
+            # The pool lock is held by this thread for the whole animation
+            device = self.pool.acquire(product, unit)
+            if device is not None:
+                animators.append(G213Animation.Animator(device, effect, fps=request.get("fps", 30)))
+            started.set()
+            if device is None:
+                return
+            try:
+                animators[0].run(request.get("duration"))
+            finally:
+                self.pool.release(product, unit)
+        thread = threading.Thread(target=run, name=f"Animation-{product}", daemon=True)
+        thread.start()
+        started.wait()
+        if not animators:
+            raise DaemonError(f"Could not connect to {product}")
+        with self._lock:
+            self.animations[key] = (animators[0], thread)
+            self.state[key] = {"frames": [], "animation": request["effect"]}
+        return {}
+
+    def _stop_animation(self, key):
+        with self._lock:
+            running = self.animations.pop(key, None)
+        if running is None:
+            return None
+        animator, thread = running
+        animator.stop()
+        thread.join()
+        return animator.stats()
+
+    def op_stop_animation(self, request):
+        stats = self._stop_animation(self._target(request))
+        return {"stats": stats}
+
+    def op_overlay(self, request):
+        """Shows "color" (on "zones", default all) or "frames" above the current lighting for "ttl" seconds (null: until cleared).
+
+        A running animation on the unit is stopped first.
+        """
+        product, unit = self._target(request)
+        if "frames" in request:
+            frames = [bytes.fromhex(frame) for frame in request["frames"]]
+        else:
+            frames = G213Compositor.flash_frames(product, request["color"], request.get("zones"))
+        self._stop_animation((product, unit))
+        compositor = self._compositor(product, unit)
+        name = request.get("name", "overlay")
+        if not compositor.set_layer(name, frames, request.get("priority", G213Compositor.PRIORITY_OVERLAY),
+                                    request.get("ttl", DEFAULT_OVERLAY_TTL)):
+            raise DaemonError(f"Could not write to {product}" + (f"@{unit}" if unit else ""))
+        return {"layers": compositor.layers()}
+
+    def op_clear_overlay(self, request):
+        product, unit = self._target(request)
+        with self._lock:
+            compositor = self.compositors.get((product, unit))
+        if compositor is None:
+            return {"layers": []}
+        if not compositor.remove_layer(request.get("name", "overlay")):
+            raise DaemonError(f"Could not write to {product}" + (f"@{unit}" if unit else ""))
+        return {"layers": compositor.layers()}
+
+    def op_preview(self, request):
+        """Hands "frames" to the preview writer and returns at once; empty frames drop a pending preview.
+
+        Only the newest frames per product are written, rate limited, through send_batch,
+        so neither the state cache nor the daemon's state records them.
+        """
+        product, _ = self._target(request)
+        frames = [bytes.fromhex(frame) for frame in request["frames"]]
+        self._stop_animation((product, None))
+        with self._lock:
+            if self.preview_writer is None:
+                import G213Async
+                self.preview_writer = G213Async.LatestWinsWriter(self.pool)
+                self.preview_writer.start()
+            preview_writer = self.preview_writer
+        if frames:
+            preview_writer.submit(product, frames)
+        else:
+            preview_writer.discard(product)
+        return {}
+
+    def op_state(self, request):
+        with self._lock:
+            devices = [
+                dict(state, product=product, unit=unit,
+                     animation_stats=self.animations[(product, unit)][0].stats() if (product, unit) in self.animations else None,
+                     layers=self.compositors[(product, unit)].layers() if (product, unit) in self.compositors else None)
+                for (product, unit), state in self.state.items()
+            ]
+        return {"devices": devices}
+
+    def op_metrics(self, request):
+        if request.get("format") == "prometheus":
+            return {"metrics": METRICS.to_prometheus()}
+        return {"metrics": METRICS.snapshot()}
+
+    def restore(self, product, unit, frames):
+        """HotplugWatcher apply_func: replays what this daemon last applied, else the saved frames (if any)."""
+        unit = self._canonical_unit(product, unit)
+        with self._lock:
+            state = self.state.get((product, unit))
+            compositor = self.compositors.get((product, unit))
+        if compositor is not None:
+            return compositor.redraw() # Overlays that are still up included
+        if state and state["frames"]:
+            frames = state["frames"]
+        elif frames is None:
+            return True # Nothing saved for it, leave the hardware default
+        try:
+            self._apply(product, unit, frames, force=True)
+        except DaemonError as e:
+            logger.warning(f"Hotplug restore of {product}@{unit} failed: {e}")
+            return False
+        return True
+
+    def apply_scheduled(self, product, unit, frames):
+        """Scheduler apply_func: a scheduled profile replaces whatever is showing, animations included."""
+        try:
+            self._apply(product, unit, frames, layer=G213Compositor.SCHEDULE_LAYER)
+        except DaemonError as e:
+            logger.warning(f"Scheduled apply to {product} failed: {e}")
+            return False
+        return True
+
+    def close(self):
+        if self.preview_writer is not None:
+            self.preview_writer.stop()
+        for key in list(self.animations):
+            self._stop_animation(key)
+        for key in list(self.compositors):
+            self._drop_compositor(key)
+        self.pool.close_all()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"ok": False, "error": f"Invalid JSON: {e}"}
+            else:
+                if isinstance(request, dict) and request.get("op") == "shutdown":
+                    self._reply({"ok": True})
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+                response = self.server.daemon_state.handle(request)
+            self._reply(response)
+
+    def _reply(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+        self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, daemon_state, socket_mode=0o600):
+        if os.path.exists(socket_path):
+            client = DaemonClient(socket_path)
+            running = client.is_running()
+            client.close()
+            if running:
+                raise DaemonError(f"A daemon is already listening on {socket_path}")
+            os.unlink(socket_path) # Stale socket left by a crashed daemon
+        self.daemon_state = daemon_state
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, socket_mode)
+
+
+def _start_hotplug_watcher(daemon_state):
+    import G213Hotplug
+    try:
+        source = G213Hotplug.NetlinkEventSource()
+    except OSError as e:
+        logger.warning(f"Hotplug reapply disabled, cannot open the uevent socket: {e}")
+        return None
+    watcher = G213Hotplug.HotplugWatcher(source, apply_func=daemon_state.restore)
+    watcher.start()
+    return watcher
+
+
+def _start_scheduler(daemon_state):
+    import G213Schedule
+    if not os.path.exists(G213Schedule.SCHEDULE_FILE):
+        return None
+    rules = G213Schedule.read_schedule()
+    if not rules:
+        return None
+    scheduler = G213Schedule.Scheduler(rules, apply_func=daemon_state.apply_scheduled)
+    scheduler.start()
+    logger.info(f"Running {len(rules)} schedule rule(s) from {G213Schedule.SCHEDULE_FILE}")
+    return scheduler
+
+
+def _start_ingest(daemon_state):
+    import G213Ingest
+    try:
+        server = G213Ingest.IngestServer(daemon_state.pool, G213Ingest.default_fifo_path())
+    except OSError as e:
+        logger.warning(f"Color ingest disabled, cannot open its endpoints: {e}")
+        return None
+    server.start()
+    return server
+
+
+def serve(socket_path=None, socket_mode=0o600, idle_timeout=G213Colors.DevicePool.DEFAULT_IDLE_TIMEOUT, hotplug=True,
+          schedule=True, ingest=False):
+    """Runs the daemon until a shutdown request or SIGTERM/SIGINT."""
+    import signal
+    socket_path = socket_path or default_socket_path()
+    METRICS.enable() # Cheap next to the USB I/O, and it is what the metrics op serves
+    daemon_state = LightingDaemon(G213Colors.DevicePool(idle_timeout=idle_timeout, ack_reader=True))
+    server = DaemonServer(socket_path, daemon_state, socket_mode)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown, daemon=True).start())
+    watcher = _start_hotplug_watcher(daemon_state) if hotplug else None
+    scheduler = _start_scheduler(daemon_state) if schedule else None
+    ingest_server = _start_ingest(daemon_state) if ingest else None
+    logger.info(f"G213Colors daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stop()
+            watcher.source.close()
+        if scheduler is not None:
+            scheduler.stop()
+        if ingest_server is not None:
+            ingest_server.stop()
+            ingest_server.close()
+        server.server_close()
+        daemon_state.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+    logger.info("G213Colors daemon stopped.")
+
+
+class DaemonClient:
+    """Thin client; keeps one connection open across requests."""
+
+    def __init__(self, socket_path=None, timeout=CLIENT_TIMEOUT):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailable(f"No daemon on {self.socket_path}: {e}") from e
+        self._socket = sock
+        self._file = sock.makefile("rwb")
+
+    def _write(self, data):
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            self.close()
+            raise DaemonUnavailable(f"Daemon on {self.socket_path} went away: {e}") from e
+
+    def request(self, op, **params):
+        """Sends one request and returns the response dict.
+
+        Raises DaemonUnavailable if no daemon took it, another OSError (e.g. a timeout) if
+        the daemon got it but did not answer, and ValueError if the answer is not JSON.
+        """
+        params["op"] = op
+        data = json.dumps(params).encode() + b"\n"
+        if self._socket is not None:
+            try:
+                self._write(data)
+            except DaemonUnavailable:
+                pass # Restarted since the last request, which never saw this one; try a new connection
+        if self._socket is None:
+            self._connect()
+            self._write(data)
+        try:
+            line = self._file.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise DaemonUnavailable("Daemon closed the connection without answering")
+        return json.loads(line)
+
+    def is_running(self):
+        """True if a daemon answers a ping within PING_TIMEOUT."""
+        timeout, self.timeout = self.timeout, min(self.timeout, PING_TIMEOUT)
+        try:
+            return self.request("ping").get("ok", False)
+        except (OSError, ValueError):
+            return False
+        finally:
+            self.timeout = timeout
+            if self._socket is not None:
+                self._socket.settimeout(timeout)
+
+    def close(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = self._file = None
+
+
+class DaemonPreviewWriter(threading.Thread):
+    """Forwards a GUI's live preview to the daemon from its own thread and connection; newest frames per product win.
+
+    Has G213Async.LatestWinsWriter's submit/discard/stop, so a GUI can use either.
+    If the daemon goes away the writer stops and calls on_unavailable() from its thread.
+    """
+
+    def __init__(self, socket_path=None, on_unavailable=None):
+        super().__init__(name="g213-daemon-preview", daemon=True)
+        self.client = DaemonClient(socket_path)
+        self.on_unavailable = on_unavailable
+        self.submitted = 0
+        self.sent = 0
+        self._latest = {} # product_name -> frames not yet sent ([] drops the daemon's pending preview)
+        self._known = set() # Products previewed so far
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def submit(self, product_name, frames):
+        with self._condition:
+            self._latest[product_name] = frames
+            self._known.add(product_name)
+            self.submitted += 1
+            self._condition.notify()
+
+    def discard(self, product_name=None):
+        """Drops previews not sent yet, here and in the daemon."""
+        with self._condition:
+            for product in ([product_name] if product_name else list(self._known)):
+                self._latest[product] = []
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._latest and not self._stopping:
+                        self._condition.wait()
+                    if self._stopping:
+                        return
+                    product_name = next(iter(self._latest))
+                    frames = self._latest.pop(product_name)
+                try:
+                    response = self.client.request("preview", product=product_name, frames=[bytes(frame).hex() for frame in frames])
+                except DaemonUnavailable as e:
+                    logger.warning(f"Lost the daemon ({e}); no more previews through it.")
+                    with self._condition:
+                        self._stopping = True
+                        self._latest.clear()
+                    if self.on_unavailable is not None:
+                        self.on_unavailable()
+                    return
+                except (OSError, ValueError) as e:
+                    logger.error(f"No answer from the daemon to a preview for {product_name}: {e}")
+                    continue
+                self.sent += 1
+                if not response["ok"]:
+                    logger.error(f"Daemon rejected the preview for {product_name}: {response['error']}")
+        finally:
+            self.client.close()
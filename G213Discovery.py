@@ -0,0 +1,93 @@
+'''
+  *  Discovery cache for G213Colors.
+  *
+  *  A USB lookup (usb.core.find) walks and opens every device on every bus, which on
+  *  a desk with a dock, hubs and dozens of devices dominates the cost of a short
+  *  apply. This cache remembers the device handle of each product/unit found by the
+  *  last enumeration, keyed by bus and port path, so later connects and the kernel
+  *  driver reattach in disconnect reuse it after a cheap check (UsbBackend.is_present,
+  *  which compares sysfs with the handle's descriptor) instead of enumerating again.
+  *
+  *  Entries expire after G213COLORS_DISCOVERY_TTL seconds (default 60), on hotplug
+  *  events, and when a transfer says the handle is gone. Disable with
+  *  G213COLORS_DISCOVERY_CACHE=0. Lookups are counted in the usb_enumerations and
+  *  discovery_cache metrics; discovery_saved_seconds estimates the time saved.
+'''
+
+import logging
+import os
+import threading
+import time
+
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60.0
+
+
+class DiscoveryCache:
+    """Maps (product_name, unit) to the handle found for it; unit None is the product's first unit."""
+
+    def __init__(self, ttl=DEFAULT_TTL, enabled=True):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = {} # (product_name, unit) -> (handle, backend, stored_at)
+        self._enumeration_cost = {} # product_name -> moving average of one enumeration in seconds
+        self._lock = threading.Lock()
+
+    def lookup(self, backend, product_name, unit):
+        """Returns the cached handle if it is still the attached device, else None (enumerate then)."""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        with self._lock:
+            entry = self._entries.get((product_name, unit))
+        if entry is None or entry[1] is not backend:
+            result = "miss"
+        elif time.monotonic() - entry[2] > self.ttl:
+            result = "expired"
+        elif not backend.is_present(entry[0]):
+            result = "stale"
+        else:
+            result = "hit"
+        if result in ("expired", "stale"):
+            logger.debug(f"Discovery cache entry for {product_name}@{unit} is {result}.")
+            self.invalidate(product_name)
+        if METRICS.enabled:
+            labels = (("product", product_name),)
+            METRICS.inc("discovery_cache", labels + (("result", result),))
+            if result == "hit":
+                saved = self._enumeration_cost.get(product_name, 0.0) - (time.perf_counter() - started)
+                METRICS.inc("discovery_saved_seconds", labels, max(0.0, saved))
+        return entry[0] if result == "hit" else None
+
+    def store_all(self, backend, product_name, units, enumeration_seconds):
+        """Replaces product_name's entries with the (unit, handle) pairs of a fresh enumeration, in bus order."""
+        with self._lock:
+            previous = self._enumeration_cost.get(product_name)
+            self._enumeration_cost[product_name] = enumeration_seconds if previous is None else (previous * 3 + enumeration_seconds) / 4
+            if not self.enabled:
+                return
+            for key in [key for key in self._entries if key[0] == product_name]:
+                del self._entries[key]
+            now = time.monotonic()
+            for unit, handle in units:
+                self._entries[(product_name, unit)] = (handle, backend, now)
+            if units:
+                self._entries[(product_name, None)] = (units[0][1], backend, now)
+
+    def invalidate(self, product_name=None, unit=None):
+        """Forgets one unit (and its product's first-unit alias), a whole product, or everything."""
+        with self._lock:
+            if product_name is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == product_name and (unit is None or key[1] in (unit, None))]:
+                del self._entries[key]
+
+
+DISCOVERY_CACHE = DiscoveryCache(
+    ttl=float(os.environ.get("G213COLORS_DISCOVERY_TTL", DEFAULT_TTL)),
+    enabled=os.environ.get("G213COLORS_DISCOVERY_CACHE") != "0",
+)
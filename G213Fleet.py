@@ -0,0 +1,80 @@
+'''
+  *  Drives every attached unit of a product, not just the first one usb.core.find returns.
+  *
+  *  Units are identified by bus and port path (see LogitechDevice.unit_id_of), so a
+  *  keyboard keeps its identity, and its own config file, as long as it stays plugged
+  *  into the same port.
+'''
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import G213Colors
+import G213Profiles
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def unit_config_path(config_dir, product_name, unit):
+    """Per-unit config file, e.g. ~/.config/G213Colors/G213@1-2.3.conf."""
+    return os.path.join(config_dir, f"{product_name}@{unit}.conf")
+
+
+def product_config_path(config_dir, product_name):
+    return os.path.join(config_dir, f"{product_name}.conf")
+
+
+def _apply_to_unit(device_class, product_name, unit, frames, force):
+    start = time.perf_counter()
+    device = device_class(product_name, unit)
+    if not force and device.is_applied(frames):
+        logger.info(f"{device.display_name} already shows these settings.")
+        return G213Colors.ApplyResult(product_name, True, time.perf_counter() - start, None)
+    if not device.connect():
+        return G213Colors.ApplyResult(product_name, False, time.perf_counter() - start, f"Could not connect to {device.display_name}")
+    try:
+        ok = device.apply_frames(frames, force)
+    finally:
+        device.disconnect()
+    error = None if ok else f"Could not write to {device.display_name}"
+    return G213Colors.ApplyResult(product_name, ok, time.perf_counter() - start, error)
+
+
+def apply_to_units(product_name, frames_by_unit, max_workers=DEFAULT_MAX_WORKERS, device_class=G213Colors.LogitechDevice, force=False):
+    """Applies {unit: [frames]} in parallel on at most max_workers threads; returns {unit: ApplyResult}.
+
+    Units that already show their frames (per the state cache) are not even opened, unless force is set.
+    """
+    if not frames_by_unit:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(frames_by_unit)), thread_name_prefix="g213-unit") as executor:
+        futures = {
+            unit: executor.submit(_apply_to_unit, device_class, product_name, unit, frames, force)
+            for unit, frames in frames_by_unit.items()
+        }
+        return {unit: future.result() for unit, future in futures.items()}
+
+
+def apply_user_configurations(product_name, config_dir, units=None, max_workers=DEFAULT_MAX_WORKERS, device_class=G213Colors.LogitechDevice, force=False):
+    """Applies each unit's own profile or config file, falling back to the product's.
+
+    See G213Profiles.user_frames for the lookup order. Units without saved settings are
+    left alone. Returns {unit: ApplyResult}.
+    """
+    if units is None:
+        units = device_class.find_units(product_name)
+    if not units:
+        logger.warning(f"No {product_name} units found.")
+        return {}
+    frames_by_unit = {}
+    store = G213Profiles.ProfileStore(os.path.join(config_dir, os.path.basename(G213Profiles.USER_PROFILE_STORE)))
+    for unit in units:
+        source, frames = G213Profiles.user_frames(product_name, unit, config_dir, store)
+        if frames:
+            logger.info(f"Using {source} for {product_name}@{unit}")
+            frames_by_unit[unit] = frames
+    return apply_to_units(product_name, frames_by_unit, max_workers, device_class, force)
@@ -0,0 +1,268 @@
+'''
+  *  Hotplug watcher for G213Colors: reapplies the saved settings when a G213/G203
+  *  is plugged in (or comes back after a hub reset) instead of leaving it on
+  *  hardware defaults until the next boot or login.
+  *
+  *  Listens on a netlink uevent socket, so it sleeps in the kernel until something
+  *  is plugged in. Bursts of events for one unit are debounced into a single
+  *  reapply of the user's profile (or legacy .conf) through LogitechDevice.apply_commands.
+  *
+  *      watcher = HotplugWatcher(NetlinkEventSource())
+  *      watcher.start()
+  *
+  *  FakeEventSource feeds the same code path without hardware or netlink.
+'''
+
+import errno
+import logging
+import os
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+
+import G213Colors
+import G213Profiles
+from G213Discovery import DISCOVERY_CACHE
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_GROUP = 1 # Raw kernel uevents
+UDEV_GROUP = 2 # Re-broadcast by udevd once its rules (and device permissions) are applied
+UDEV_MONITOR_MAGIC = 0xfeedcafe
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+DEFAULT_DEBOUNCE = 0.05 # Seconds of quiet after the last event before reapplying
+RETRY_DELAY = 0.25
+MAX_ATTEMPTS = 3
+
+
+def parse_uevent(data):
+    """Returns the KEY=value properties of a raw kernel or libudev uevent message, or None."""
+    if data.startswith(b"libudev\0"):
+        if len(data) < 24 or struct.unpack_from("!I", data, 8)[0] != UDEV_MONITOR_MAGIC:
+            return None
+        properties_offset, properties_length = struct.unpack_from("=II", data, 16)
+        data = data[properties_offset:properties_offset + properties_length]
+    properties = {}
+    for field in data.split(b"\0"):
+        key, separator, value = field.partition(b"=")
+        if separator:
+            properties[key.decode("ascii", "replace")] = value.decode("utf-8", "replace")
+    return properties or None
+
+
+def match_event(properties):
+    """Returns (action, product_name, unit) for a supported USB device event, else None.
+
+    Only whole-device events count: the interface bind/unbind events caused by our own
+    kernel driver detach and reattach must not trigger another reapply.
+    """
+    if properties.get("SUBSYSTEM") != "usb" or properties.get("DEVTYPE") != "usb_device":
+        return None
+    try:
+        id_vendor, id_product = (int(part, 16) for part in properties["PRODUCT"].split("/")[:2])
+    except (KeyError, ValueError):
+        return None
+    if id_vendor != G213Colors.LogitechDevice.ID_VENDOR:
+        return None
+    for product_name, spec in G213Colors.LogitechDevice.PRODUCT_SPECS.items():
+        if spec["idProduct"] == id_product:
+            # The sysfs name of a USB device ("1-2.3") is the same bus-port id unit_id_of() gives
+            return properties.get("ACTION"), product_name, os.path.basename(properties.get("DEVPATH", "")) or None
+    return None
+
+
+class NetlinkEventSource:
+    """Uevents from the kernel's netlink multicast group (udevd's by default)."""
+
+    def __init__(self, group=UDEV_GROUP):
+        self.group = group
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC, NETLINK_KOBJECT_UEVENT)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        except OSError:
+            pass
+        self.socket.bind((0, group))
+        self._wake_read, self._wake_write = os.pipe()
+
+    def receive(self, timeout=None):
+        """Returns one raw message, b"" if events were dropped (rescan needed), or None on timeout/wake."""
+        readable, _, _ = select.select([self.socket, self._wake_read], [], [], timeout)
+        if self._wake_read in readable:
+            os.read(self._wake_read, 64)
+            return None
+        if not readable:
+            return None
+        try:
+            data, (sender_pid, _) = self.socket.recvfrom(16384)
+        except OSError as e:
+            if e.errno == errno.ENOBUFS:
+                logger.warning("Uevent receive buffer overflowed; some hotplug events were lost.")
+                return b""
+            raise
+        if self.group == KERNEL_GROUP and sender_pid != 0:
+            return None # Kernel uevents always come from pid 0
+        return data
+
+    def wake(self):
+        os.write(self._wake_write, b"\0")
+
+    def close(self):
+        self.socket.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+
+class FakeEventSource:
+    """In-memory event source producing kernel-format uevents, for tests and the simulator."""
+
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def emit(self, action, product_name, unit, devtype="usb_device"):
+        spec = G213Colors.LogitechDevice.PRODUCT_SPECS[product_name]
+        bus = unit.split("-", 1)[0]
+        devpath = f"/devices/pci0000:00/0000:00:14.0/usb{bus}/{unit}"
+        properties = [
+            f"ACTION={action}", f"DEVPATH={devpath}", "SUBSYSTEM=usb", f"DEVTYPE={devtype}",
+            f"PRODUCT={G213Colors.LogitechDevice.ID_VENDOR:x}/{spec['idProduct']:x}/110",
+        ]
+        self._events.put(f"{action}@{devpath}\0".encode() + "\0".join(properties).encode() + b"\0")
+
+    def overflow(self):
+        self._events.put(b"")
+
+    def receive(self, timeout=None):
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wake(self):
+        self._events.put(None)
+
+    def close(self):
+        pass
+
+
+class HotplugWatcher(threading.Thread):
+    """Reapplies the matching configuration once a unit has been quiet for debounce seconds.
+
+    apply_func(product_name, unit, frames) does the work and returns True on success;
+    by default it is LogitechDevice.apply_commands. A custom apply_func is also called
+    when there are no saved settings (frames None). on_applied, if given,
+    is called as on_applied(product_name, unit, ok) after every attempt.
+    """
+
+    def __init__(self, source, config_dir=G213Colors.USER_CONFIG_DIR,
+                 system_conf_file=G213Colors.LogitechDevice.SYSTEM_DEFAULT_CONF_FILE,
+                 debounce=DEFAULT_DEBOUNCE, apply_func=None, on_applied=None):
+        super().__init__(name="HotplugWatcher", daemon=True)
+        self.source = source
+        self.config_dir = config_dir
+        self.system_conf_file = system_conf_file
+        self.debounce = debounce
+        self.apply_func = apply_func
+        self.on_applied = on_applied
+        self.events_seen = 0
+        self.reapplies = 0
+        self._pending = {} # (product_name, unit) -> [due_at, first_event_at, attempts]
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _apply_frames(product_name, unit, frames):
+        return G213Colors.LogitechDevice.apply_commands(product_name, frames, unit, force=True, source="hotplug")
+
+    def frames_for(self, product_name, unit):
+        """Returns (source, frames): the user's unit or product settings, else the system default if it is for product_name."""
+        if self.config_dir:
+            source, frames = G213Profiles.user_frames(product_name, unit, self.config_dir)
+            if frames:
+                return source, frames
+        if self.system_conf_file:
+            try:
+                file_product, commands = G213Colors.LogitechDevice.read_configuration(self.system_conf_file)
+            except (ValueError, IOError):
+                return None, None
+            if file_product == product_name and commands:
+                return self.system_conf_file, commands
+        return None, None
+
+    def stop(self):
+        self._stop_event.set()
+        self.source.wake()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            timeout = None
+            if self._pending:
+                timeout = max(0.0, min(entry[0] for entry in self._pending.values()) - time.monotonic())
+            data = self.source.receive(timeout)
+            if data == b"":
+                self._schedule_rescan()
+            elif data:
+                self._handle(data)
+            self._run_due()
+
+    def _handle(self, data):
+        properties = parse_uevent(data)
+        event = match_event(properties) if properties else None
+        if event is None:
+            return
+        action, product_name, unit = event
+        key = (product_name, unit)
+        self.events_seen += 1
+        if METRICS.enabled:
+            METRICS.inc("hotplug_events", (("product", product_name), ("action", str(action))))
+        logger.debug(f"Hotplug {action} for {product_name}@{unit}")
+        # A replugged unit is back on hardware defaults; forgotten in the cache of the backend that drives it
+        G213Colors.get_default_backend().state_cache.invalidate(f"{product_name}@{unit}")
+        DISCOVERY_CACHE.invalidate(product_name, unit) # and has a new device handle
+        if action == "remove":
+            self._pending.pop(key, None)
+        elif action in ("add", "bind"):
+            now = time.monotonic()
+            entry = self._pending.setdefault(key, [0, now, 0])
+            entry[0] = now + self.debounce # Every new event restarts the quiet period
+
+    def _schedule_rescan(self):
+        now = time.monotonic()
+        for product_name in G213Colors.LogitechDevice.PRODUCT_SPECS:
+            for unit in G213Colors.LogitechDevice.find_units(product_name):
+                self._pending.setdefault((product_name, unit), [now + self.debounce, now, 0])
+
+    def _run_due(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._pending.items() if entry[0] <= now]:
+            self._reapply(key, self._pending[key])
+
+    def _reapply(self, key, entry):
+        product_name, unit = key
+        source, frames = self.frames_for(product_name, unit)
+        if frames is None and self.apply_func is None:
+            logger.info(f"{product_name}@{unit} plugged in, but there is no saved configuration for it.")
+            del self._pending[key]
+            return
+        entry[2] += 1
+        logger.info(f"{product_name}@{unit} plugged in; applying {source}")
+        ok = (self.apply_func or self._apply_frames)(product_name, unit, frames)
+        if ok or entry[2] >= MAX_ATTEMPTS:
+            del self._pending[key]
+            if ok:
+                self.reapplies += 1
+                if METRICS.enabled:
+                    METRICS.observe("hotplug_reapply", time.monotonic() - entry[1], (("product", product_name),))
+            else:
+                logger.error(f"Giving up reapplying settings to {product_name}@{unit} after {entry[2]} attempts.")
+        else:
+            # Usually udev has not finished setting the device permissions yet
+            entry[0] = time.monotonic() + RETRY_DELAY
+        if self.on_applied is not None:
+            self.on_applied(product_name, unit, ok)
@@ -0,0 +1,374 @@
+'''
+  *  Local color stream ingestion for G213Colors.
+  *
+  *  Lets CI dashboards, music visualizers or game hooks drive the zones without
+  *  importing this code or starting a process per update: they write small binary
+  *  packets to a named pipe ($XDG_RUNTIME_DIR/g213colors.fifo) or send them as UDP
+  *  datagrams to 127.0.0.1:21213.
+  *
+  *  Packet layout (little endian):
+  *      header   "GC", version u8, product u8 (1 = G213, 2 = G203),
+  *               unit u8 (0 = first found, n = nth unit of 'g213colors list'),
+  *               sequence u32, zone mask u8 (bit 0 = whole device, bit n = zone n)
+  *      colors   r, g, b u8 for every bit set in the mask, lowest zone first
+  *
+  *  e.g. the whole G213 red:
+  *      printf 'GC\\x01\\x01\\x00\\x01\\x00\\x00\\x00\\x01\\xff\\x00\\x00' > $XDG_RUNTIME_DIR/g213colors.fifo
+  *
+  *  Received packets go into a bounded queue that drops the oldest ones when the
+  *  writer falls behind. The writer merges whatever is queued into the newest color
+  *  per zone and writes only zones that changed, paced by the device's acks and at
+  *  most max_rate times per second per unit. Sequence numbers are tracked per sender:
+  *  gaps are counted as lost, older or repeated packets are dropped as stale.
+'''
+
+import collections
+import logging
+import os
+import select
+import socket
+import stat
+import struct
+import threading
+import time
+
+import G213Colors
+from G213Animation import PRODUCT_ZONES
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GC"
+VERSION = 1
+HEADER = struct.Struct("<2sBBBIB")
+PRODUCT_CODES = {1: "G213", 2: "G203"}
+FIFO_NAME = "g213colors.fifo"
+DEFAULT_UDP_PORT = 21213
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_MAX_RATE = 60.0 # Writes per second per unit; the acks usually limit it first
+SENDER_RESTART_AFTER = 2.0 # Seconds of silence after which a sender may start its sequence over
+RETRY_AFTER = 2.0
+
+Packet = collections.namedtuple("Packet", ["product_name", "unit_index", "sequence", "colors", "received"])
+
+
+def default_fifo_path():
+    if os.geteuid() == 0:
+        return os.path.join("/run", FIFO_NAME)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    return os.path.join(runtime_dir, FIFO_NAME)
+
+
+def encode_packet(product_name, colors, sequence, unit_index=0):
+    """Packet bytes setting {zone: color} (hex string or r, g, b) on a unit; for clients written in Python."""
+    code = next(code for code, name in PRODUCT_CODES.items() if name == product_name)
+    mask = 0
+    payload = b""
+    for zone in sorted(colors):
+        mask |= 1 << zone
+        color = colors[zone]
+        payload += bytes.fromhex(color) if isinstance(color, str) else bytes(color)
+    return HEADER.pack(MAGIC, VERSION, code, unit_index, sequence & 0xffffffff, mask) + payload
+
+
+def decode_packet(data, offset=0):
+    """Returns (Packet, offset after it), or (None, offset) if data ends inside the packet.
+
+    ValueError if there is no valid packet header at offset.
+    """
+    if len(data) - offset < HEADER.size:
+        return None, offset
+    magic, version, code, unit_index, sequence, mask = HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version 1 G213Colors color packet")
+    product_name = PRODUCT_CODES.get(code)
+    if product_name is None:
+        raise ValueError(f"unknown product code {code}")
+    zones = [zone for zone in range(8) if mask >> zone & 1]
+    end = offset + HEADER.size + 3 * len(zones)
+    if len(data) < end:
+        return None, offset
+    if not zones or any(zone and zone not in PRODUCT_ZONES[product_name] for zone in zones):
+        raise ValueError(f"zone mask {mask:#04x} does not fit the {product_name}")
+    position = offset + HEADER.size
+    colors = [(zone, bytes(data[position + 3 * i:position + 3 * i + 3])) for i, zone in enumerate(zones)]
+    return Packet(product_name, unit_index, sequence, colors, time.monotonic()), end
+
+
+class SequenceTracker:
+    """Per-sender sequence accounting: counts lost packets and flags stale (older or repeated) ones."""
+
+    def __init__(self):
+        self.lost = 0
+        self.stale = 0
+        self._last = {} # (sender, product, unit index) -> (sequence, monotonic time)
+
+    def accept(self, sender, packet):
+        """True if packet is newer than the sender's previous one for the same unit."""
+        key = (sender, packet.product_name, packet.unit_index)
+        previous = self._last.get(key)
+        if previous is not None and packet.received - previous[1] < SENDER_RESTART_AFTER:
+            ahead = (packet.sequence - previous[0]) & 0xffffffff
+            if ahead == 0 or ahead >= 1 << 31:
+                self.stale += 1
+                return False
+            self.lost += ahead - 1
+        self._last[key] = (packet.sequence, packet.received)
+        return True
+
+
+class ZoneStreamWriter(threading.Thread):
+    """Writes the newest queued color of every zone to its unit, at most max_rate times per second per unit."""
+
+    def __init__(self, pool, queue_size=DEFAULT_QUEUE_SIZE, max_rate=DEFAULT_MAX_RATE):
+        super().__init__(name="g213-ingest-writer", daemon=True)
+        self.pool = pool
+        self.interval = 1.0 / max_rate
+        self.queued = 0
+        self.dropped = 0 # Oldest packets pushed out of a full queue
+        self.coalesced = 0 # Zone colors replaced by a newer one before they were written
+        self.frames_sent = 0
+        self._queue = collections.deque(maxlen=queue_size)
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._pending = {} # (product, unit) -> {zone: rgb} in write order
+        self._shown = {} # (product, unit) -> {zone: rgb} last written
+        self._next_write_at = {} # (product, unit) -> monotonic time
+        self._units = {} # (product, unit index) -> unit id from find_units
+
+    def put(self, packet):
+        with self._condition:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                if METRICS.enabled:
+                    METRICS.inc("ingest_dropped", (("product", packet.product_name),))
+            self._queue.append(packet)
+            self.queued += 1
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _resolve_unit(self, product_name, unit_index):
+        if unit_index == 0:
+            return None
+        key = (product_name, unit_index)
+        if key not in self._units:
+            units = G213Colors.LogitechDevice.find_units(product_name)
+            if unit_index > len(units):
+                logger.warning(f"No {product_name} unit number {unit_index}; {len(units)} attached.")
+                return False
+            self._units[key] = units[unit_index - 1]
+        return self._units[key]
+
+    def _merge(self, packet):
+        unit = self._resolve_unit(packet.product_name, packet.unit_index)
+        if unit is False:
+            return
+        zones = self._pending.setdefault((packet.product_name, unit), {})
+        for zone, rgb in packet.colors:
+            if zone == 0:
+                self.coalesced += len(zones)
+                zones.clear() # The whole device color covers every earlier zone color
+            elif zones.pop(zone, None) is not None:
+                self.coalesced += 1
+            zones[zone] = rgb
+
+    def _requeue(self, key, zones):
+        """Puts zones that could not be written back for a retry, under anything queued for key since."""
+        newer = self._pending.get(key, {})
+        if 0 in newer:
+            return # A newer whole-device color covers them all
+        retry = {zone: rgb for zone, rgb in zones.items() if zone not in newer}
+        retry.update(newer)
+        self._pending[key] = retry
+
+    def _next_due(self):
+        if not self._pending:
+            return None
+        now = time.monotonic()
+        return max(0.0, min(self._next_write_at.get(key, 0) for key in self._pending) - now)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and not self._queue:
+                    wait = self._next_due()
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+                if self._stopping:
+                    return
+                packets = list(self._queue)
+                self._queue.clear()
+            for packet in packets:
+                self._merge(packet)
+            now = time.monotonic()
+            for key in [key for key in self._pending if self._next_write_at.get(key, 0) <= now]:
+                self._write(key, self._pending.pop(key), packets)
+
+    def _write(self, key, zones, packets):
+        product_name, unit = key
+        shown = self._shown.setdefault(key, {})
+        all_zones = PRODUCT_ZONES[product_name]
+        frames = []
+        for zone, rgb in zones.items():
+            if zone == 0 and all(shown.get(z) == rgb for z in all_zones):
+                continue
+            if zone and shown.get(zone) == rgb:
+                continue
+            frames.append(G213Colors.build_frame(product_name, "color", (zone, rgb)))
+            for z in (all_zones if zone == 0 else (zone,)):
+                shown[z] = rgb
+        self._next_write_at[key] = time.monotonic() + self.interval
+        if not frames:
+            return
+
+        def send(device):
+            results = device.send_batch(frames)
+            return len(results) == len(frames) and all(result.sent for result in results)
+        if not self.pool.call(product_name, send, unit):
+            logger.error(f"Could not write streamed colors to {product_name}" + (f"@{unit}" if unit else ""))
+            self._shown.pop(key, None)
+            self._next_write_at[key] = time.monotonic() + RETRY_AFTER
+            self._requeue(key, zones)
+            return
+        self.frames_sent += len(frames)
+        if METRICS.enabled:
+            labels = (("product", product_name),)
+            METRICS.inc("ingest_frames", labels, len(frames))
+            newest = max((packet.received for packet in packets if packet.product_name == product_name), default=None)
+            if newest is not None:
+                METRICS.observe("ingest_latency", time.monotonic() - newest, labels)
+
+
+class IngestServer(threading.Thread):
+    """Receives color packets on a FIFO and/or a loopback UDP socket and feeds them to a ZoneStreamWriter."""
+
+    def __init__(self, pool=None, fifo_path=None, udp_port=DEFAULT_UDP_PORT, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_rate=DEFAULT_MAX_RATE):
+        super().__init__(name="g213-ingest", daemon=True)
+        self.writer = ZoneStreamWriter(pool or G213Colors.DevicePool(), queue_size, max_rate)
+        self.sequences = SequenceTracker()
+        self.received = 0
+        self.invalid = 0
+        self.fifo_path = fifo_path
+        self._fifo = None
+        self._created_fifo = False
+        self._fifo_buffer = bytearray()
+        self.udp = None
+        if fifo_path:
+            self._open_fifo(fifo_path)
+        if udp_port is not None:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+            self.udp.bind(("127.0.0.1", udp_port))
+            self.udp.setblocking(False)
+        self._wake_read, self._wake_write = os.pipe()
+        self._stop_event = threading.Event()
+
+    def _open_fifo(self, path):
+        try:
+            if not stat.S_ISFIFO(os.stat(path).st_mode):
+                raise OSError(f"{path} exists and is not a FIFO")
+        except FileNotFoundError:
+            os.mkfifo(path, 0o600)
+            self._created_fifo = True
+        # Opened for writing too, so the pipe never reports EOF between writers
+        self._fifo = os.open(path, os.O_RDWR | os.O_NONBLOCK | os.O_CLOEXEC)
+
+    def stats(self):
+        return {
+            "received": self.received, "invalid": self.invalid, "lost": self.sequences.lost, "stale": self.sequences.stale,
+            "dropped": self.writer.dropped, "coalesced": self.writer.coalesced, "frames_sent": self.writer.frames_sent,
+        }
+
+    def _accept(self, sender, packet):
+        self.received += 1
+        lost_before = self.sequences.lost
+        accepted = self.sequences.accept(sender, packet)
+        if METRICS.enabled:
+            labels = (("product", packet.product_name),)
+            METRICS.inc("ingest_packets", labels)
+            if not accepted:
+                METRICS.inc("ingest_stale", labels)
+            elif self.sequences.lost > lost_before:
+                METRICS.inc("ingest_lost", labels, self.sequences.lost - lost_before)
+        if accepted:
+            self.writer.put(packet)
+
+    def _invalid(self, source, e):
+        self.invalid += 1
+        if METRICS.enabled:
+            METRICS.inc("ingest_invalid", (("source", source),))
+        logger.debug(f"Ignoring invalid {source} data: {e}")
+
+    def _read_udp(self):
+        while True: # Everything that arrived since the last wakeup
+            try:
+                data, address = self.udp.recvfrom(512)
+            except BlockingIOError:
+                return
+            try:
+                packet, end = decode_packet(data)
+                if packet is None or end != len(data):
+                    raise ValueError(f"{len(data)} byte datagram is not one whole packet")
+            except ValueError as e:
+                self._invalid("udp", e)
+                continue
+            self._accept(address, packet)
+
+    def _read_fifo(self):
+        try:
+            self._fifo_buffer += os.read(self._fifo, 4096)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(self._fifo_buffer):
+            try:
+                packet, end = decode_packet(self._fifo_buffer, offset)
+            except ValueError as e:
+                self._invalid("fifo", e)
+                next_magic = self._fifo_buffer.find(MAGIC, offset + 1)
+                offset = next_magic if next_magic >= 0 else len(self._fifo_buffer) # Resynchronize on the next header
+                continue
+            if packet is None:
+                break
+            offset = end
+            self._accept("fifo", packet)
+        del self._fifo_buffer[:offset]
+
+    def run(self):
+        self.writer.start()
+        sources = [fd for fd in (self._fifo, self.udp) if fd is not None] + [self._wake_read]
+        logger.info(f"Ingesting colors from {self.fifo_path or 'no FIFO'}"
+                    + (f" and udp://127.0.0.1:{self.udp.getsockname()[1]}" if self.udp else ""))
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select(sources, [], [])
+            if self.udp in readable:
+                self._read_udp()
+            if self._fifo is not None and self._fifo in readable:
+                self._read_fifo()
+
+    def stop(self):
+        self._stop_event.set()
+        os.write(self._wake_write, b"\0")
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.writer.stop()
+
+    def close(self):
+        if self.udp is not None:
+            self.udp.close()
+        if self._fifo is not None:
+            os.close(self._fifo)
+            if self._created_fifo:
+                try:
+                    os.unlink(self.fifo_path)
+                except OSError:
+                    pass
+        os.close(self._wake_read)
+        os.close(self._wake_write)
@@ -0,0 +1,199 @@
+'''
+  *  System-load visualizer for G213Colors: shows the machine's health on the keyboard.
+  *
+  *  SystemLoadSampler reads CPU time per core, memory use and pressure, and the load
+  *  average from /proc. SystemLoadEffect maps them to colors from green (idle) over
+  *  yellow to red (saturated) and runs under G213Animation.Animator, which writes only
+  *  the zones whose color changed:
+  *
+  *      G213   zones 1-3  busiest core of each third of the CPUs
+  *             zone 4     memory (used fraction, or pressure stalls if higher)
+  *             zone 5     1-minute load average per CPU
+  *      G203   the worst of the three
+  *
+  *      g213colors load G213 --interval 2
+  *
+  *  The /proc files are opened once, reread into preallocated buffers and parsed in place
+  *  (bytearray.find, then int() or float() on the slice of each number), and values are
+  *  quantized to a precomputed palette, so a sample only allocates the numbers it reads
+  *  and an unchanged machine causes no USB traffic at all.
+'''
+
+import logging
+import os
+
+import G213Pipeline
+from G213Animation import Effect
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 2.0 # Seconds between samples
+LEVELS = 16 # Distinct colors per zone; smaller changes than 1/LEVELS are not written
+DEFAULT_STOPS = ("00ff00", "ffff00", "ff0000")
+PSI_FULL_SCALE = 10.0 # Percent of time stalled on memory (avg10) that counts as saturated
+CPU_STAT_FIELDS = 8 # user nice system idle iowait irq softirq steal
+IDLE_FIELDS = (3, 4) # idle and iowait are not busy time
+
+
+class ProcFile:
+    """A /proc file kept open and reread from offset 0 into a preallocated buffer."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.buffer = bytearray(size)
+
+    def read(self, until=None):
+        """Rereads the file into buffer and returns the byte count.
+
+        A read that fills the buffer may have cut the file short, so the buffer is doubled
+        and the read repeated, unless until (a marker past everything the caller parses)
+        was already read. Take self.buffer after calling this.
+        """
+        while True:
+            count = os.preadv(self._fd, [self.buffer], 0)
+            if count < len(self.buffer) or (until is not None and self.buffer.find(until, 0, count) >= 0):
+                return count
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _field_end(buffer, start, end):
+    """Index of the space after the field at start, or end if it is the last one."""
+    stop = buffer.find(b" ", start, end)
+    return end if stop < 0 else stop
+
+
+def _value_after(buffer, key, end):
+    """The number following key (e.g. "MemTotal:") in buffer[:end], as a slice for int()/float(); None if absent."""
+    start = buffer.find(key, 0, end)
+    if start < 0:
+        return None
+    start += len(key)
+    while start < end and buffer[start] == 0x20: # Column padding, as in "MemTotal:       16318412 kB"
+        start += 1
+    return buffer[start:_field_end(buffer, start, end)]
+
+
+class SystemLoadSampler:
+    """Holds the latest core_load list, memory and load values, each 0.0 (idle) to 1.0 (saturated)."""
+
+    def __init__(self, proc="/proc"):
+        self.cpu_count = os.cpu_count() or 1
+        # The cpu lines come first in /proc/stat; the rest (interrupt counters) is only read if a cpu line is cut
+        self._stat = ProcFile(os.path.join(proc, "stat"), 32 + (self.cpu_count + 1) * 160)
+        self._meminfo = ProcFile(os.path.join(proc, "meminfo"), 512)
+        self._loadavg = ProcFile(os.path.join(proc, "loadavg"), 128)
+        try:
+            self._pressure = ProcFile(os.path.join(proc, "pressure", "memory"), 256)
+        except OSError:
+            self._pressure = None # Kernels without PSI
+        self._busy = [0] * self.cpu_count
+        self._total = [0] * self.cpu_count
+        self.core_load = [0.0] * self.cpu_count
+        self.memory = 0.0
+        self.load = 0.0
+        self.samples = 0
+
+    def sample(self):
+        self._sample_cpus()
+        self._sample_memory()
+        end = self._loadavg.read()
+        try:
+            self.load = min(1.0, float(self._loadavg.buffer[:_field_end(self._loadavg.buffer, 0, end)]) / self.cpu_count)
+        except ValueError:
+            pass # Keep the previous value
+        self.samples += 1
+
+    def _sample_cpus(self):
+        end = self._stat.read(until=b"\nintr ")
+        buffer = self._stat.buffer
+        position = buffer.find(b"\ncpu", 0, end) + 1 # Skip the aggregate "cpu " line
+        if not position:
+            return
+        for _ in range(self.cpu_count):
+            if not buffer.startswith(b"cpu", position, end):
+                break
+            line_end = buffer.find(b"\n", position, end)
+            if line_end < 0:
+                line_end = end
+            field_end = _field_end(buffer, position, line_end)
+            line_start, position = position, line_end + 1
+            try:
+                core = int(buffer[line_start + 3:field_end])
+                if core >= self.cpu_count:
+                    continue
+                total = busy = 0
+                for index in range(CPU_STAT_FIELDS):
+                    field_start = field_end + 1
+                    field_end = _field_end(buffer, field_start, line_end)
+                    value = int(buffer[field_start:field_end])
+                    total += value
+                    if index not in IDLE_FIELDS:
+                        busy += value
+            except ValueError:
+                logger.debug(f"Skipping an unreadable line in {self._stat.path}.")
+                continue # No sample for this core this time
+            elapsed = total - self._total[core]
+            if self._total[core] and elapsed > 0:
+                self.core_load[core] = (busy - self._busy[core]) / elapsed
+            self._busy[core] = busy
+            self._total[core] = total
+
+    def _sample_memory(self):
+        end = self._meminfo.read()
+        buffer = self._meminfo.buffer
+        total = _value_after(buffer, b"MemTotal:", end)
+        available = _value_after(buffer, b"MemAvailable:", end)
+        stalled = 0.0
+        try:
+            used = 1.0 - int(available) / int(total) if total and available else 0.0
+            if self._pressure is not None:
+                # "some avg10=1.23 avg60=..." : percent of the last 10 s some task waited for memory
+                end = self._pressure.read()
+                avg10 = _value_after(self._pressure.buffer, b"avg10=", end)
+                if avg10:
+                    stalled = float(avg10) / PSI_FULL_SCALE
+        except (ValueError, ZeroDivisionError):
+            return # No sample; keep the previous value
+        self.memory = min(1.0, max(used, stalled))
+
+    def close(self):
+        for proc_file in (self._stat, self._meminfo, self._loadavg, self._pressure):
+            if proc_file is not None:
+                proc_file.close()
+
+
+class SystemLoadEffect(Effect):
+    """Samples the system on every frame; run it at a low fps (1 / interval)."""
+
+    def __init__(self, sampler=None, stops=DEFAULT_STOPS, levels=LEVELS):
+        self.sampler = sampler or SystemLoadSampler()
+        self.palette = G213Pipeline.palette(stops, levels)
+        self._colors = []
+
+    def _color(self, value):
+        return self.palette[min(len(self.palette) - 1, max(0, int(value * (len(self.palette) - 1) + 0.5)))]
+
+    def values(self, zone_count):
+        """The 0.0-1.0 value shown on each of zone_count zones (see the module docstring)."""
+        sampler = self.sampler
+        if zone_count < 3:
+            return [max(max(sampler.core_load), sampler.memory, sampler.load)] * zone_count
+        groups = zone_count - 2
+        cores = sampler.core_load
+        values = []
+        for group in range(groups):
+            first = group * len(cores) // groups
+            values.append(max(cores[first:max(first + 1, (group + 1) * len(cores) // groups)]))
+        return values + [sampler.memory, sampler.load]
+
+    def colors_at(self, t, zone_count):
+        self.sampler.sample()
+        if len(self._colors) != zone_count:
+            self._colors = [None] * zone_count
+        for i, value in enumerate(self.values(zone_count)):
+            self._colors[i] = self._color(value)
+        return self._colors
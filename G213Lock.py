@@ -0,0 +1,224 @@
+'''
+  *  Cross-process device arbitration for G213Colors.
+  *
+  *  The service, the login autostart entries, the GUI and the daemon may all reach
+  *  for the same keyboard at login. LogitechDevice.connect() takes an exclusive flock
+  *  on /run/g213colors/g213colors-<product>@<unit>.lock before detaching the kernel driver
+  *  and disconnect() releases it after the reattach, so sessions queue up instead of
+  *  racing each other's detach/reattach and losing writes.
+  *
+  *  One-shot writers (LogitechDevice.apply_commands) coalesce while they wait: each
+  *  one leaves its frames in the unit's .pending file, overwriting older ones, and
+  *  whoever gets the lock next applies what is there. The newest request is applied
+  *  once; older ones are dropped instead of being replayed in turn.
+  *
+  *  While a process waits it holds a shared flock on the unit's .waiting file, so a
+  *  holder that keeps its handle open between writes (DevicePool) sees that someone
+  *  is queued (others_waiting) and lets go right after its current batch instead of
+  *  at the end of its idle timeout.
+  *
+  *  The files are never renamed or removed. They live in /run/g213colors, which
+  *  systemd-tmpfiles creates root:g213colors mode 3770 (sticky, so members cannot unlink
+  *  each other's files), and are created mode 0660: root's
+  *  service and the members of the g213colors group share them, other users can neither
+  *  hold a unit's lock nor queue frames for it. A user outside the group gets private
+  *  files in their runtime directory instead. Contention and wait times go to the
+  *  device_lock_contended, device_lock_wait and requests_coalesced metrics.
+'''
+
+import fcntl
+import logging
+import os
+import time
+
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SHARED_LOCK_DIR = "/run/g213colors" # root:g213colors 3770, see g213colors.tmpfiles
+DEFAULT_TIMEOUT = 30.0 # Seconds to queue for a device before giving up
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.1
+
+
+def lock_directory():
+    """/run/g213colors for root and the g213colors group, else a directory only this user can write."""
+    if os.access(SHARED_LOCK_DIR, os.W_OK | os.X_OK):
+        return SHARED_LOCK_DIR
+    if os.geteuid() == 0:
+        return "/run"
+    return os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+
+
+def open_shared(path):
+    """Opens (creating) a file the owner and the directory's group may write; never follows a symlink."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC | os.O_NOFOLLOW, 0o660)
+    try:
+        if os.fstat(fd).st_uid == os.geteuid():
+            os.fchmod(fd, 0o660) # Undo the umask so the rest of the group can queue too
+    except OSError:
+        pass
+    return fd
+
+
+class DeviceLock:
+    """Exclusive lock on one physical unit ("G213@1-2.3"), held by one LogitechDevice at a time."""
+
+    def __init__(self, identity, directory=None):
+        self.identity = identity
+        directory = directory or lock_directory()
+        self.path = os.path.join(directory, f"g213colors-{identity.replace('/', '_')}.lock")
+        self.pending_path = self.path[:-len(".lock")] + ".pending"
+        self.waiting_path = self.path[:-len(".lock")] + ".waiting"
+        self.metric_labels = (("product", identity.split("@", 1)[0]),)
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def _try_lock(self):
+        fd = open_shared(self.path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def acquire(self, timeout=DEFAULT_TIMEOUT):
+        """Waits up to timeout seconds for the unit; True once it is ours."""
+        if self.held:
+            return True
+        try:
+            if self._try_lock():
+                return True
+        except OSError as e:
+            logger.warning(f"Cannot lock {self.path} ({e}); continuing without arbitration.")
+            return True
+        logger.info(f"{self.identity} is in use by another process; waiting.")
+        started = time.monotonic()
+        if METRICS.enabled:
+            METRICS.inc("device_lock_contended", self.metric_labels)
+        waiting_fd = self._announce_waiting()
+        try:
+            interval = POLL_INTERVAL
+            while not self._try_lock():
+                if time.monotonic() - started >= timeout:
+                    logger.error(f"Gave up waiting {timeout:.0f} s for {self.identity}.")
+                    return False
+                time.sleep(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        finally:
+            if waiting_fd is not None:
+                os.close(waiting_fd)
+        if METRICS.enabled:
+            METRICS.observe("device_lock_wait", time.monotonic() - started, self.metric_labels)
+        logger.debug(f"Got {self.identity} after {time.monotonic() - started:.3f} s.")
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd) # Closing the only descriptor drops the flock
+            self._fd = None
+
+    def _announce_waiting(self):
+        try:
+            fd = open_shared(self.waiting_path)
+            fcntl.flock(fd, fcntl.LOCK_SH) # Only ever blocks for a holder's instant probe
+            return fd
+        except OSError:
+            return None
+
+    def others_waiting(self):
+        """True if another process is queued for this unit, i.e. holds the .waiting file shared."""
+        try:
+            fd = open_shared(self.waiting_path)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def _swap_pending(self, content, only_if_empty=False):
+        """Replaces the .pending file's content under its own short flock; returns the old content.
+
+        With only_if_empty the content is left as it is when something is already pending.
+        """
+        fd = open_shared(self.pending_path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            old = os.pread(fd, 1 << 16, 0)
+            if only_if_empty and old:
+                return old
+            os.ftruncate(fd, 0)
+            if content:
+                os.pwrite(fd, content, 0)
+            return old
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _pending_content(token, frames):
+        return f"{token}\n{' '.join(frame.hex() for frame in frames)}\n".encode()
+
+    def submit(self, frames, timeout=DEFAULT_TIMEOUT):
+        """Queues a one-shot write of frames (bytes) and returns once the lock is held.
+
+        Returns the frames to write now (ours, or a newer request left by another
+        process) with the lock held, None if a newer request was already applied
+        (lock released), or False on timeout.
+        """
+        try:
+            if self._try_lock():
+                self._swap_pending(b"") # Anything still pending is older than this request
+                return frames
+            token = f"{os.getpid()}-{time.monotonic_ns()}"
+            self._swap_pending(self._pending_content(token, frames))
+        except OSError as e:
+            logger.warning(f"Cannot lock {self.path} ({e}); continuing without arbitration.")
+            return frames
+        if not self.acquire(timeout):
+            self._take_if_ours(token)
+            return False
+        pending = self._swap_pending(b"")
+        if not pending:
+            if METRICS.enabled:
+                METRICS.inc("requests_coalesced", self.metric_labels)
+            logger.info(f"A newer request for {self.identity} was applied while this one waited.")
+            self.release()
+            return None
+        pending_token, _, hex_frames = pending.decode("ascii", "replace").partition("\n")
+        if pending_token != token:
+            if METRICS.enabled:
+                METRICS.inc("requests_coalesced", self.metric_labels)
+            logger.info(f"Applying the newest queued request for {self.identity} instead of this one.")
+        try:
+            return [bytes.fromhex(frame) for frame in hex_frames.split()]
+        except ValueError:
+            logger.warning(f"Ignoring a malformed queued request in {self.pending_path}.")
+            return frames
+
+    def requeue(self, frames):
+        """Puts frames returned by submit() back in .pending, unless a newer request is waiting there.
+
+        For when they could not be written after all (e.g. connect() failed): whoever gets
+        the unit next applies them instead of them being lost.
+        """
+        try:
+            self._swap_pending(self._pending_content(f"{os.getpid()}-{time.monotonic_ns()}", frames), only_if_empty=True)
+        except OSError as e:
+            logger.warning(f"Could not requeue frames for {self.identity}: {e}")
+
+    def _take_if_ours(self, token):
+        try:
+            pending = self._swap_pending(b"")
+            if pending and not pending.startswith(token.encode() + b"\n"):
+                self._swap_pending(pending) # Someone newer is still waiting for it
+        except OSError:
+            pass
@@ -0,0 +1,152 @@
+'''
+  *  Counters and latency histograms for the USB hot path.
+  *
+  *  Disabled by default: every instrumented call site checks METRICS.enabled before
+  *  touching a clock, so the cost when off is one attribute lookup. Enable with
+  *  METRICS.enable() (or G213COLORS_METRICS=1), then export with snapshot() as
+  *  JSON or write_prometheus_textfile() for node_exporter's textfile collector.
+  *  Setting G213COLORS_METRICS_TEXTFILE=<path> enables metrics and writes that
+  *  file when the process exits, which suits the one-shot service invocations.
+'''
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds, 50 µs .. 1 s
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+PROMETHEUS_PREFIX = "g213colors_"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+class Metrics:
+    """Registry of named counters and histograms, each series keyed by a tuple of (label, value) pairs."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {} # name -> {labels tuple: value}
+        self.histograms = {} # name -> {labels tuple: Histogram}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Returns a JSON-serializable copy of every series."""
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [dict(histogram.to_dict(), labels=dict(labels)) for labels, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Renders the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                metric = PROMETHEUS_PREFIX + name + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in series.items():
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                metric = PROMETHEUS_PREFIX + name + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_textfile(self, path):
+        """Atomically replaces path (e.g. /var/lib/node_exporter/textfile/g213colors.prom)."""
+        directory = os.path.dirname(path) or "."
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".g213colors-", suffix=".prom")
+            with os.fdopen(fd, "w") as f:
+                f.write(self.to_prometheus())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+            return True
+        except OSError as e:
+            logger.error(f"Failed to write metrics textfile {path}: {e}")
+            return False
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+METRICS = Metrics(enabled=os.environ.get("G213COLORS_METRICS") == "1")
+
+_textfile = os.environ.get("G213COLORS_METRICS_TEXTFILE")
+if _textfile:
+    METRICS.enable()
+    atexit.register(METRICS.write_prometheus_textfile, _textfile)
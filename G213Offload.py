@@ -0,0 +1,133 @@
+'''
+  *  Hardware offload planner for G213Colors animations.
+  *
+  *  A host-driven animation costs a USB write per changed zone per frame and keeps
+  *  the kernel driver detached (no multimedia keys) for as long as it runs. The
+  *  devices can breathe and cycle on their own after a single write. plan() samples
+  *  one loop of an Effect and picks the cheapest equivalent:
+  *
+  *      static    the colors never change (within tolerance): color frames
+  *      breathe   one color on every zone, fading to dark and back: a breathe frame
+  *      cycle     every zone the same fully saturated hue, going once round the
+  *                color wheel at a steady pace: a cycle frame
+  *      host      anything else, streamed frame by frame by an Animator
+  *
+  *  Only effects with a fixed period (LoopEffect, PulseEffect, ChaseEffect, looping
+  *  KeyframeEffect) are considered; data-driven ones like G213Load always stream.
+'''
+
+import colorsys
+import logging
+from collections import namedtuple
+
+import G213Colors
+from G213Animation import PRODUCT_ZONES, KeyframeEffect, rgb_to_hex
+from G213Metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 12 # Largest per-channel difference (0-255) still called equivalent
+MAX_SAMPLES = 240
+MIN_SPEED_MS = 500 # Range of the breathe/cycle speed field
+MAX_SPEED_MS = 65535
+DARK_LEVEL = 0.1 # A breathe fades at least this far down
+
+# frames are what to send for the hardware paths (None for host); host_writes_per_second
+# is what streaming the effect would cost, i.e. what offloading saves
+OffloadPlan = namedtuple("OffloadPlan", ["path", "frames", "reason", "host_writes_per_second"])
+
+
+def effect_period(effect):
+    """Seconds after which effect repeats, or None if it does not."""
+    if isinstance(effect, KeyframeEffect):
+        return effect.duration if effect.loop and effect.duration > 0 else None
+    return getattr(effect, "period", None)
+
+
+def _host_writes(samples, period):
+    writes = sum(
+        sum(1 for a, b in zip(samples[i - 1], frame) if a != b) # i = 0 compares with the last frame: it loops
+        for i, frame in enumerate(samples)
+    )
+    return writes / period
+
+
+def _close(a, b, tolerance):
+    return all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+def _breathe_color(colors, tolerance):
+    """The peak color if colors are one color scaled from near dark to full, else None."""
+    peak = max(colors, key=max)
+    if max(peak) == 0 or min(max(color) for color in colors) > DARK_LEVEL * max(peak):
+        return None
+    for color in colors:
+        level = max(color) / max(peak)
+        if not _close(color, [channel * level for channel in peak], tolerance):
+            return None
+    return peak
+
+
+def _is_hue_cycle(colors, tolerance):
+    """True if colors go once round the hue circle, forwards, at full saturation and a steady pace."""
+    step = 1.0 / len(colors)
+    hsv = [colorsys.rgb_to_hsv(*(channel / 255 for channel in color)) for color in colors]
+    if any(s < 1 - tolerance / 255 or v < 1 - tolerance / 255 for _, s, v in hsv):
+        return False
+    for i, (hue, _, _) in enumerate(hsv):
+        advance = (hue - hsv[i - 1][0]) % 1.0
+        if abs(advance - step) > tolerance / 255 / 6: # One channel off by tolerance shifts the hue by up to tolerance/(6*255)
+            return False
+    return True
+
+
+def plan(effect, product_name, fps=30, tolerance=DEFAULT_TOLERANCE):
+    """Returns the OffloadPlan for running effect on a product_name unit."""
+    zone_count = len(PRODUCT_ZONES[product_name])
+    period = effect_period(effect)
+    if period is None:
+        return _chosen(product_name, OffloadPlan("host", None, "the effect does not repeat", None))
+    frame_count = max(2, min(MAX_SAMPLES, round(period * fps)))
+    effect.prepare(fps, zone_count)
+    samples = [list(effect.colors_at(period * i / frame_count, zone_count)) for i in range(frame_count)]
+    host_writes = _host_writes(samples, period)
+
+    if all(_close(a, b, tolerance) for frame in samples for a, b in zip(frame, samples[0])):
+        colors = samples[0]
+        if all(color == colors[0] for color in colors):
+            frames = [G213Colors.build_frame(product_name, "color", (0, rgb_to_hex(colors[0])))]
+        else:
+            frames = [G213Colors.build_frame(product_name, "color", (zone, rgb_to_hex(color)))
+                      for zone, color in zip(PRODUCT_ZONES[product_name], colors)]
+        return _chosen(product_name, OffloadPlan("static", frames, "the colors do not change", host_writes))
+
+    if not all(_close(color, frame[0], tolerance) for frame in samples for color in frame):
+        return _chosen(product_name, OffloadPlan("host", None, "the zones show different colors", host_writes))
+    speed = round(period * 1000)
+    if not MIN_SPEED_MS <= speed <= MAX_SPEED_MS:
+        return _chosen(product_name, OffloadPlan("host", None, f"a {period:g} s period is outside the hardware's range",
+                                                 host_writes))
+    colors = [frame[0] for frame in samples]
+    peak = _breathe_color(colors, tolerance)
+    if peak is not None:
+        frame = G213Colors.build_frame(product_name, "breathe", (rgb_to_hex(peak), speed))
+        return _chosen(product_name, OffloadPlan("breathe", [frame], f"one color pulsing every {period:g} s", host_writes))
+    if _is_hue_cycle(colors, tolerance):
+        frame = G213Colors.build_frame(product_name, "cycle", (speed,))
+        return _chosen(product_name, OffloadPlan("cycle", [frame], f"the full spectrum every {period:g} s", host_writes))
+    return _chosen(product_name, OffloadPlan("host", None, "no hardware effect matches", host_writes))
+
+
+def describe(offload_plan):
+    """One line saying which path was chosen and why, for logs and command output."""
+    if offload_plan.path == "host":
+        return f"Streaming from the host: {offload_plan.reason}."
+    saved = f", saving about {offload_plan.host_writes_per_second:.0f} USB writes/s" if offload_plan.host_writes_per_second else ""
+    return f"Offloaded to hardware {offload_plan.path} ({offload_plan.reason}){saved}."
+
+
+def _chosen(product_name, offload_plan):
+    if METRICS.enabled:
+        METRICS.inc("offload_plans", (("product", product_name), ("path", offload_plan.path)))
+    logger.info(f"{product_name}: {describe(offload_plan)}")
+    return offload_plan
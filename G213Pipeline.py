@@ -0,0 +1,189 @@
+'''
+  *  Color pipeline for G213Colors: what an RGB value chosen on screen becomes on the LEDs.
+  *
+  *  Screen colors are gamma encoded, the LEDs' PWM is linear, so sending the 8-bit
+  *  value unchanged makes every mid tone look washed out. ColorPipeline holds one
+  *  256-entry lookup table per channel combining gamma, white balance and brightness,
+  *  computed once per product; correcting a color is three table lookups.
+  *  G213Colors.build_frame runs every color and breathe command through it, so the GUI,
+  *  CLI, daemon and animations all share one correction (and its LRU cache).
+  *
+  *  Per-product defaults are in PRODUCT_DEFAULTS: gamma 2.2 for both, and the G213's
+  *  white balance maps ffffff to the keyboard's standard white (ffb4aa). G213COLORS_GAMMA,
+  *  G213COLORS_BRIGHTNESS and G213COLORS_WHITE_BALANCE ("1,0.9,0.8") override them for
+  *  every product, G213COLORS_GAMMA_G213 (etc., with the product name) for one product.
+  *
+  *  Saved frames are device bytes and are always sent as stored. Profiles record the
+  *  PIPELINE_VERSION their frames were built with; frames saved before the pipeline
+  *  existed, .conf files and hand-written hex are RAW_FRAMES and keep their exact bytes.
+  *
+  *  gradient_timeline() and palette() interpolate whole animations in one pass, with
+  *  NumPy when it is installed and a pure-Python loop (same result) when it is not.
+  *  NumPy is only imported by the first of those calls, never when a command starts.
+'''
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_DEFAULTS = {
+    "G213": {"gamma": 2.2, "white_balance": (1.0, 0.706, 0.667), "brightness": 1.0}, # ffffff -> ffb4aa
+    "G203": {"gamma": 2.2, "white_balance": (1.0, 1.0, 1.0), "brightness": 1.0},
+}
+FALLBACK_DEFAULTS = {"gamma": 2.2, "white_balance": (1.0, 1.0, 1.0), "brightness": 1.0}
+
+# Stored with saved profiles: what turned screen colors into their frames
+RAW_FRAMES = 0 # Frames given as device bytes (or saved before the pipeline), never re-corrected
+PIPELINE_VERSION = 1 # Frames built by build_frame through the per-product pipeline
+
+# Hue 0..1 at full saturation and value is linear between these six colors
+RAINBOW_STOPS = ((255, 0, 0), (255, 255, 0), (0, 255, 0), (0, 255, 255), (0, 0, 255), (255, 0, 255))
+
+_numpy_module = False # Not looked for yet; None once known to be missing
+
+
+def _numpy():
+    """The numpy module, or None if it is not installed; imported on first use."""
+    global _numpy_module
+    if _numpy_module is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_module = numpy
+    return _numpy_module
+
+
+def as_rgb(color):
+    """(r, g, b) of a hex string, bytes or sequence."""
+    return tuple(bytes.fromhex(color)) if isinstance(color, str) else tuple(color)
+
+
+def rgba_to_hex(red, green, blue):
+    """Hex string of 0.0-1.0 float channels (e.g. Gdk.RGBA), rounded to the nearest 8-bit value."""
+    return "".join(f"{min(255, max(0, int(channel * 255 + 0.5))):02x}" for channel in (red, green, blue))
+
+
+class ColorPipeline:
+    """Gamma, white balance and brightness folded into one lookup table per channel."""
+
+    def __init__(self, gamma=1.0, white_balance=(1.0, 1.0, 1.0), brightness=1.0):
+        if gamma <= 0 or brightness < 0 or min(white_balance) < 0:
+            raise ValueError("Gamma must be positive, brightness and white balance not negative")
+        self.gamma = gamma
+        self.white_balance = tuple(white_balance)
+        self.brightness = brightness
+        self.tables = tuple(
+            bytes(min(255, int(255 * brightness * scale * (value / 255) ** gamma + 0.5)) for value in range(256))
+            for scale in self.white_balance
+        )
+        self.identity = all(table == bytes(range(256)) for table in self.tables)
+
+    def apply(self, color):
+        """Corrected bytes(r, g, b) of a hex string, bytes or (r, g, b) sequence."""
+        rgb = as_rgb(color)
+        if len(rgb) != 3 or not all(0 <= channel <= 255 for channel in rgb):
+            raise ValueError(f"Invalid RGB value: {color!r}")
+        red, green, blue = self.tables
+        return bytes((red[rgb[0]], green[rgb[1]], blue[rgb[2]]))
+
+
+def _env_setting(name, product_name):
+    """$G213COLORS_<NAME>_<PRODUCT>, else $G213COLORS_<NAME>, else None."""
+    return os.environ.get(f"G213COLORS_{name}_{product_name}") or os.environ.get(f"G213COLORS_{name}") or None
+
+
+def _env_defaults(product_name):
+    settings = dict(PRODUCT_DEFAULTS.get(product_name, FALLBACK_DEFAULTS))
+    try:
+        gamma = _env_setting("GAMMA", product_name)
+        if gamma:
+            settings["gamma"] = float(gamma)
+        brightness = _env_setting("BRIGHTNESS", product_name)
+        if brightness:
+            settings["brightness"] = float(brightness)
+        white_balance = _env_setting("WHITE_BALANCE", product_name)
+        if white_balance:
+            settings["white_balance"] = tuple(float(part) for part in white_balance.split(","))
+            if len(settings["white_balance"]) != 3:
+                raise ValueError("G213COLORS_WHITE_BALANCE needs three comma separated factors")
+    except ValueError as e:
+        logger.error(f"Ignoring color pipeline environment settings: {e}")
+        return dict(PRODUCT_DEFAULTS.get(product_name, FALLBACK_DEFAULTS))
+    return settings
+
+
+_pipelines = {} # product_name -> ColorPipeline
+
+
+def pipeline_for(product_name):
+    """Returns the product's ColorPipeline, building its tables on first use."""
+    pipeline = _pipelines.get(product_name)
+    if pipeline is None:
+        pipeline = _pipelines[product_name] = ColorPipeline(**_env_defaults(product_name))
+    return pipeline
+
+
+def set_pipeline(product_name, pipeline):
+    """Replaces a product's pipeline; use G213Colors.set_color_pipeline, which also drops cached frames."""
+    _pipelines[product_name] = pipeline
+
+
+def _interpolate(stops, position):
+    position = (position % 1.0) * len(stops)
+    index = int(position) % len(stops)
+    a, b, f = stops[index], stops[(index + 1) % len(stops)], position - int(position)
+    return (int(a[0] + (b[0] - a[0]) * f + 0.5), int(a[1] + (b[1] - a[1]) * f + 0.5), int(a[2] + (b[2] - a[2]) * f + 0.5))
+
+
+def gradient_timeline(stops, zone_count, frame_count, zone_step=None, scale=1.0):
+    """Colors of a gradient looping through stops and scrolled across the zones, for a whole loop.
+
+    Returns frame_count lists of zone_count (r, g, b) tuples: zone z of frame f shows
+    position f / frame_count + z * zone_step of the closed gradient (zone_step defaults
+    to 1 / zone_count, negative scrolls the other way). scale dims every color.
+    """
+    stops = [as_rgb(stop) for stop in stops]
+    if zone_step is None:
+        zone_step = 1.0 / zone_count
+    numpy = _numpy()
+    if numpy is None:
+        timeline = []
+        for f in range(frame_count):
+            frame = [_interpolate(stops, f / frame_count + z * zone_step) for z in range(zone_count)]
+            if scale != 1.0:
+                frame = [tuple(int(channel * scale + 0.5) for channel in color) for color in frame]
+            timeline.append(frame)
+        return timeline
+    table = numpy.asarray(stops, dtype=numpy.float64)
+    positions = numpy.add.outer(numpy.arange(frame_count) / frame_count, numpy.arange(zone_count) * zone_step)
+    positions = numpy.mod(positions, 1.0) * len(stops)
+    index = positions.astype(numpy.int64) % len(stops)
+    fraction = (positions - numpy.floor(positions))[..., None]
+    a, b = table[index], table[(index + 1) % len(stops)]
+    colors = numpy.floor(a + (b - a) * fraction + 0.5)
+    if scale != 1.0:
+        colors = numpy.floor(colors * scale + 0.5)
+    return [[tuple(zone) for zone in frame] for frame in colors.astype(numpy.uint8).tolist()]
+
+
+def palette(stops, levels):
+    """levels colors evenly spaced from the first to the last stop (an open gradient, unlike gradient_timeline)."""
+    stops = [as_rgb(stop) for stop in stops]
+    if levels < 2 or len(stops) < 2:
+        return [stops[0]] * levels
+    numpy = _numpy()
+    if numpy is None:
+        colors = []
+        for level in range(levels):
+            position = level / (levels - 1) * (len(stops) - 1)
+            index = min(int(position), len(stops) - 2)
+            a, b, f = stops[index], stops[index + 1], position - index
+            colors.append(tuple(int(a[c] + (b[c] - a[c]) * f + 0.5) for c in range(3)))
+        return colors
+    positions = numpy.linspace(0, len(stops) - 1, levels)
+    table = numpy.asarray(stops, dtype=numpy.float64)
+    return [tuple(color) for color in numpy.stack(
+        [numpy.floor(numpy.interp(positions, numpy.arange(len(stops)), table[:, c]) + 0.5) for c in range(3)], axis=-1
+    ).astype(numpy.uint8).tolist()]
@@ -0,0 +1,271 @@
+'''
+  *  Compiled profile store for G213Colors.
+  *
+  *  Holds any number of named profiles per product in one indexed binary file
+  *  (~/.config/G213Colors/profiles.g2p). Frames are validated against the product's
+  *  command templates and compiled to binary when a profile is saved, so applying one
+  *  is an mmap slice with nothing left to parse or fail on.
+  *
+  *  Each profile records the G213Pipeline version its frames were built with. Frames
+  *  given as hex, imported from .conf files or saved by a version 1 store are
+  *  RAW_FRAMES: like every profile they are sent byte for byte, whatever the color
+  *  pipeline defaults are now.
+  *
+  *  File layout (little endian):
+  *      header   "G2PF", version u16, profile count u16, crc32 u32 of everything after the header
+  *      index    per profile: product 8s, name 32s, data offset u32, frame count u16, frame size u16,
+  *               pipeline version u8 (not in version 1 files)
+  *      data     the frames of every profile, back to back
+  *
+  *  The legacy PRODUCT=/hex-line .conf files are still read (LogitechDevice.read_configuration);
+  *  convert_legacy_configs() imports a whole config directory once.
+'''
+
+import glob
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+import G213Colors
+import G213Pipeline
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"G2PF"
+VERSION = 2
+HEADER = struct.Struct("<4sHHI")
+ENTRY = struct.Struct("<8s32sIHHB")
+ENTRY_V1 = struct.Struct("<8s32sIHH") # Read only; its profiles are RAW_FRAMES
+MAX_NAME_BYTES = 32
+
+USER_PROFILE_STORE = os.path.join(G213Colors.USER_CONFIG_DIR, "profiles.g2p")
+DEFAULT_PROFILE = "default" # What the GUI and --save write, and what apply --user applies
+
+
+def unit_profile_name(unit):
+    """Name of the profile that overrides DEFAULT_PROFILE for one unit, e.g. 'default@1-2.3'."""
+    return f"{DEFAULT_PROFILE}@{unit}"
+
+
+def compile_frames(product_name, frames):
+    """Returns frames (hex strings or bytes) as validated binary frames; ValueError on the first bad one."""
+    if product_name not in G213Colors.LogitechDevice.PRODUCT_SPECS:
+        raise ValueError(f"Unsupported product: {product_name}")
+    if not frames:
+        raise ValueError("A profile needs at least one frame")
+    templates = [G213Colors.get_frame_template(product_name, mode) for mode in G213Colors.LogitechDevice.COMMAND_FIELDS]
+    compiled = []
+    for number, frame in enumerate(frames, 1):
+        try:
+            frame = bytes.fromhex(frame.strip()) if isinstance(frame, str) else bytes(frame)
+        except ValueError:
+            raise ValueError(f"Frame {number} is not valid hex: {frame!r}")
+        if not any(template.matches(frame) for template in templates):
+            raise ValueError(f"Frame {number} is not a {product_name} color, breathe or cycle command: {frame.hex()}")
+        compiled.append(frame)
+    if len({len(frame) for frame in compiled}) != 1:
+        raise ValueError("All frames of a profile must have the same length")
+    return compiled
+
+
+class ProfileStore:
+    """Reads and writes one profile file; reads are served from a read-only mmap."""
+
+    def __init__(self, path=USER_PROFILE_STORE):
+        self.path = path
+        self._index = {} # (product_name, name) -> (offset, frame count, frame size, pipeline version)
+        self._map = None
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """(Re)maps the file if it changed since the last look; ValueError if it is corrupt."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._index, self._map, self._loaded_mtime = {}, None, None
+            return
+        if stat.st_mtime_ns == self._loaded_mtime:
+            return
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        if len(data) < HEADER.size:
+            raise ValueError(f"{self.path} is too short to be a profile store")
+        magic, version, count, crc = HEADER.unpack_from(data)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"{self.path} is not a version {VERSION} profile store")
+        if zlib.crc32(memoryview(data)[HEADER.size:]) != crc:
+            raise ValueError(f"{self.path} is corrupt (checksum mismatch)")
+        entry = ENTRY if version == VERSION else ENTRY_V1
+        index = {}
+        for number in range(count):
+            product, name, offset, frame_count, frame_size, *pipeline = entry.unpack_from(data, HEADER.size + number * entry.size)
+            key = (product.rstrip(b"\0").decode(), name.rstrip(b"\0").decode())
+            index[key] = (offset, frame_count, frame_size, pipeline[0] if pipeline else G213Pipeline.RAW_FRAMES)
+        self._index, self._map, self._loaded_mtime = index, data, stat.st_mtime_ns
+
+    def get(self, product_name, name):
+        """Returns the profile's binary frames, or None if there is no such profile."""
+        with self._lock:
+            self._load()
+            entry = self._index.get((product_name, name))
+            if entry is None:
+                return None
+            offset, frame_count, frame_size, _ = entry
+            return [self._map[offset + i * frame_size:offset + (i + 1) * frame_size] for i in range(frame_count)]
+
+    def pipeline_version(self, product_name, name):
+        """The G213Pipeline version the profile's frames were built with, or None if there is no such profile."""
+        with self._lock:
+            self._load()
+            entry = self._index.get((product_name, name))
+            return None if entry is None else entry[3]
+
+    def names(self, product_name=None):
+        """Returns [(product_name, name)] of every stored profile, sorted."""
+        with self._lock:
+            self._load()
+            return sorted(key for key in self._index if product_name is None or key[0] == product_name)
+
+    def _read_all(self):
+        self._load()
+        profiles = {}
+        for key, (offset, frame_count, frame_size, pipeline_version) in self._index.items():
+            frames = [self._map[offset + i * frame_size:offset + (i + 1) * frame_size] for i in range(frame_count)]
+            profiles[key] = (frames, pipeline_version)
+        return profiles
+
+    def _write_all(self, profiles):
+        index = b""
+        data = b""
+        data_start = HEADER.size + ENTRY.size * len(profiles)
+        for (product_name, name), (frames, pipeline_version) in sorted(profiles.items()):
+            index += ENTRY.pack(product_name.encode(), name.encode(), data_start + len(data), len(frames), len(frames[0]),
+                                pipeline_version)
+            data += b"".join(frames)
+        body = index + data
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".profiles-", suffix=".g2p")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(profiles), zlib.crc32(body)) + body)
+            os.replace(temp_path, self.path) # Readers keep their mmap of the old file
+        except OSError:
+            os.unlink(temp_path)
+            raise
+
+    def save(self, product_name, name, frames, pipeline_version=G213Pipeline.RAW_FRAMES):
+        """Validates, compiles and stores frames as product_name/name; True on success.
+
+        pipeline_version is G213Pipeline.PIPELINE_VERSION for frames from build_frame.
+        """
+        try:
+            if not name or len(name.encode()) > MAX_NAME_BYTES or "\0" in name:
+                raise ValueError(f"Profile names must be 1-{MAX_NAME_BYTES} bytes")
+            compiled = compile_frames(product_name, frames)
+            with self._lock:
+                profiles = self._read_all()
+                profiles[(product_name, name)] = (compiled, pipeline_version)
+                self._write_all(profiles)
+            logger.info(f"Saved profile {product_name}/{name} ({len(compiled)} frame(s)) to {self.path}")
+            return True
+        except ValueError as e:
+            logger.error(f"Not saving profile {product_name}/{name}: {e}")
+            return False
+        except OSError as e:
+            logger.error(f"Failed to write profile store {self.path}: {e}")
+            return False
+
+    def delete(self, product_name, name):
+        try:
+            with self._lock:
+                profiles = self._read_all()
+                if profiles.pop((product_name, name), None) is None:
+                    return False
+                self._write_all(profiles)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to delete profile {product_name}/{name}: {e}")
+            return False
+
+    def apply(self, product_name, name, unit=None, force=False):
+        """Applies a stored profile with LogitechDevice.apply_commands; False if it does not exist."""
+        try:
+            frames = self.get(product_name, name)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read profile store {self.path}: {e}")
+            return False
+        if frames is None:
+            logger.error(f"No profile {product_name}/{name} in {self.path}")
+            return False
+        return G213Colors.LogitechDevice.apply_commands(product_name, frames, unit, force, f"profile {name}")
+
+
+def user_frames(product_name, unit, config_dir=G213Colors.USER_CONFIG_DIR, store=None):
+    """Returns (source, frames) of the user's settings for a unit, or (None, None).
+
+    Looks at the unit's and then the product's default profile in the store, then the
+    legacy <PRODUCT>@<unit>.conf and <PRODUCT>.conf files.
+    """
+    store = store or ProfileStore(os.path.join(config_dir, os.path.basename(USER_PROFILE_STORE)))
+    names = [DEFAULT_PROFILE] if unit is None else [unit_profile_name(unit), DEFAULT_PROFILE]
+    for name in names:
+        try:
+            frames = store.get(product_name, name)
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring profile store {store.path}: {e}")
+            break
+        if frames is not None:
+            return f"profile {name}", frames
+    legacy_names = [product_name] if unit is None else [f"{product_name}@{unit}", product_name]
+    for legacy_name in legacy_names:
+        path = os.path.join(config_dir, f"{legacy_name}.conf")
+        if not os.path.exists(path):
+            continue
+        try:
+            file_product, commands = G213Colors.LogitechDevice.read_configuration(path)
+            if file_product != product_name:
+                raise ValueError(f"it is for {file_product}, not {product_name}")
+            return path, compile_frames(product_name, commands)
+        except (ValueError, IOError) as e:
+            logger.error(f"Skipping {path}: {e}")
+    return None, None
+
+
+def save_user_profile(product_name, frames, unit=None, config_dir=G213Colors.USER_CONFIG_DIR,
+                      pipeline_version=G213Pipeline.PIPELINE_VERSION):
+    """Stores frames (built by build_frame unless pipeline_version says otherwise) as the user's default profile."""
+    store = ProfileStore(os.path.join(config_dir, os.path.basename(USER_PROFILE_STORE)))
+    return store.save(product_name, DEFAULT_PROFILE if unit is None else unit_profile_name(unit), frames, pipeline_version)
+
+
+def convert_legacy_configs(config_dir=G213Colors.USER_CONFIG_DIR, store=None, remove=False):
+    """One-shot import of every <PRODUCT>[@<unit>].conf in config_dir; returns the number converted.
+
+    Each file becomes the product's (or unit's) default profile. With remove, converted
+    files are deleted afterwards.
+    """
+    store = store or ProfileStore(os.path.join(config_dir, os.path.basename(USER_PROFILE_STORE)))
+    converted = 0
+    for path in sorted(glob.glob(os.path.join(config_dir, "*.conf"))):
+        stem = os.path.basename(path)[:-len(".conf")]
+        product_name, _, unit = stem.partition("@")
+        try:
+            file_product, commands = G213Colors.LogitechDevice.read_configuration(path)
+        except (ValueError, IOError) as e:
+            logger.error(f"Skipping {path}: {e}")
+            continue
+        if file_product != product_name:
+            logger.error(f"Skipping {path}: it is for {file_product}, not {product_name}.")
+            continue
+        if not store.save(product_name, unit_profile_name(unit) if unit else DEFAULT_PROFILE, commands):
+            continue
+        converted += 1
+        if remove:
+            os.remove(path)
+    return converted
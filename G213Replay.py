@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+'''
+  *  Resume fast path for G213Colors (installed as /usr/bin/g213colors-replay).
+  *
+  *  Every successful LogitechDevice.apply_frames leaves the unit's complete frame set
+  *  in a compact binary blob on tmpfs ($XDG_RUNTIME_DIR or /run). After suspend,
+  *  g213colors.service runs this script, which reads the blobs and writes the frames
+  *  back as they are: no GTK, no argparse, no config parsing, and besides pyusb only
+  *  G213Colors is imported, to check the frames against its command templates. When
+  *  there is no blob (first boot) it hands over to 'g213colors apply --system'.
+  *
+  *  The service runs as root, so blobs are not trusted: only root's own blob and the
+  *  one of the user in front of seat0 are read, and a record is replayed only if it
+  *  targets a supported Logitech product with that product's wValue, ack mode and
+  *  frame gap and every frame matches one of the product's command templates.
+  *
+  *  Blob layout (little endian):
+  *      header   "G2RB", version u8, record count u8
+  *      record   idVendor u16, idProduct u16, wValue u16, needs_ack u8, bus u8,
+  *               frame gap in µs u32, port count u8, ports u8 * n,
+  *               frame count u8, frame size u8, frames
+'''
+
+import fcntl
+import logging
+import os
+import stat
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"G2RB"
+VERSION = 1
+HEADER = struct.Struct("<4sBB")
+RECORD = struct.Struct("<HHHBBIB")
+FRAMES = struct.Struct("<BB")
+BLOB_NAME = "g213colors-replay.bin"
+FALLBACK_COMMAND = ["/usr/bin/g213colors", "apply", "--system"]
+
+# Same transfer parameters as LogitechDevice; duplicated so the write loop needs no lookups
+USB_BM_REQUEST_TYPE = 0x21
+USB_BM_REQUEST = 0x09
+USB_W_INDEX = 0x0001
+USB_ENDPOINT_IN = 0x82
+ACK_TIMEOUT_MS = 100
+
+# Same per-unit lock files as G213Lock, so the replay queues behind an autostart or GUI write
+PRODUCT_NAMES = {0xc336: "G213", 0xc084: "G203"}
+LOCK_DIR = "/run/g213colors"
+LOCK_TIMEOUT = 10.0
+SEAT_STATE_PATH = "/run/systemd/seats/seat0"
+
+
+def default_blob_path():
+    if os.geteuid() == 0:
+        return os.path.join("/run", BLOB_NAME)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    return os.path.join(runtime_dir, BLOB_NAME)
+
+
+def read_blob(path):
+    """Returns the records of a blob as dicts; [] if it is missing or malformed."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return []
+    try:
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            return []
+        records = []
+        offset = HEADER.size
+        for _ in range(count):
+            id_vendor, id_product, w_value, needs_ack, bus, gap_us, port_count = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            ports = tuple(data[offset:offset + port_count])
+            offset += port_count
+            frame_count, frame_size = FRAMES.unpack_from(data, offset)
+            offset += FRAMES.size
+            frames = [data[offset + i * frame_size:offset + (i + 1) * frame_size] for i in range(frame_count)]
+            offset += frame_count * frame_size
+            records.append({
+                "idVendor": id_vendor, "idProduct": id_product, "wValue": w_value, "needs_ack": bool(needs_ack),
+                "bus": bus, "ports": ports, "gap": gap_us / 1e6, "frames": frames,
+            })
+        return records
+    except struct.error:
+        logger.warning(f"Ignoring truncated replay blob {path}")
+        return []
+
+
+def _record_key(record):
+    return (record["idVendor"], record["idProduct"], record["bus"], record["ports"])
+
+
+def write_blob(path, records):
+    import tempfile # Only writers need it; keeps the replay path's imports down
+    data = HEADER.pack(MAGIC, VERSION, len(records))
+    for record in records:
+        data += RECORD.pack(
+            record["idVendor"], record["idProduct"], record["wValue"], record["needs_ack"],
+            record["bus"], int(record["gap"] * 1e6), len(record["ports"])
+        )
+        data += bytes(record["ports"])
+        data += FRAMES.pack(len(record["frames"]), len(record["frames"][0]))
+        data += b"".join(record["frames"])
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".g213colors-replay-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        os.unlink(temp_path)
+        raise
+
+
+def update_blob(record, path=None):
+    """Replaces (or adds) the record of one unit; failures are logged, never raised."""
+    path = path or default_blob_path()
+    records = [existing for existing in read_blob(path) if _record_key(existing) != _record_key(record)]
+    records.append(record)
+    try:
+        write_blob(path, records[-255:])
+    except OSError as e:
+        logger.debug(f"Could not write replay blob {path}: {e}")
+
+
+def active_seat_uid(seat_state_path=SEAT_STATE_PATH):
+    """uid of the user in the foreground on seat0 as recorded by systemd-logind; None if nobody or unknown."""
+    try:
+        with open(seat_state_path) as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                if key == "ACTIVE_UID":
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def blob_paths():
+    """This user's blob, plus the active seat user's when run as root (only if that user owns it and alone can write it)."""
+    paths = [default_blob_path()]
+    uid = active_seat_uid() if os.geteuid() == 0 else None
+    if uid:
+        path = os.path.join("/run/user", str(uid), BLOB_NAME)
+        try:
+            info = os.lstat(path)
+        except OSError:
+            return paths
+        if stat.S_ISREG(info.st_mode) and info.st_uid == uid and not info.st_mode & 0o022:
+            paths.append(path)
+    return paths
+
+
+def valid_record(record):
+    """True if record only writes known command frames of a supported Logitech product."""
+    import G213Colors # Deferred until there is a blob to check; G213Colors imports this module
+    device_class = G213Colors.LogitechDevice
+    if record["idVendor"] != device_class.ID_VENDOR:
+        return False
+    product_name = next((name for name, spec in device_class.PRODUCT_SPECS.items() if spec["idProduct"] == record["idProduct"]), None)
+    if product_name is None:
+        return False
+    spec = device_class.PRODUCT_SPECS[product_name]
+    if record["wValue"] != spec["wValue"] or record["needs_ack"] != spec["needs_receive_after_color"]:
+        return False
+    if not 0 <= record["gap"] <= device_class.MAX_FRAME_GAP or not record["frames"]:
+        return False
+    templates = [G213Colors.get_frame_template(product_name, mode) for mode in device_class.COMMAND_FIELDS]
+    return all(any(template.matches(frame) for template in templates) for frame in record["frames"])
+
+
+def collect_records(paths):
+    """Newest valid record per unit across paths (by blob mtime)."""
+    by_mtime = []
+    for path in paths:
+        try:
+            by_mtime.append((os.stat(path).st_mtime_ns, path))
+        except OSError:
+            continue
+    records = {}
+    for _, path in sorted(by_mtime):
+        for record in read_blob(path):
+            if not valid_record(record):
+                logger.warning(f"Ignoring a record in {path} that is not a known command for a supported device.")
+                continue
+            records[_record_key(record)] = record
+    return list(records.values())
+
+
+def lock_unit(record, timeout=LOCK_TIMEOUT):
+    """Open file holding the unit's flock, or None when it cannot be had (the replay then goes ahead anyway)."""
+    name = PRODUCT_NAMES.get(record["idProduct"])
+    if name is None or not os.access(LOCK_DIR, os.W_OK | os.X_OK):
+        return None
+    path = os.path.join(LOCK_DIR, f"g213colors-{name}@{record['bus']}-{'.'.join(map(str, record['ports']))}.lock")
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC | os.O_NOFOLLOW, 0o660)
+    except OSError:
+        return None
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                logger.warning(f"{path} is still locked after {timeout:.0f} s; replaying anyway.")
+                os.close(fd)
+                return None
+            time.sleep(0.05)
+
+
+def replay(records, find, dispose=None):
+    """Writes each record's frames to its unit; find(idVendor, idProduct) yields pyusb-like devices.
+
+    Returns (units that got every frame, units where a write failed); unplugged units count as neither.
+    """
+    lit = failed = 0
+    for record in records:
+        device = next((
+            candidate for candidate in find(record["idVendor"], record["idProduct"])
+            if candidate.bus == record["bus"] and tuple(candidate.port_numbers or ()) == record["ports"]
+        ), None)
+        if device is None:
+            continue
+        lock_fd = lock_unit(record)
+        detached = False
+        try:
+            if device.is_kernel_driver_active(USB_W_INDEX):
+                device.detach_kernel_driver(USB_W_INDEX)
+                detached = True
+            for number, frame in enumerate(record["frames"]):
+                if number and not record["needs_ack"]:
+                    time.sleep(record["gap"])
+                device.ctrl_transfer(USB_BM_REQUEST_TYPE, USB_BM_REQUEST, record["wValue"], USB_W_INDEX, frame)
+                if record["needs_ack"]:
+                    try:
+                        device.read(USB_ENDPOINT_IN, 64, timeout=ACK_TIMEOUT_MS)
+                    except IOError:
+                        pass # A missing ack only costs the timeout, the frame was delivered
+            lit += 1
+        except IOError as e:
+            logger.error(f"Replay to {record['bus']}-{'.'.join(map(str, record['ports']))} failed: {e}")
+            failed += 1
+        finally:
+            if dispose is not None:
+                dispose(device)
+            if detached:
+                try:
+                    device.attach_kernel_driver(USB_W_INDEX)
+                except IOError:
+                    pass
+            if lock_fd is not None:
+                os.close(lock_fd)
+    return lit, failed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    records = collect_records(blob_paths())
+    if not records:
+        logger.info("No replay blob, applying the system default instead.")
+        os.execv(FALLBACK_COMMAND[0], FALLBACK_COMMAND)
+    import usb.core
+    import usb.util
+    lit, failed = replay(
+        records,
+        lambda id_vendor, id_product: usb.core.find(find_all=True, idVendor=id_vendor, idProduct=id_product),
+        usb.util.dispose_resources,
+    )
+    logger.info(f"Replayed the last applied frames to {lit} of {len(records)} unit(s).")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+'''
+  *  Scheduled profile changes for G213Colors (dim at night, bright during shifts).
+  *
+  *  Rules live in ~/.config/G213Colors/schedule.conf, one per line:
+  *
+  *      # when            product  profile  [unit]
+  *      22:00             G213     night
+  *      07:30@mon-fri     G213     day
+  *      09:00@sat,sun     G203     weekend  1-4
+  *      login+30m         G213     bright
+  *
+  *  "login+N" (s, m or h) counts from when the scheduler started, i.e. the daemon or
+  *  'g213colors schedule' run at login. Profiles are looked up in the profile store
+  *  when they are due, so editing a profile needs no reload.
+  *
+  *  All pending events sit in one heap; the scheduler thread sleeps in select() on a
+  *  timerfd armed for the earliest one (CLOCK_REALTIME, absolute, cancelled when the
+  *  clock is set), so nothing runs between events. After a clock change or a resume
+  *  that skipped events, each device gets the profile that should be showing now.
+  *  Without timerfd it falls back to sleeping at most FALLBACK_MAX_SLEEP seconds and
+  *  detecting jumps from the realtime/monotonic offset.
+'''
+
+import ctypes
+import datetime
+import errno
+import heapq
+import itertools
+import logging
+import os
+import re
+import select
+import threading
+import time
+
+import G213Colors
+import G213Profiles
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_FILE = os.path.join(G213Colors.USER_CONFIG_DIR, "schedule.conf")
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun") # datetime.weekday() order
+FALLBACK_MAX_SLEEP = 60.0
+CLOCK_JUMP_TOLERANCE = 1.0 # Seconds the realtime/monotonic offset may drift before we rebuild
+
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+TFD_TIMER_CANCEL_ON_SET = 2
+
+_TIME_RE = re.compile(r"^(\d{1,2}):(\d{2})(?:@([a-z,\-]+))?$")
+_LOGIN_RE = re.compile(r"^login\+(\d+)([smh])$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600}
+
+
+def _boottime():
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (AttributeError, OSError):
+        return time.monotonic()
+
+
+def _parse_days(text):
+    if text is None:
+        return frozenset(range(7))
+    days = set()
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        if first not in DAYS or (last and last not in DAYS):
+            raise ValueError(f"Unknown day in {text!r}; use {', '.join(DAYS)}")
+        day, end = DAYS.index(first), DAYS.index(last or first)
+        days.add(day)
+        while day != end: # Ranges may wrap around the week, e.g. fri-mon
+            day = (day + 1) % 7
+            days.add(day)
+    return frozenset(days)
+
+
+class ScheduleRule:
+    """One line of schedule.conf: a time of day on some weekdays, or a delay after login."""
+
+    def __init__(self, product_name, profile, unit=None, at=None, days=None, login_delay=None, line=None):
+        if product_name not in G213Colors.LogitechDevice.PRODUCT_SPECS:
+            raise ValueError(f"Unsupported product: {product_name}")
+        self.product_name = product_name
+        self.profile = profile
+        self.unit = unit
+        self.at = at # datetime.time, or None for login rules
+        self.days = days if days is not None else frozenset(range(7))
+        self.login_delay = login_delay
+        self.line = line
+        self.login_due = None # _boottime() a login rule fires at, set by Scheduler
+
+    @property
+    def target(self):
+        return (self.product_name, self.unit)
+
+    def next_after(self, now):
+        """Wall-clock time of the first occurrence after now, or None (a login rule that already fired)."""
+        if self.at is None:
+            if self.login_due is None:
+                return None
+            return now + max(0.0, self.login_due - _boottime())
+        today = datetime.date.fromtimestamp(now)
+        for offset in range(8):
+            day = today + datetime.timedelta(days=offset)
+            if day.weekday() in self.days:
+                # Naive local datetime: timestamp() goes through mktime, so DST is handled
+                when = datetime.datetime.combine(day, self.at).timestamp()
+                if when > now:
+                    return when
+        return None
+
+    def last_before(self, now):
+        """Wall-clock time of the latest occurrence at or before now (within a week), else None."""
+        if self.at is None:
+            return None
+        today = datetime.date.fromtimestamp(now)
+        for offset in range(8):
+            day = today - datetime.timedelta(days=offset)
+            if day.weekday() in self.days:
+                when = datetime.datetime.combine(day, self.at).timestamp()
+                if when <= now:
+                    return when
+        return None
+
+
+def parse_rule(line):
+    """Returns the ScheduleRule of one schedule.conf line, None for blank/comment lines; ValueError if invalid."""
+    fields = line.split("#", 1)[0].split()
+    if not fields:
+        return None
+    if len(fields) not in (3, 4):
+        raise ValueError("expected: <when> <product> <profile> [unit]")
+    when, product_name, profile = fields[:3]
+    unit = fields[3] if len(fields) == 4 else None
+    login = _LOGIN_RE.match(when.lower())
+    if login:
+        delay = int(login.group(1)) * _UNIT_SECONDS[login.group(2)]
+        return ScheduleRule(product_name, profile, unit, login_delay=delay, line=line.strip())
+    at = _TIME_RE.match(when.lower())
+    if not at:
+        raise ValueError(f"bad time {when!r}; use HH:MM, HH:MM@mon-fri or login+30m")
+    hour, minute = int(at.group(1)), int(at.group(2))
+    if hour > 23 or minute > 59:
+        raise ValueError(f"bad time {when!r}")
+    return ScheduleRule(product_name, profile, unit, at=datetime.time(hour, minute), days=_parse_days(at.group(3)),
+                        line=line.strip())
+
+
+def read_schedule(path=SCHEDULE_FILE):
+    """Returns the valid rules of a schedule file; bad lines are logged and skipped."""
+    rules = []
+    try:
+        with open(path, "r") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    rule = parse_rule(line)
+                except ValueError as e:
+                    logger.error(f"{path}:{number}: {e}")
+                    continue
+                if rule is not None:
+                    rules.append(rule)
+    except IOError as e:
+        logger.error(f"Cannot read schedule {path}: {e}")
+    return rules
+
+
+class _Timespec(ctypes.Structure):
+    # time_t is a long for the timerfd_settime symbol ctypes finds, on 32- and 64-bit glibc alike
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class _Itimerspec(ctypes.Structure):
+    _fields_ = [("it_interval", _Timespec), ("it_value", _Timespec)]
+
+
+class _TimerFd:
+    """CLOCK_REALTIME timerfd armed at absolute wall times; read() reports clock changes."""
+
+    def __init__(self):
+        if hasattr(os, "timerfd_create"): # Python 3.13+
+            self.fd = os.timerfd_create(time.CLOCK_REALTIME, flags=os.TFD_CLOEXEC)
+            self._libc = None
+        else:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            self._libc.timerfd_settime.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(_Itimerspec), ctypes.POINTER(_Itimerspec)]
+            self.fd = self._libc.timerfd_create(time.CLOCK_REALTIME, TFD_CLOEXEC)
+            if self.fd < 0:
+                raise OSError(ctypes.get_errno(), "timerfd_create failed")
+
+    def arm(self, wall_time):
+        """Fires at wall_time (0 disarms)."""
+        flags = TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET
+        if self._libc is None:
+            os.timerfd_settime(self.fd, flags=flags, initial=wall_time)
+            return
+        seconds = int(wall_time)
+        nanoseconds = int((wall_time - seconds) * 1e9)
+        spec = _Itimerspec(it_value=_Timespec(seconds, nanoseconds))
+        if self._libc.timerfd_settime(self.fd, flags, ctypes.byref(spec), None) < 0:
+            raise OSError(ctypes.get_errno(), "timerfd_settime failed")
+
+    def read(self):
+        """Returns False after an expiry, True if the clock was set (the timer must be rearmed)."""
+        try:
+            os.read(self.fd, 8)
+            return False
+        except OSError as e:
+            if e.errno == errno.ECANCELED:
+                return True
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Scheduler(threading.Thread):
+    """Applies rules when they are due.
+
+    apply_func(product_name, unit, frames) does the writing and returns True on success;
+    by default it goes through a DevicePool, so the handle stays open across quick
+    successive events. frames come from the profile store at store_path.
+    """
+
+    def __init__(self, rules, apply_func=None, store_path=G213Profiles.USER_PROFILE_STORE, catch_up=True):
+        super().__init__(name="Scheduler", daemon=True)
+        self.rules = rules
+        self.store = G213Profiles.ProfileStore(store_path)
+        self.catch_up = catch_up
+        self._pool = None
+        self.apply_func = apply_func or self._apply_with_pool
+        self.applied = 0
+        self.clock_changes = 0
+        self._heap = [] # (wall time, sequence, rule)
+        self._sequence = itertools.count()
+        self._stop_event = threading.Event()
+        self._wake_lock = threading.Lock()
+        self._wake_read = self._wake_write = None # Pipe for stop() to interrupt select(); open only while run() is
+        self._timer = None
+        started = _boottime()
+        for rule in rules:
+            if rule.login_delay is not None:
+                rule.login_due = started + rule.login_delay
+
+    def _apply_with_pool(self, product_name, unit, frames):
+        if self._pool is None:
+            self._pool = G213Colors.DevicePool()
+        return self._pool.call(product_name, lambda device: device.apply_frames(frames), unit)
+
+    def _apply(self, rule):
+        try:
+            frames = self.store.get(rule.product_name, rule.profile)
+        except (OSError, ValueError) as e:
+            logger.error(f"Cannot read profile store {self.store.path}: {e}")
+            return False
+        if frames is None:
+            logger.error(f"Scheduled profile {rule.product_name}/{rule.profile} does not exist ({rule.line}).")
+            return False
+        logger.info(f"Schedule: applying {rule.product_name}/{rule.profile}" + (f" to {rule.unit}" if rule.unit else ""))
+        ok = self.apply_func(rule.product_name, rule.unit, frames)
+        if ok:
+            self.applied += 1
+        else:
+            logger.error(f"Scheduled apply of {rule.product_name}/{rule.profile} failed.")
+        return ok
+
+    def _rebuild(self, now):
+        self._heap = []
+        for rule in self.rules:
+            when = rule.next_after(now)
+            if when is not None:
+                heapq.heappush(self._heap, (when, next(self._sequence), rule))
+
+    def _apply_current(self, now):
+        """Applies, per device, the time rule whose occurrence is the most recent one."""
+        latest = {}
+        for rule in self.rules:
+            when = rule.last_before(now)
+            if when is not None and (rule.target not in latest or when >= latest[rule.target][0]):
+                latest[rule.target] = (when, rule)
+        for _, rule in latest.values():
+            self._apply(rule)
+
+    def _run_due(self, now):
+        due = {} # target -> (wall time, rule); only the latest due rule per device is applied
+        while self._heap and self._heap[0][0] <= now:
+            when, _, rule = heapq.heappop(self._heap)
+            if rule.target not in due or when >= due[rule.target][0]:
+                due[rule.target] = (when, rule)
+            if rule.at is None:
+                rule.login_due = None # Login rules fire once
+            following = rule.next_after(now)
+            if following is not None:
+                heapq.heappush(self._heap, (following, next(self._sequence), rule))
+        for _, rule in due.values():
+            self._apply(rule)
+
+    def stop(self):
+        with self._wake_lock:
+            self._stop_event.set()
+            if self._wake_write is not None:
+                os.write(self._wake_write, b"\0")
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def _open_fds(self):
+        with self._wake_lock:
+            self._wake_read, self._wake_write = os.pipe()
+        try:
+            self._timer = _TimerFd()
+        except (OSError, AttributeError) as e:
+            logger.info(f"No timerfd ({e}); checking the schedule at least every {FALLBACK_MAX_SLEEP:.0f} s.")
+            self._timer = None
+
+    def _close_fds(self):
+        if self._timer is not None:
+            self._timer.close()
+            self._timer = None
+        with self._wake_lock:
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._wake_read = self._wake_write = None
+
+    def run(self):
+        self._open_fds()
+        try:
+            now = time.time()
+            self._rebuild(now)
+            if self.catch_up:
+                self._apply_current(now)
+            offset = time.time() - time.monotonic()
+            while not self._stop_event.is_set():
+                timeout = None
+                if self._timer is not None:
+                    self._timer.arm(self._heap[0][0] if self._heap else 0)
+                elif self._heap:
+                    timeout = min(FALLBACK_MAX_SLEEP, max(0.0, self._heap[0][0] - time.time()))
+                else:
+                    timeout = FALLBACK_MAX_SLEEP
+                sources = [self._wake_read] + ([self._timer.fd] if self._timer is not None else [])
+                readable, _, _ = select.select(sources, [], [], timeout)
+                if self._wake_read in readable:
+                    os.read(self._wake_read, 64)
+                    continue
+                clock_set = self._timer.read() if self._timer is not None and readable else False
+                new_offset = time.time() - time.monotonic()
+                # Without timerfd a clock change or a suspend shows as a jump of this offset
+                if clock_set or (self._timer is None and abs(new_offset - offset) > CLOCK_JUMP_TOLERANCE):
+                    self.clock_changes += 1
+                    logger.info("System clock changed; rescheduling.")
+                    now = time.time()
+                    self._rebuild(now)
+                    self._apply_current(now)
+                else:
+                    self._run_due(time.time())
+                offset = new_offset
+        finally:
+            self._close_fds()
+            if self._pool is not None:
+                self._pool.close_all()
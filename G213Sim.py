@@ -0,0 +1,171 @@
+'''
+  *  In-process simulator of the G213 keyboard and G203 mouse for G213Colors.
+  *
+  *  SimulatedBackend plugs in under LogitechDevice (see G213Colors.UsbBackend), so
+  *  the whole command path can be tested and benchmarked without hardware:
+  *
+  *      backend = SimulatedBackend()
+  *      backend.add_device("G213", ctrl_latency=0.001, ack_latency=0.002)
+  *      G213Colors.set_default_backend(backend)
+'''
+
+import errno
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import G213Colors
+
+logger = logging.getLogger(__name__)
+
+
+class SimUSBError(IOError):
+    """Raised by simulated devices; carries errno like usb.core.USBError."""
+
+    def __init__(self, error_number, message=None):
+        super().__init__(error_number, message or errno.errorcode.get(error_number, "USB error"))
+
+
+class SimulatedDevice:
+    """One simulated unit with pyusb's Device surface.
+
+    ctrl_latency and ack_latency are in seconds. ack_loss is the probability an ack
+    never arrives (the read times out), timeout_rate and error_rate the probabilities
+    a control transfer fails with ETIMEDOUT or EIO. unplug() makes every later call
+    fail with ENODEV.
+    """
+
+    def __init__(self, product_name, bus=1, port_numbers=(1,), address=None,
+                 ctrl_latency=0.0005, ack_latency=0.001, ack_loss=0.0,
+                 timeout_rate=0.0, error_rate=0.0, seed=None):
+        spec = G213Colors.LogitechDevice.PRODUCT_SPECS[product_name]
+        self.product_name = product_name
+        self.idVendor = G213Colors.LogitechDevice.ID_VENDOR
+        self.idProduct = spec["idProduct"]
+        self.bus = bus
+        self.port_numbers = tuple(port_numbers)
+        self.address = address if address is not None else 2 + sum(port_numbers)
+        self.ctrl_latency = ctrl_latency
+        self.ack_latency = ack_latency
+        self.ack_loss = ack_loss
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.sends_acks = spec["needs_receive_after_color"]
+        self.kernel_driver_active = True
+        self.plugged_in = True
+        self.frames = [] # Every frame received, in order
+        self.zone_colors = {} # zone -> rgb hex, decoded from color frames
+        self.mode = None # Last effect command: ("color"|"breathe"|"cycle", frame)
+        self._acks = deque() # (ready_at, reply)
+        self._ack_ready = threading.Condition()
+        self._random = random.Random(seed)
+
+    def _check_plugged_in(self):
+        if not self.plugged_in:
+            raise SimUSBError(errno.ENODEV)
+
+    def unplug(self):
+        self.plugged_in = False
+        with self._ack_ready:
+            self._ack_ready.notify_all()
+
+    def replug(self):
+        self.plugged_in = True
+        self.kernel_driver_active = True
+        self.zone_colors.clear()
+        self.mode = None
+
+    def is_kernel_driver_active(self, interface):
+        self._check_plugged_in()
+        return self.kernel_driver_active
+
+    def detach_kernel_driver(self, interface):
+        self._check_plugged_in()
+        self.kernel_driver_active = False
+
+    def attach_kernel_driver(self, interface):
+        self._check_plugged_in()
+        self.kernel_driver_active = True
+
+    def ctrl_transfer(self, bm_request_type, b_request, w_value, w_index, data):
+        self._check_plugged_in()
+        if self.ctrl_latency:
+            time.sleep(self.ctrl_latency)
+        if self.timeout_rate and self._random.random() < self.timeout_rate:
+            raise SimUSBError(errno.ETIMEDOUT)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise SimUSBError(errno.EIO)
+        frame = bytes(data)
+        self.frames.append(frame)
+        self._decode(frame)
+        if self.sends_acks and not (self.ack_loss and self._random.random() < self.ack_loss):
+            with self._ack_ready:
+                self._acks.append((time.monotonic() + self.ack_latency, frame[:4] + bytes(16)))
+                self._ack_ready.notify_all()
+        return len(frame)
+
+    def read(self, endpoint, size, timeout=None):
+        deadline = time.monotonic() + (timeout or 1000) / 1000
+        with self._ack_ready:
+            while True:
+                self._check_plugged_in()
+                now = time.monotonic()
+                if self._acks and self._acks[0][0] <= now:
+                    return bytearray(self._acks.popleft()[1][:size])
+                if now >= deadline:
+                    raise SimUSBError(errno.ETIMEDOUT)
+                wake_at = min(deadline, self._acks[0][0]) if self._acks else deadline
+                self._ack_ready.wait(wake_at - now)
+
+    def _decode(self, frame):
+        for mode in ("color", "breathe", "cycle"):
+            template = G213Colors.get_frame_template(self.product_name, mode)
+            if template.matches(frame):
+                self.mode = (mode, frame)
+                if mode == "color":
+                    fields = template.fields(frame)
+                    zone = fields["zone"][0]
+                    if zone == 0:
+                        self.zone_colors.clear()
+                    self.zone_colors[zone] = fields["rgb"].hex()
+                return
+
+
+class SimulatedBackend(G213Colors.UsbBackend):
+    """Holds the attached SimulatedDevices; enumeration_latency is charged per find() call.
+
+    Simulated units keep no last-applied state unless state_cache (a G213State.StateCache
+    of their own, never the shared one) is given.
+    """
+    USBError = SimUSBError
+
+    def __init__(self, enumeration_latency=0.002, state_cache=None):
+        self.enumeration_latency = enumeration_latency
+        if state_cache is not None:
+            self.state_cache = state_cache
+        self.devices = []
+        self.find_calls = 0
+
+    def add_device(self, product_name, bus=1, port_numbers=None, **options):
+        if port_numbers is None:
+            port_numbers = (len(self.devices) + 1,)
+        device = SimulatedDevice(product_name, bus, port_numbers, **options)
+        self.devices.append(device)
+        return device
+
+    def find(self, id_vendor, id_product, find_all=False):
+        self.find_calls += 1
+        if self.enumeration_latency:
+            time.sleep(self.enumeration_latency)
+        matches = [
+            device for device in self.devices
+            if device.plugged_in and device.idVendor == id_vendor and device.idProduct == id_product
+        ]
+        if find_all:
+            return iter(matches)
+        return matches[0] if matches else None
+
+    def is_present(self, handle):
+        return handle.plugged_in and handle in self.devices
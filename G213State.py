@@ -0,0 +1,291 @@
+'''
+  *  Last-applied state cache for G213Colors.
+  *
+  *  Remembers, per physical unit ("G213@1-2.3"), the last frames successfully written
+  *  to each slot (a zone, or 0 for whole-device commands), so applying the same
+  *  settings again sends nothing. Kept in memory and in one small JSON file per user,
+  *  g213colors-state-<uid>.json, next to the G213Lock files, which the kernel empties
+  *  on reboot.
+  *
+  *  A user only ever skips frames on the strength of their own file: it is replaced
+  *  atomically by its owner, the sticky lock directory keeps others from replacing it,
+  *  and a file owned by someone else is ignored. The other users' files are only read
+  *  to learn that they wrote to a unit later than we did, which makes our entry stale;
+  *  a forged one can therefore cause extra writes, never a skipped one. That is why
+  *  forgetting a unit leaves a timestamped, empty entry instead of deleting it.
+  *
+  *  The cache belongs to a USB backend (UsbBackend.state_cache): only PyUsbBackend
+  *  uses this shared one, simulated backends keep none unless given their own.
+  *
+  *  Entries are dropped when the system has been suspended since they were recorded
+  *  (the device may have lost its state), on hotplug, and whenever frames are written
+  *  outside LogitechDevice.apply_frames (animations, single commands). Disable with
+  *  G213COLORS_STATE_CACHE=0, or pass force=True to skip it for one apply.
+'''
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import G213Lock
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE_PREFIX = "g213colors-state-"
+SUSPEND_TOLERANCE = 1.0 # Seconds of CLOCK_BOOTTIME/CLOCK_MONOTONIC drift that count as a suspend
+
+
+def _boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _suspended_seconds():
+    """Total time spent suspended since boot: CLOCK_BOOTTIME counts it, CLOCK_MONOTONIC does not."""
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - time.clock_gettime(time.CLOCK_MONOTONIC)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def _now():
+    """Seconds since boot, comparable between processes and across suspend."""
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (AttributeError, OSError):
+        return time.monotonic()
+
+
+def _file_key(info):
+    """Changes whenever a state file is replaced, rewritten or handed to another owner."""
+    return info.st_ino, info.st_mtime_ns, info.st_uid
+
+
+def _read_entries(path, uid=None):
+    """(_file_key, entries) of a state file; (None, {}) if missing, unreadable or (with uid) not owned by uid."""
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC | os.O_NOFOLLOW)
+    except OSError:
+        return None, {}
+    try:
+        info = os.fstat(fd)
+        if uid is not None and info.st_uid != uid:
+            logger.warning(f"Ignoring state cache {path}: it belongs to uid {info.st_uid}.")
+            return None, {}
+        data = os.pread(fd, info.st_size, 0)
+    except OSError:
+        return None, {}
+    finally:
+        os.close(fd)
+    try:
+        entries = json.loads(data) if data.strip() else {}
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable state cache {path}: {e}")
+        return None, {}
+    return _file_key(info), entries if isinstance(entries, dict) else {}
+
+
+class StateCache:
+    """Maps a unit identity to {slot: frame hex}; see plan() and record()."""
+
+    def __init__(self, directory=None, enabled=True):
+        self.directory = directory or G213Lock.lock_directory()
+        self.uid = os.geteuid()
+        self.path = os.path.join(self.directory, f"{STATE_FILE_PREFIX}{self.uid}.json")
+        self.enabled = enabled
+        self._entries = {} # identity -> {"slots": {slot: hex}, "at": float, "boot_id": str, "suspended": float}
+        self._loaded = None
+        self._others = {} # path -> (_file_key, entries) of the other users' files
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Rereads our file if another of our processes replaced it since we last looked."""
+        try:
+            if _file_key(os.stat(self.path, follow_symlinks=False)) == self._loaded:
+                return
+        except OSError:
+            pass
+        self._loaded, self._entries = _read_entries(self.path, self.uid)
+
+    def _save(self):
+        """Replaces our file with the entries; nobody else can write or replace it."""
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{STATE_FILE_PREFIX}{self.uid}-", dir=self.directory)
+        except OSError as e:
+            logger.debug(f"Could not write state cache {self.path}: {e}")
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                os.fchmod(f.fileno(), 0o640) # The group reads it to see that we wrote later
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+            self._loaded = _file_key(os.stat(self.path, follow_symlinks=False))
+        except OSError as e:
+            logger.debug(f"Could not write state cache {self.path}: {e}")
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    def _update(self, change):
+        """Runs change(entries) on our freshly loaded entries and saves them, serialized between our own processes."""
+        try:
+            lock_fd = os.open(self.path[:-len(".json")] + ".lock", os.O_RDWR | os.O_CREAT | os.O_CLOEXEC | os.O_NOFOLLOW, 0o600)
+        except OSError as e:
+            logger.debug(f"Could not lock state cache {self.path}: {e}")
+            return
+        try:
+            if os.fstat(lock_fd).st_uid != self.uid:
+                logger.warning(f"Not writing state cache {self.path}: its lock file belongs to someone else.")
+                return
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            self._load()
+            if change(self._entries):
+                self._save()
+        finally:
+            os.close(lock_fd)
+
+    def _other_entries(self):
+        """Entries of the other users' state files that we may read, refreshed when they change."""
+        try:
+            names = [name for name in os.listdir(self.directory)
+                     if name.startswith(STATE_FILE_PREFIX) and name.endswith(".json")]
+        except OSError:
+            return []
+        own_name = os.path.basename(self.path)
+        others = {}
+        for name in names:
+            if name == own_name:
+                continue
+            path = os.path.join(self.directory, name)
+            cached = self._others.get(path)
+            try:
+                if cached is not None and cached[0] == _file_key(os.stat(path, follow_symlinks=False)):
+                    others[path] = cached
+                    continue
+            except OSError:
+                continue
+            others[path] = _read_entries(path)
+        self._others = others
+        return [entries for _, entries in others.values()]
+
+    def _written_by_others_since(self, identity, at):
+        """True if another user's file says it wrote to (or forgot) identity at or after at."""
+        boot_id = _boot_id()
+        for entries in self._other_entries():
+            entry = entries.get(identity)
+            try:
+                if entry is not None and entry.get("boot_id") == boot_id and float(entry["at"]) >= at:
+                    return True
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return True # Cannot tell when, so do not trust ours
+        return False
+
+    def _valid_slots(self, identity):
+        entry = self._entries.get(identity)
+        if entry is None:
+            return None
+        try:
+            if entry.get("boot_id") != _boot_id() or abs(entry.get("suspended", 0.0) - _suspended_seconds()) > SUSPEND_TOLERANCE:
+                logger.debug(f"State of {identity} predates a reboot or suspend, discarding it.")
+                del self._entries[identity]
+                return None
+            slots = {int(slot): str(frame) for slot, frame in entry["slots"].items()}
+            if not slots:
+                return None
+            if self._written_by_others_since(identity, float(entry["at"])):
+                logger.debug(f"Another user wrote to {identity} after us, not trusting our state of it.")
+                return None
+            return slots
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warning(f"Ignoring a malformed state cache entry for {identity}.")
+            del self._entries[identity]
+            return None
+
+    def plan(self, identity, frames, slot_of, force=False):
+        """Returns (frames still to send, slots after sending them).
+
+        slot_of(frame) gives the zone a frame sets, 0 for commands that replace the whole
+        device state, or None for frames it does not understand (always sent). A
+        whole-device frame is only skipped if the device holds exactly that frame.
+        """
+        frames = [bytes.fromhex(frame) if isinstance(frame, str) else bytes(frame) for frame in frames]
+        with self._lock:
+            if not self.enabled or force or identity is None:
+                current = None
+            else:
+                self._load()
+                current = self._valid_slots(identity)
+        slots = dict(current or {})
+        to_send = []
+        for frame in frames:
+            slot = slot_of(frame)
+            frame_hex = frame.hex()
+            if current is not None and slot is not None:
+                if slot == 0 and slots == {0: frame_hex}:
+                    continue
+                if slot != 0 and slots.get(slot) == frame_hex:
+                    continue
+            to_send.append(frame)
+            if slot is None:
+                current = None # Unknown effect, later frames can no longer be compared
+                slots = {}
+            elif slot == 0:
+                slots = {0: frame_hex}
+            else:
+                slots.pop(0, None)
+                slots[slot] = frame_hex
+        return to_send, slots
+
+    @staticmethod
+    def _needs_forgetting(own, others):
+        """False only if our entry already forgets the unit and no other user wrote to it since."""
+        try:
+            if own is None or own["slots"]:
+                return True
+            return any(other is not None and other["slots"] and float(other["at"]) >= float(own["at"]) for other in others)
+        except (KeyError, TypeError, ValueError):
+            return True
+
+    @staticmethod
+    def _entry(slots):
+        return {"slots": slots, "at": _now(), "boot_id": _boot_id(), "suspended": _suspended_seconds()}
+
+    def record(self, identity, slots):
+        """Stores slots as the state of identity after a write; empty slots mark it unknown."""
+        if not self.enabled or identity is None:
+            return
+
+        def change(entries):
+            entries[identity] = self._entry(slots)
+            return True
+
+        with self._lock:
+            self._update(change)
+
+    def invalidate(self, identity=None):
+        """Forgets identity (or every unit any user knows of) for every user; cheap when there is nothing to forget."""
+        if not self.enabled:
+            return
+
+        def change(entries):
+            others = self._other_entries()
+            identities = {identity} if identity is not None else set(entries).union(*others)
+            forget = [name for name in identities if self._needs_forgetting(entries.get(name), [other.get(name) for other in others])]
+            for name in forget:
+                entries[name] = self._entry({})
+            return bool(forget)
+
+        with self._lock:
+            self._update(change)
+
+
+STATE_CACHE = StateCache(enabled=os.environ.get("G213COLORS_STATE_CACHE") != "0")
+NO_STATE_CACHE = StateCache(enabled=False) # For backends whose writes must not touch the shared cache
@@ -0,0 +1,298 @@
+'''
+  *  USB traffic recorder and replay harness for G213Colors.
+  *
+  *  Recording: with G213COLORS_TRACE=<file> (or 'g213colors --trace <file> ...') the
+  *  default USB backend is wrapped in a RecordingBackend, which appends every control
+  *  transfer and interrupt read (time, wValue or endpoint, payload, result, latency)
+  *  to a compact binary trace. Nothing changes when the variable is not set.
+  *
+  *  Replay: ReplayBackend builds G213Sim devices that answer with the recorded
+  *  latencies and results, in order, so the current code can be run against a
+  *  user's session (set_default_backend(ReplayBackend(read_trace(path)))).
+  *  replay() feeds the recorded transfers themselves back at original or accelerated
+  *  speed and reports timing and the final state of every zone:
+  *
+  *      g213colors trace show session.g2t
+  *      g213colors trace replay session.g2t --speed 10
+  *
+  *  File layout (little endian):
+  *      header    "G2TR", version u8, wall clock start f64
+  *      device    kind 0 u8, device id u8, idVendor u16, idProduct u16, bus u8, port count u8, ports u8 * n
+  *      transfer  kind 1 (control) or 2 (read) u8, device id u8, time since start f64,
+  *                latency f32, wValue or endpoint u16, result i32 (bytes, or -errno),
+  *                payload length u16, payload
+'''
+
+import atexit
+import errno
+import logging
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+import G213Colors
+import G213Sim
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"G2TR"
+VERSION = 1
+HEADER = struct.Struct("<4sBd")
+DEVICE = struct.Struct("<BBHHBB")
+TRANSFER = struct.Struct("<BBdfHiH")
+KIND_DEVICE = 0
+KIND_CONTROL = 1
+KIND_READ = 2
+
+TraceDevice = namedtuple("TraceDevice", ["device_id", "id_vendor", "id_product", "bus", "ports"])
+TraceEvent = namedtuple("TraceEvent", ["kind", "device_id", "time", "latency", "value", "result", "payload"])
+Trace = namedtuple("Trace", ["started", "devices", "events"])
+
+
+class TraceWriter:
+    """Appends records to a trace file; safe to call from any thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._lock = threading.Lock()
+        self._origin = time.monotonic()
+        self._device_ids = {} # (bus, ports, idProduct) -> device id
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        atexit.register(self.close)
+
+    def device_id(self, handle):
+        ports = tuple(getattr(handle, "port_numbers", None) or ())
+        key = (handle.bus, ports, handle.idProduct)
+        with self._lock:
+            device_id = self._device_ids.get(key)
+            if device_id is None:
+                device_id = self._device_ids[key] = len(self._device_ids) % 256
+                self._file.write(DEVICE.pack(KIND_DEVICE, device_id, handle.idVendor, handle.idProduct, handle.bus, len(ports)) + bytes(ports))
+            return device_id
+
+    def transfer(self, kind, device_id, started, latency, value, result, payload):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(TRANSFER.pack(kind, device_id, started - self._origin, latency, value, result, len(payload)) + payload)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class RecordingHandle:
+    """Wraps one pyusb-like device handle; ctrl_transfer and read are recorded, the rest passes through."""
+
+    def __init__(self, handle, writer):
+        self.handle = handle
+        self._writer = writer
+        self._device_id = writer.device_id(handle)
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def ctrl_transfer(self, bm_request_type, b_request, w_value, w_index, data):
+        started = time.monotonic()
+        try:
+            result = self.handle.ctrl_transfer(bm_request_type, b_request, w_value, w_index, data)
+        except IOError as e:
+            self._writer.transfer(KIND_CONTROL, self._device_id, started, time.monotonic() - started, w_value,
+                                  -(getattr(e, "errno", None) or errno.EIO), bytes(data))
+            raise
+        self._writer.transfer(KIND_CONTROL, self._device_id, started, time.monotonic() - started, w_value, result, bytes(data))
+        return result
+
+    def read(self, endpoint, size, timeout=None):
+        started = time.monotonic()
+        try:
+            data = self.handle.read(endpoint, size, timeout=timeout)
+        except IOError as e:
+            self._writer.transfer(KIND_READ, self._device_id, started, time.monotonic() - started, endpoint,
+                                  -(getattr(e, "errno", None) or errno.EIO), b"")
+            raise
+        self._writer.transfer(KIND_READ, self._device_id, started, time.monotonic() - started, endpoint, len(data), bytes(data))
+        return data
+
+
+class RecordingBackend(G213Colors.UsbBackend):
+    """Any UsbBackend, with the traffic of every handle it finds recorded to path."""
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.USBError = inner.USBError
+        self.hardware = inner.hardware
+        self.state_cache = inner.state_cache
+        self.writer = TraceWriter(path)
+        logger.info(f"Recording USB traffic to {path}")
+
+    def find(self, id_vendor, id_product, find_all=False):
+        found = self.inner.find(id_vendor, id_product, find_all=find_all)
+        if find_all:
+            return [RecordingHandle(handle, self.writer) for handle in found]
+        return RecordingHandle(found, self.writer) if found is not None else None
+
+    def dispose(self, handle):
+        self.inner.dispose(handle.handle)
+
+    def is_present(self, handle):
+        return self.inner.is_present(handle.handle)
+
+
+def read_trace(path):
+    """Returns the Trace in path; ValueError if it is not a trace. A truncated tail (crash) is dropped."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is too short to be a trace")
+    magic, version, started = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} G213Colors trace")
+    devices, events = {}, []
+    offset = HEADER.size
+    try:
+        while offset < len(data):
+            if data[offset] == KIND_DEVICE:
+                _, device_id, id_vendor, id_product, bus, port_count = DEVICE.unpack_from(data, offset)
+                offset += DEVICE.size
+                devices[device_id] = TraceDevice(device_id, id_vendor, id_product, bus, tuple(data[offset:offset + port_count]))
+                offset += port_count
+            else:
+                kind, device_id, t, latency, value, result, length = TRANSFER.unpack_from(data, offset)
+                offset += TRANSFER.size
+                payload = data[offset:offset + length]
+                if len(payload) < length:
+                    break
+                offset += length
+                events.append(TraceEvent(kind, device_id, t, latency, value, result, payload))
+    except struct.error:
+        logger.warning(f"{path} ends in a truncated record; ignoring it.")
+    return Trace(started, devices, events)
+
+
+def product_of(trace_device):
+    for product_name, spec in G213Colors.LogitechDevice.PRODUCT_SPECS.items():
+        if trace_device.id_vendor == G213Colors.LogitechDevice.ID_VENDOR and spec["idProduct"] == trace_device.id_product:
+            return product_name
+    return None
+
+
+def describe(product_name, event):
+    """One line of human-readable text for a trace event."""
+    if event.kind == KIND_READ:
+        what = f"read  ep 0x{event.value:02x}" + (f" {event.payload.hex()}" if event.payload else "")
+    else:
+        what = f"ctrl  {event.payload.hex()}"
+        for mode in G213Colors.LogitechDevice.COMMAND_FIELDS if product_name else ():
+            template = G213Colors.get_frame_template(product_name, mode)
+            if template.matches(event.payload):
+                what = f"ctrl  {mode} " + " ".join(
+                    f"{name}={value.hex() if name == 'rgb' else int.from_bytes(value, 'big')}"
+                    for name, value in template.fields(event.payload).items()
+                )
+                break
+    result = f"-> {errno.errorcode.get(-event.result, event.result)}" if event.result < 0 else f"-> {event.result}"
+    return f"{event.time * 1000:10.3f} ms  {product_name or '?'}#{event.device_id}  {what}  {result}  ({event.latency * 1000:.3f} ms)"
+
+
+class ReplayDevice(G213Sim.SimulatedDevice):
+    """A simulated unit whose transfers take the recorded latencies and return the recorded results, in order.
+
+    Past the end of the recording it behaves like a plain, instant SimulatedDevice.
+    """
+
+    def __init__(self, product_name, bus, port_numbers, events, speed=1.0):
+        super().__init__(product_name, bus, port_numbers, ctrl_latency=0, ack_latency=0)
+        self.speed = speed
+        self._script = {
+            KIND_CONTROL: deque(event for event in events if event.kind == KIND_CONTROL),
+            KIND_READ: deque(event for event in events if event.kind == KIND_READ),
+        }
+
+    def _next(self, kind):
+        script = self._script[kind]
+        if not script:
+            return None
+        event = script.popleft()
+        if self.speed:
+            time.sleep(event.latency / self.speed)
+        if event.result < 0:
+            raise G213Sim.SimUSBError(-event.result)
+        return event
+
+    def ctrl_transfer(self, bm_request_type, b_request, w_value, w_index, data):
+        self._check_plugged_in()
+        self._next(KIND_CONTROL)
+        return super().ctrl_transfer(bm_request_type, b_request, w_value, w_index, data)
+
+    def read(self, endpoint, size, timeout=None):
+        self._check_plugged_in()
+        event = self._next(KIND_READ)
+        if event is None:
+            return super().read(endpoint, size, timeout)
+        return bytearray(event.payload[:size])
+
+
+class ReplayBackend(G213Sim.SimulatedBackend):
+    """The units of a trace as ReplayDevices, found by the usual LogitechDevice code."""
+
+    def __init__(self, trace, speed=1.0):
+        super().__init__(enumeration_latency=0)
+        self.by_id = {}
+        for trace_device in trace.devices.values():
+            product_name = product_of(trace_device)
+            if product_name is None:
+                continue
+            events = [event for event in trace.events if event.device_id == trace_device.device_id]
+            device = ReplayDevice(product_name, trace_device.bus, trace_device.ports or (1,), events, speed)
+            self.devices.append(device)
+            self.by_id[trace_device.device_id] = device
+
+
+def replay(trace, speed=1.0):
+    """Sends the recorded transfers again, on the recorded schedule divided by speed (0 = as fast as possible).
+
+    Returns a report dict: event and error counts, recorded and replayed wall time and
+    transfer latency, and each unit's final zone colors as decoded by the simulator.
+    """
+    backend = ReplayBackend(trace, speed)
+    recorded_latency = replayed_latency = 0.0
+    errors = 0
+    start = time.monotonic()
+    for event in trace.events:
+        device = backend.by_id.get(event.device_id)
+        if device is None:
+            continue
+        if speed:
+            delay = start + event.time / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.monotonic()
+        try:
+            if event.kind == KIND_CONTROL:
+                device.ctrl_transfer(0x21, 0x09, event.value, 0x0001, event.payload)
+            else:
+                device.read(event.value, 64)
+        except G213Sim.SimUSBError:
+            errors += 1
+        replayed_latency += time.monotonic() - sent
+        recorded_latency += event.latency
+    return {
+        "events": len(trace.events),
+        "errors": errors,
+        "recorded_s": trace.events[-1].time + trace.events[-1].latency if trace.events else 0.0,
+        "replayed_s": time.monotonic() - start,
+        "recorded_latency_s": recorded_latency,
+        "replayed_latency_s": replayed_latency,
+        "units": {
+            f"{device.product_name}@{device.bus}-{'.'.join(map(str, device.port_numbers))}": {
+                "zones": dict(sorted(device.zone_colors.items())),
+                "mode": device.mode[0] if device.mode else None,
+                "frames": len(device.frames),
+            }
+            for device in backend.devices
+        },
+    }
@@ -23,7 +23,8 @@ sudo apt-get install -y \
     python3-gi-cairo \
     gir1.2-gtk-3.0 \
     python3-cairo \
-    python3-usb
+    python3-usb \
+    python3-numpy
 
 echo ""
 echo "Installing Python library 'randomcolor' via pip3..."
@@ -69,6 +70,13 @@ else
     echo "Please ensure G213Colors.py, main.py (as g213colors-gui), service files, icons, etc., are copied to their correct system locations and systemd is reloaded if necessary." >&2
 fi
 
+echo ""
+if [ -n "$SUDO_USER" ] && [ "$SUDO_USER" != "root" ]; then
+    echo "Adding $SUDO_USER to the g213colors group, which shares device locks with the system service..."
+    sudo usermod -aG g213colors "$SUDO_USER"
+    echo "Log out and back in for the group membership to take effect."
+fi
+
 echo ""
 echo "Installation script finished."
 echo "If your Logitech devices were already connected, you might need to unplug/replug them or reboot for all changes (especially udev rules) to fully take effect."
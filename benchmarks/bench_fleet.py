@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+'''
+Times applying a five-zone segment config to N = 1..8 simulated G213 units,
+sequentially and with G213Fleet's bounded thread pool.
+
+Units are G213Sim simulated devices with typical enumeration, transfer and ack
+latencies, so no hardware is needed. Every apply is forced, so each run writes
+all frames instead of hitting the last-applied state cache:
+    python3 benchmarks/bench_fleet.py --max-units 8 --workers 4
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import G213Colors # noqa: E402
+import G213Fleet # noqa: E402
+import G213Sim # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-units", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=G213Fleet.DEFAULT_MAX_WORKERS)
+    args = parser.parse_args()
+
+    backend = G213Sim.SimulatedBackend(enumeration_latency=0.004)
+    G213Colors.set_default_backend(backend)
+    for _ in range(args.max_units):
+        backend.add_device("G213", ctrl_latency=0.001, ack_latency=0.001)
+
+    frames = [G213Colors.build_frame("G213", "color", (zone, "ff8000")) for zone in range(1, 6)]
+    units = G213Colors.LogitechDevice.find_units("G213")
+    print(f"{'units':>5} {'sequential ms':>14} {'parallel ms':>12} {'speedup':>8}")
+    for count in range(1, args.max_units + 1):
+        frames_by_unit = {unit: frames for unit in units[:count]}
+        start = time.perf_counter()
+        G213Fleet.apply_to_units("G213", frames_by_unit, max_workers=1, force=True)
+        sequential = time.perf_counter() - start
+        start = time.perf_counter()
+        G213Fleet.apply_to_units("G213", frames_by_unit, max_workers=args.workers, force=True)
+        parallel = time.perf_counter() - start
+        print(f"{count:>5} {sequential * 1000:>14.1f} {parallel * 1000:>12.1f} {sequential / parallel:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
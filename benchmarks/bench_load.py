@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+CPU cost of the system-load visualizer (G213Load) per sample, and the resulting share
+of one core at the given sample interval. Samples the real /proc and writes to a
+G213Sim simulated G213 with zero transfer latency, so only our own work is counted:
+    python3 benchmarks/bench_load.py --samples 2000 --interval 2
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import G213Animation # noqa: E402
+import G213Colors # noqa: E402
+import G213Load # noqa: E402
+import G213Sim # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=G213Load.DEFAULT_INTERVAL)
+    args = parser.parse_args()
+
+    backend = G213Sim.SimulatedBackend(enumeration_latency=0)
+    backend.add_device("G213", ctrl_latency=0, ack_latency=0)
+    G213Colors.set_default_backend(backend)
+    device = G213Colors.LogitechDevice("G213")
+    device.connect()
+    device.start_ack_reader()
+    effect = G213Load.SystemLoadEffect()
+    writer = G213Animation.ZoneWriter(device)
+    zone_count = len(writer.zones)
+
+    start = time.process_time()
+    for _ in range(args.samples):
+        effect.sampler.sample()
+    sampler = (time.process_time() - start) / args.samples
+
+    # Alternate between idle and saturated so every zone is written on every sample
+    start = time.process_time()
+    for number in range(args.samples):
+        writer.write([effect.palette[-1 if number % 2 else 0]] * zone_count)
+    writer_cost = (time.process_time() - start) / args.samples
+    device.disconnect()
+
+    print(f"{'':>24} {'µs/sample':>10} {'% of a core':>12}")
+    for label, seconds in (("sampler", sampler), ("writer (every zone)", writer_cost), ("total (worst case)", sampler + writer_cost)):
+        print(f"{label:>24} {seconds * 1e6:>10.1f} {seconds / args.interval * 100:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
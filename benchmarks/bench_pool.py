@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''
+Measures static color commands/sec with a connect/disconnect per command
+(the old GUI behaviour) versus a DevicePool that keeps the handle open.
+
+Needs the real device attached and USB permissions (udev rules) in place,
+or --backend sim for the in-process simulator:
+    python3 benchmarks/bench_pool.py --product G213 --count 50
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import G213Colors # noqa: E402
+import G213Sim # noqa: E402
+
+COLORS = ["ff0000", "00ff00", "0000ff", "ffffff"]
+
+
+def bench_per_command(product, count):
+    start = time.perf_counter()
+    for i in range(count):
+        controller = G213Colors.LogitechDevice(product)
+        if not controller.connect():
+            raise SystemExit(f"Could not connect to {product}")
+        controller.send_color_command(COLORS[i % len(COLORS)])
+        controller.disconnect()
+    return time.perf_counter() - start
+
+
+def bench_pooled(product, count):
+    pool = G213Colors.DevicePool()
+    start = time.perf_counter()
+    for i in range(count):
+        with pool.session(product) as controller:
+            if controller is None:
+                raise SystemExit(f"Could not connect to {product}")
+            controller.send_color_command(COLORS[i % len(COLORS)])
+    elapsed = time.perf_counter() - start
+    pool.close_all()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--product", default="G213", choices=list(G213Colors.LogitechDevice.PRODUCT_SPECS))
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--backend", choices=["usb", "sim"], default="usb")
+    args = parser.parse_args()
+
+    if args.backend == "sim":
+        backend = G213Sim.SimulatedBackend()
+        backend.add_device(args.product)
+        G213Colors.set_default_backend(backend)
+
+    for label, func in (("connect per command", bench_per_command), ("pooled handle", bench_pooled)):
+        elapsed = func(args.product, args.count)
+        print(f"{label:>20}: {args.count / elapsed:8.1f} commands/s ({elapsed * 1000 / args.count:.2f} ms/command)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''
+Resume-to-lit time of the two service paths after a suspend:
+
+    apply --system    g213colors apply --system (the old g213colors.service command)
+    replay            g213colors-replay, writing the blob left by the last apply
+
+Each path is measured in two parts and summed: the process start with its imports,
+run in a fresh interpreter (--runs times), and the device work itself, run
+in-process against the simulator. No hardware is needed.
+    python3 benchmarks/bench_resume.py --runs 10
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+import G213Animation # noqa: E402
+import G213Colors # noqa: E402
+import G213Replay # noqa: E402
+import G213Sim # noqa: E402
+
+STARTUP = {
+    "apply --system": "import sys; sys.argv = ['g213colors', 'apply', '--system']; import G213Cli; G213Cli.build_parser().parse_args(sys.argv[1:]); import usb.core",
+    "replay": "import G213Replay, usb.core",
+}
+
+
+def startup_ms(code, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def device_ms(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--product", default="G213", choices=list(G213Colors.LogitechDevice.PRODUCT_SPECS))
+    args = parser.parse_args()
+
+    backend = G213Sim.SimulatedBackend()
+    backend.add_device(args.product, port_numbers=(2,))
+    G213Colors.set_default_backend(backend)
+    frames = [G213Colors.build_frame(args.product, "color", (zone, "ff8000")) for zone in G213Animation.PRODUCT_ZONES[args.product]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        conf_file_path = os.path.join(directory, "G213Colors.conf")
+        G213Colors.LogitechDevice(args.product).save_configuration("\n".join(frame.hex() for frame in frames), conf_file_path)
+        blob_path = os.path.join(directory, G213Replay.BLOB_NAME)
+        device = G213Colors.LogitechDevice(args.product)
+        device.connect()
+        G213Replay.update_blob({
+            "idVendor": device.ID_VENDOR, "idProduct": device.spec["idProduct"], "wValue": device.spec["wValue"],
+            "needs_ack": device.spec["needs_receive_after_color"], "bus": device.device.bus,
+            "ports": tuple(device.device.port_numbers), "gap": device.spec["minFrameGap"], "frames": frames,
+        }, blob_path)
+        device.disconnect()
+
+        work = {
+            "apply --system": lambda: G213Colors.LogitechDevice.apply_configuration_from_file(conf_file_path, force=True),
+            "replay": lambda: G213Replay.replay(G213Replay.collect_records([blob_path]), lambda v, p: backend.find(v, p, find_all=True)),
+        }
+        print(f"{'path':>16} {'startup ms':>11} {'device ms':>10} {'total ms':>9}")
+        print(f"{'(bare python)':>16} {startup_ms('pass', args.runs):>11.1f}")
+        for label in work:
+            start = startup_ms(STARTUP[label], args.runs)
+            apply = device_ms(work[label], args.runs)
+            print(f"{label:>16} {start:>11.1f} {apply:>10.2f} {start + apply:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
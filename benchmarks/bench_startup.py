@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+'''
+Wall time of the one-shot apply paths, each run in a fresh interpreter:
+
+    gui -t            main.py -t (the old g213colors.service command)
+    cli apply         G213Cli.py apply --system (the new service command)
+    gtk import only   what main.py used to pay before even parsing -t
+
+Both apply commands read /etc/G213Colors.conf; without a device attached they fail
+after the same amount of work, so the numbers still compare startup cost.
+    python3 benchmarks/bench_startup.py --runs 10
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+COMMANDS = {
+    "gui -t": [sys.executable, os.path.join(ROOT, "main.py"), "-t"],
+    "cli apply": [sys.executable, os.path.join(ROOT, "G213Cli.py"), "apply", "--system"],
+    "gtk import only": [sys.executable, "-c", "import gi; gi.require_version('Gtk', '3.0'); from gi.repository import Gtk"],
+}
+
+
+def run(command, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    for label, command in COMMANDS.items():
+        samples = run(command, args.runs)
+        print(f"{label:>16}: median {statistics.median(samples) * 1000:7.1f} ms, min {min(samples) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+'''
+Benchmark suite for the LogitechDevice command path.
+
+Runs against the in-process simulator by default (no hardware needed) or the
+real device with --backend usb, and writes machine-readable results:
+    python3 benchmarks/run_benchmarks.py --output results.json
+    python3 benchmarks/run_benchmarks.py --compare results.json
+
+With --compare, each case is printed next to the baseline and the exit status is
+1 if any case got slower by more than --max-regression percent.
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import G213Animation # noqa: E402
+import G213Colors # noqa: E402
+import G213Metrics # noqa: E402
+import G213Profiles # noqa: E402
+import G213Sim # noqa: E402
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+def summarize(samples, operations_per_sample=1):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "iterations": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "min_ms": samples[0] * 1000,
+        "max_ms": samples[-1] * 1000,
+        "ops_per_s": len(samples) * operations_per_sample / total if total else None,
+    }
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark
+def connect_disconnect(product, iterations):
+    device = G213Colors.LogitechDevice(product)
+
+    def cycle():
+        if not device.connect():
+            raise RuntimeError(f"Could not connect to {product}")
+        device.disconnect()
+    return summarize(timed(cycle, iterations))
+
+
+@benchmark
+def single_command(product, iterations):
+    device = G213Colors.LogitechDevice(product)
+    device.connect()
+    try:
+        return summarize(timed(lambda: device.send_color_command("ff8000"), iterations))
+    finally:
+        device.disconnect()
+
+
+@benchmark
+def segment_batch(product, iterations):
+    device = G213Colors.LogitechDevice(product)
+    zones = G213Animation.PRODUCT_ZONES[product]
+    frames = [device.build_frame("color", zone, "00ff80") for zone in zones]
+    device.connect()
+    try:
+        return summarize(timed(lambda: device.send_batch(frames), iterations), len(frames))
+    finally:
+        device.disconnect()
+
+
+@benchmark
+def config_apply(product, iterations):
+    zones = G213Animation.PRODUCT_ZONES[product]
+    device = G213Colors.LogitechDevice(product)
+    commands = "\n".join(device.build_frame("color", zone, "8000ff").hex() for zone in zones)
+    with tempfile.TemporaryDirectory() as directory:
+        conf_file_path = os.path.join(directory, f"{product}.conf")
+        device.save_configuration(commands, conf_file_path)
+        return summarize(timed(lambda: G213Colors.LogitechDevice.apply_configuration_from_file(conf_file_path, force=True), iterations))
+
+
+@benchmark
+def profile_apply(product, iterations):
+    zones = G213Animation.PRODUCT_ZONES[product]
+    with tempfile.TemporaryDirectory() as directory:
+        store = G213Profiles.ProfileStore(os.path.join(directory, "profiles.g2p"))
+        store.save(product, "bench", [G213Colors.build_frame(product, "color", (zone, "8000ff")) for zone in zones])
+        return summarize(timed(lambda: store.apply(product, "bench", force=True), iterations))
+
+
+@benchmark
+def animation_throughput(product, iterations):
+    device = G213Colors.LogitechDevice(product)
+    device.connect()
+    try:
+        animator = G213Animation.Animator(device, G213Animation.WaveEffect(period=0.5), fps=1000)
+        start = time.perf_counter()
+        animator.run(duration=max(0.2, iterations / 100))
+        elapsed = time.perf_counter() - start
+    finally:
+        device.disconnect()
+    stats = animator.stats()
+    return {
+        "iterations": stats["frames_rendered"],
+        "frames_per_s": stats["frames_rendered"] / elapsed,
+        "usb_writes_per_s": stats["usb_writes"] / elapsed,
+        "frames_dropped": stats["frames_dropped"],
+        "mean_ms": elapsed * 1000 / max(1, stats["frames_rendered"]),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressed = False
+    print(f"{'case':<22} {'baseline ms':>12} {'current ms':>11} {'change':>8}")
+    for name, current in results.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"{name:<22} {'-':>12} {current['mean_ms']:>11.3f}")
+            continue
+        change = (current["mean_ms"] - old["mean_ms"]) / old["mean_ms"] * 100
+        flag = ""
+        if change > max_regression:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"{name:<22} {old['mean_ms']:>12.3f} {current['mean_ms']:>11.3f} {change:>+7.1f}%{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sim", "usb"], default="sim")
+    parser.add_argument("--product", default="G213", choices=list(G213Colors.LogitechDevice.PRODUCT_SPECS))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--only", action="append", help="Run only the named case (repeatable)")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE_JSON")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Percent (default 20)")
+    parser.add_argument("--metrics", action="store_true", help="Run with G213Metrics enabled to measure its overhead")
+    args = parser.parse_args()
+
+    if args.metrics:
+        G213Metrics.METRICS.enable()
+
+    if args.backend == "sim":
+        backend = G213Sim.SimulatedBackend()
+        backend.add_device(args.product, seed=1)
+        G213Colors.set_default_backend(backend)
+
+    results = {}
+    for func in BENCHMARKS:
+        if args.only and func.__name__ not in args.only:
+            continue
+        results[func.__name__] = func(args.product, args.iterations)
+
+    report = {
+        "version": git_version(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "backend": args.backend,
+        "product": args.product,
+        "metrics_enabled": G213Metrics.METRICS.enabled,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare and compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
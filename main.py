@@ -1,16 +1,12 @@
 #!/usr/bin/env python3
 
 import G213Colors # Import the module
-from time import sleep
-import gi
+import G213Cli
 import sys
 import os # For path manipulation
 import logging
 import argparse # For more robust argument parsing
 
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
-
 # Configure logging (place this early)
 logging.basicConfig(
     level=logging.INFO,  # Change to logging.DEBUG for more verbose output
@@ -20,7 +16,7 @@ logger = logging.getLogger("g213colors_gui") # Specific logger for the GUI part
 
 NAME = "G213 Colors"
 PRODUCTS = ["G213", "G203"]
-USER_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "G213Colors")
+USER_CONFIG_DIR = G213Colors.USER_CONFIG_DIR
 
 # --- Command-Line Argument Parsing ---
 parser = argparse.ArgumentParser(description="G213 Colors GUI and CLI tool.")
@@ -48,38 +44,25 @@ except SystemExit as e:
 
 
 # --- CLI Action: Apply System Default Config (-t) ---
+# Kept for existing service units and cron jobs; the headless g213colors CLI does the work.
 if args.apply_system_default:
     logger.info("Option '-t' / '--apply-system-default' detected. Applying system default saved settings.")
-    success = G213Colors.LogitechDevice.apply_configuration_from_file(
-        G213Colors.LogitechDevice.SYSTEM_DEFAULT_CONF_FILE
-    )
-    if success:
-        logger.info("System default settings applied successfully via -t.")
-        sys.exit(0)
-    else:
-        logger.error("Failed to apply system default settings via -t.")
-        sys.exit(1)
+    sys.exit(G213Cli.apply_system_default())
 
 # --- CLI Action: Apply User Config (--apply-user-config) ---
 elif args.apply_user_config:
-    product_to_load = args.apply_user_config
-    logger.info(f"Option '--apply-user-config' detected for product: {product_to_load}")
-    
-    user_conf_path = os.path.join(USER_CONFIG_DIR, f"{product_to_load}.conf")
-    logger.info(f"Attempting to load user config from: {user_conf_path}")
+    logger.info(f"Option '--apply-user-config' detected for product: {args.apply_user_config}")
+    sys.exit(G213Cli.apply_user_config(args.apply_user_config, USER_CONFIG_DIR))
 
-    if not os.path.exists(user_conf_path):
-        logger.warning(f"User configuration file not found for {product_to_load} at {user_conf_path}. Nothing to apply.")
-        sys.exit(0) # Not an error, just no config to apply
 
-    success = G213Colors.LogitechDevice.apply_configuration_from_file(user_conf_path)
-    
-    if success:
-        logger.info(f"User settings for {product_to_load} applied successfully from {user_conf_path}.")
-        sys.exit(0)
-    else:
-        logger.error(f"Failed to apply user settings for {product_to_load} from {user_conf_path}.")
-        sys.exit(1)
+# GTK is only loaded once we know the GUI is actually wanted
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+import G213Async
+import G213Profiles
+import G213Daemon
+import G213Pipeline
 
 
 # --- GUI Application Class ---
@@ -96,6 +79,23 @@ class Window(Gtk.Window):
             logger.error(f"Could not create autostart directory {self.autostart_dir}: {e}")
             # Non-fatal, GUI will still load, but autostart management might fail.
 
+        # "Set all Products" drives every product concurrently off the GTK main thread
+        self.async_loop = G213Async.BackgroundLoop()
+        # With a g213colors daemon running, it owns the devices and this window is a thin client
+        self.daemon_client = G213Daemon.DaemonClient()
+        if not self.daemon_client.is_running():
+            self.daemon_client = None
+        self.device_pool = None
+        self.preview_writer = None
+        if self.daemon_client is None:
+            self._open_devices()
+        else:
+            # Live preview goes to the daemon from a thread of its own, newest value wins
+            self.preview_writer = G213Daemon.DaemonPreviewWriter(
+                self.daemon_client.socket_path, on_unavailable=lambda: GLib.idle_add(self._on_daemon_lost)
+            )
+            self.preview_writer.start()
+
         vBoxMain = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10) # Increased main spacing a bit
         self.add(vBoxMain)
 
@@ -157,10 +157,20 @@ class Window(Gtk.Window):
             hBoxSetButtons.pack_start(btn, True, True, 0)
         vBoxMain.pack_start(hBoxSetButtons, False, False, 5) # Add some margin
 
+        # --- Live preview toggle ---
+        self.chkPreview = Gtk.CheckButton(label="Live preview (saved only when you click Set)")
+        self.chkPreview.connect("toggled", self.on_preview_toggled)
+        vBoxMain.pack_start(self.chkPreview, False, False, 0)
+        for color_button in [self.staticColorButton, self.breatheColorButton] + self.segmentColorBtns:
+            color_button.connect("notify::rgba", self.on_preview_changed)
+        for spin_button in (self.sbCycle, self.sbBCycle):
+            spin_button.connect("value-changed", self.on_preview_changed)
+        self.stack.connect("notify::visible-child-name", self.on_preview_changed)
+
         # --- SET ALL Button ---
-        btnSetAll = Gtk.Button.new_with_label("Set all Products")
-        btnSetAll.connect("clicked", self.on_button_clicked, "all")
-        vBoxMain.pack_start(btnSetAll, False, False, 0)
+        self.btnSetAll = Gtk.Button.new_with_label("Set all Products")
+        self.btnSetAll.connect("clicked", self.on_button_clicked, "all")
+        vBoxMain.pack_start(self.btnSetAll, False, False, 0)
         
         # --- Autostart Checkboxes Section ---
         vBoxMain.pack_start(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL, margin_top=10, margin_bottom=5), False, False, 0)
@@ -180,19 +190,42 @@ class Window(Gtk.Window):
         vBoxMain.pack_start(hBoxAutostartChecks, False, False, 5)
 
 
+    def _open_devices(self):
+        """Drives the devices from this window, when there is no daemon (or it went away)."""
+        if self.device_pool is not None:
+            return
+        if self.preview_writer is not None:
+            self.preview_writer.stop() # The daemon's, which is gone
+        # Keeps device handles open between clicks instead of re-enumerating USB every time
+        self.device_pool = G213Colors.DevicePool(ack_reader=True)
+        # Live preview streams widget changes to the devices off the main loop, newest value wins
+        self.preview_writer = G213Async.LatestWinsWriter(self.device_pool)
+        self.preview_writer.start()
+
+    def _on_daemon_lost(self):
+        self.daemon_client = None
+        self._open_devices()
+        self.on_preview_changed()
+        return False # One-shot idle callback
+
+    def shutdown(self):
+        if self.preview_writer is not None:
+            self.preview_writer.stop()
+        self.async_loop.stop()
+        if self.device_pool is not None:
+            self.device_pool.close_all()
+
     def btnGetHex(self, btn):
         color = btn.get_rgba()
-        red = int(color.red * 255)
-        green = int(color.green * 255)
-        blue = int(color.blue * 255)
-        hexColor = f"{red:02x}{green:02x}{blue:02x}"
-        return hexColor
+        # Rounded, not truncated; gamma and white balance are applied per product when the frame is built
+        return G213Pipeline.rgba_to_hex(color.red, color.green, color.blue)
 
     def sbGetValue(self, sb):
         return sb.get_value_as_int()
 
-    def _get_user_config_path(self, product_name):
-        return os.path.join(USER_CONFIG_DIR, f"{product_name}.conf")
+    def _save_user_profile(self, product_name, frames):
+        """Stores frames as the user's default profile, which the login autostart applies."""
+        return G213Profiles.save_user_profile(product_name, frames, config_dir=USER_CONFIG_DIR)
 
     def _get_autostart_desktop_file_path(self, product_name):
         return os.path.join(self.autostart_dir, f"g213colors-autostart-{product_name}.desktop")
@@ -216,7 +249,7 @@ class Window(Gtk.Window):
             desktop_content = f"""[Desktop Entry]
 Name=G213Colors Autostart ({product_name})
 Comment=Apply saved G213Colors settings for {product_name} on login
-Exec=/usr/bin/g213colors-gui --apply-user-config {product_name}
+Exec=/usr/bin/g213colors apply --user {product_name}
 Icon=g213colors
 Terminal=false
 Type=Application
@@ -242,126 +275,135 @@ X-GNOME-Autostart-enabled=true
                     self._show_error_dialog(f"Error removing autostart for {product_name}", str(e))
                     checkbox.set_active(True)
 
-    def sendStatic(self, product):
-        logger.info(f"Initiating static color for {product}")
-        controller = G213Colors.LogitechDevice(product)
-        if not controller.connect():
-            logger.error(f"Failed to connect to {product}. Aborting command.")
-            self._show_error_dialog(f"Connection failed: {product}", "Could not connect to the device. Check USB connection and permissions (udev rules).")
-            return
-
-        color_hex = self.btnGetHex(self.staticColorButton)
-        if controller.send_color_command(color_hex):
-            logger.info(f"Static color command sent to {product}.")
-            field_for_static = 0 
-            command_to_save = controller.spec["colorCommand"].format(f"{field_for_static:02x}", color_hex)
-            user_conf_path = self._get_user_config_path(product)
-            controller.save_configuration(command_to_save, user_conf_path)
-        else:
-            logger.error(f"Failed to send static color command to {product}.")
-            self._show_error_dialog(f"Command Failed: {product}", "Could not send static color command.")
-        controller.disconnect()
-
-    def sendBreathe(self, product):
-        logger.info(f"Initiating breathe effect for {product}")
-        controller = G213Colors.LogitechDevice(product)
-        if not controller.connect():
-            logger.error(f"Failed to connect to {product}. Aborting command.")
-            self._show_error_dialog(f"Connection failed: {product}", "Could not connect to the device.")
-            return
-
-        color_hex = self.btnGetHex(self.breatheColorButton)
-        speed = self.sbGetValue(self.sbBCycle)
-        if controller.send_breathe_command(color_hex, speed):
-            logger.info(f"Breathe command sent to {product}.")
-            command_to_save = controller.spec["breatheCommand"].format(color_hex, f"{speed:04x}")
-            user_conf_path = self._get_user_config_path(product)
-            controller.save_configuration(command_to_save, user_conf_path)
-        else:
-            logger.error(f"Failed to send breathe command to {product}.")
-            self._show_error_dialog(f"Command Failed: {product}", "Could not send breathe command.")
-        controller.disconnect()
-
-    def sendCycle(self, product):
-        logger.info(f"Initiating cycle effect for {product}")
-        controller = G213Colors.LogitechDevice(product)
-        if not controller.connect():
-            logger.error(f"Failed to connect to {product}. Aborting command.")
-            self._show_error_dialog(f"Connection failed: {product}", "Could not connect to the device.")
-            return
+    def _frames_for_current_tab(self, product):
+        """Builds the frames the visible effect tab sends to product."""
+        stack_name = self.stack.get_visible_child_name()
+        if stack_name == "cycle":
+            return [G213Colors.build_frame(product, "cycle", (self.sbGetValue(self.sbCycle),))]
+        if stack_name == "breathe":
+            color_hex = self.btnGetHex(self.breatheColorButton)
+            return [G213Colors.build_frame(product, "breathe", (color_hex, self.sbGetValue(self.sbBCycle)))]
+        if stack_name == "segments" and product != "G203":
+            return [
+                G213Colors.build_frame(product, "color", (i, self.btnGetHex(self.segmentColorBtns[i-1])))
+                for i in range(1, 6)
+            ]
+        # Static, or segments on the G203 which only has one zone (first segment color)
+        button = self.segmentColorBtns[0] if stack_name == "segments" else self.staticColorButton
+        return [G213Colors.build_frame(product, "color", (0, self.btnGetHex(button)))]
+
+    def sendAll(self, products=PRODUCTS):
+        # Pool acquires can wait for another process's device lock, so never on the GTK main thread
+        logger.info(f"Applying current '{self.stack.get_visible_child_name()}' settings to {', '.join(products)}.")
+        self._open_devices()
+        frames_by_product = {p: self._frames_for_current_tab(p) for p in products}
+        self.btnSetAll.set_sensitive(False)
+        self.async_loop.submit(
+            G213Async.apply_all(frames_by_product, self.device_pool),
+            lambda results: GLib.idle_add(self._on_apply_all_done, frames_by_product, results)
+        )
 
-        speed = self.sbGetValue(self.sbCycle)
-        if controller.send_cycle_command(speed):
-            logger.info(f"Cycle command sent to {product}.")
-            command_to_save = controller.spec["cycleCommand"].format(f"{speed:04x}")
-            user_conf_path = self._get_user_config_path(product)
-            controller.save_configuration(command_to_save, user_conf_path)
-        else:
-            logger.error(f"Failed to send cycle command to {product}.")
-            self._show_error_dialog(f"Command Failed: {product}", "Could not send cycle command.")
-        controller.disconnect()
-
-    def sendSegments(self, product):
-        logger.info(f"Initiating segment colors for {product}")
-        if product == "G203": # G203 doesn't support segments, treat as full static color
-            logger.warning("Segment mode is not applicable to G203. Applying color from first segment to whole device.")
-            # Use color from first segment button for the whole device
-            # Or disable this option if G203 is selected for segments in GUI
-            self.staticColorButton.set_rgba(self.segmentColorBtns[0].get_rgba()) # Set static color button
-            self.sendStatic(product) # Send as a static command
-            return
+    def _on_apply_all_done(self, frames_by_product, results):
+        self.btnSetAll.set_sensitive(True)
+        if isinstance(results, Exception):
+            logger.error(f"Applying to all products failed: {results}")
+            self._show_error_dialog("Command Failed", str(results))
+            return False
+        for product, result in results.items():
+            if result.ok:
+                logger.info(f"Settings applied to {product} in {result.elapsed * 1000:.1f} ms.")
+                self._save_user_profile(product, frames_by_product[product])
+            else:
+                logger.error(f"Failed to apply settings to {product}: {result.error}")
+                self._show_error_dialog(f"Command Failed: {product}", result.error)
+        return False # One-shot idle callback
+
+    def sendViaDaemon(self, product_target):
+        # The daemon may queue for a device lock for a while, so never wait for it on the GTK main thread
+        targets = PRODUCTS if product_target == "all" else [product_target]
+        frames_by_product = {product: self._frames_for_current_tab(product) for product in targets}
+        socket_path = self.daemon_client.socket_path
+
+        def send():
+            client = G213Daemon.DaemonClient(socket_path)
+            responses = {}
+            try:
+                for product, frames in frames_by_product.items():
+                    try:
+                        responses[product] = client.request("apply_frames", product=product, frames=[frame.hex() for frame in frames])
+                    except G213Daemon.DaemonUnavailable as e:
+                        responses[product] = e
+                        break
+                    except (OSError, ValueError) as e:
+                        responses[product] = e
+            finally:
+                client.close()
+            return responses
+        self.btnSetAll.set_sensitive(False)
+        self.async_loop.submit(
+            G213Async.run_blocking(send),
+            lambda responses: GLib.idle_add(self._on_daemon_apply_done, frames_by_product, responses)
+        )
 
-        controller = G213Colors.LogitechDevice(product)
-        if not controller.connect():
-            logger.error(f"Failed to connect to {product}. Aborting command.")
-            self._show_error_dialog(f"Connection failed: {product}", "Could not connect to the device.")
-            return
-
-        commands_to_save_list = []
-        all_segments_sent_successfully = True
-        for i in range(1, 6): 
-            segment_color_hex = self.btnGetHex(self.segmentColorBtns[i-1])
-            logger.debug(f"Sending segment {i} color {segment_color_hex} for {product}")
-            if not controller.send_color_command(segment_color_hex, i):
-                logger.error(f"Failed to send color for segment {i} to {product}.")
-                all_segments_sent_successfully = False
-                break 
-            
-            command_for_segment = controller.spec["colorCommand"].format(f"{i:02x}", segment_color_hex)
-            commands_to_save_list.append(command_for_segment)
-            sleep(0.01) 
-        
-        if all_segments_sent_successfully:
-            logger.info(f"All segment commands sent to {product}.")
-            full_data_to_save = "\n".join(commands_to_save_list)
-            user_conf_path = self._get_user_config_path(product)
-            controller.save_configuration(full_data_to_save, user_conf_path)
-        else:
-            logger.warning(f"Segment color setting partially failed for {product}. Configuration not saved for this attempt.")
-            self._show_error_dialog(f"Segment Command Failed: {product}", "Could not send all segment color commands.")
-        controller.disconnect()
+    def _on_daemon_apply_done(self, frames_by_product, responses):
+        self.btnSetAll.set_sensitive(True)
+        if isinstance(responses, Exception):
+            logger.error(f"Applying through the daemon failed: {responses}")
+            self._show_error_dialog("Command Failed", str(responses))
+            return False
+        unanswered = []
+        for product, frames in frames_by_product.items():
+            response = responses.get(product)
+            if response is None or isinstance(response, G213Daemon.DaemonUnavailable):
+                unanswered.append(product)
+            elif isinstance(response, Exception):
+                # The daemon may still be applying: writing the device from here as well would race it
+                logger.error(f"No answer from the daemon for {product}: {response}")
+                self._show_error_dialog(f"Command Failed: {product}", f"The daemon did not answer: {response}")
+            elif response["ok"]:
+                logger.info(f"Settings applied to {product} through the daemon.")
+                self._save_user_profile(product, frames)
+            else:
+                logger.error(f"Daemon failed to apply settings to {product}: {response['error']}")
+                self._show_error_dialog(f"Command Failed: {product}", response["error"])
+        if unanswered:
+            logger.warning(f"Lost the daemon; applying to {', '.join(unanswered)} directly.")
+            self.daemon_client = None
+            self.sendAll(unanswered)
+        return False # One-shot idle callback
 
     def sendManager(self, product_target):
-        if product_target == "all":
-            logger.info("Applying current effect settings to all configured products.")
-            for p in PRODUCTS:
-                self.sendManager(p) 
+        if self.daemon_client is not None:
+            self.sendViaDaemon(product_target)
+        elif product_target == "all":
+            self.sendAll()
         else:
-            self.stackName = self.stack.get_visible_child_name()
-            logger.info(f"Managing '{self.stackName}' settings for product: {product_target}")
-            if self.stackName == "static":
-                self.sendStatic(product_target)
-            elif self.stackName == "cycle":
-                self.sendCycle(product_target)
-            elif self.stackName == "breathe":
-                self.sendBreathe(product_target)
-            elif self.stackName == "segments":
-                self.sendSegments(product_target)
+            self.sendAll([product_target])
 
     def on_button_clicked(self, button, product):
         logger.debug(f"Set button clicked for product: {product}. Current effect tab: {self.stack.get_visible_child_name()}")
+        # A preview frame still queued must not land after the committed settings
+        self.preview_writer.discard(None if product == "all" else product)
         self.sendManager(product)
 
+    def on_preview_changed(self, *args):
+        if not self.chkPreview.get_active():
+            return
+        # Only hands the frames to a writer thread; never touches USB or the daemon socket on the main loop
+        for product in PRODUCTS:
+            self.preview_writer.submit(product, self._frames_for_current_tab(product))
+
+    def on_preview_toggled(self, checkbox):
+        if checkbox.get_active():
+            self.on_preview_changed()
+            return
+        # Preview off: put back what is saved
+        for product in PRODUCTS:
+            _, frames = G213Profiles.user_frames(product, None, USER_CONFIG_DIR)
+            self.preview_writer.discard(product)
+            if frames:
+                self.preview_writer.submit(product, frames)
+
 # --- Main Execution Guard ---
 if __name__ == "__main__":
     # The argparse logic at the top of the file handles CLI arguments and exits if they are processed.
@@ -372,6 +414,7 @@ if __name__ == "__main__":
     try:
         win = Window()
         win.connect("delete-event", Gtk.main_quit)
+        win.connect("destroy", lambda w: w.shutdown())
         win.show_all()
         Gtk.main()
     except Exception as e:
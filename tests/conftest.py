@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import G213Colors # noqa: E402
+import G213Discovery # noqa: E402
+import G213Lock # noqa: E402
+import G213Sim # noqa: E402
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """A fresh SimulatedBackend as the default backend, with lock files kept in tmp_path."""
+    monkeypatch.setattr(G213Lock, "SHARED_LOCK_DIR", str(tmp_path))
+    monkeypatch.setattr(G213Colors.LogitechDevice, "_learned_frame_gaps", {})
+    G213Discovery.DISCOVERY_CACHE.invalidate()
+    sim = G213Sim.SimulatedBackend(enumeration_latency=0)
+    G213Colors.set_default_backend(sim)
+    yield sim
+    G213Colors.set_default_backend(None)
+    G213Discovery.DISCOVERY_CACHE.invalidate()
+
+
+@pytest.fixture
+def connect():
+    """connect(product_name) returns a connected LogitechDevice; every one is disconnected afterwards."""
+    devices = []
+
+    def _connect(product_name, ack_reader=False):
+        device = G213Colors.LogitechDevice(product_name)
+        assert device.connect()
+        if ack_reader:
+            device.start_ack_reader()
+        devices.append(device)
+        return device
+    yield _connect
+    for device in devices:
+        device.stop_ack_reader()
+        device.disconnect()
+
+
+@pytest.fixture
+def pool(backend):
+    """A DevicePool on the simulated backend; its handles are closed afterwards."""
+    device_pool = G213Colors.DevicePool()
+    yield device_pool
+    device_pool.close_all()
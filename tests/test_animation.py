@@ -0,0 +1,48 @@
+import threading
+import time
+
+from G213Animation import Animator, Effect, hex_to_rgb
+
+
+class StepEffect(Effect):
+    """Zone 1 changes color every step seconds; the other zones stay put."""
+
+    def __init__(self, step):
+        self.step = step
+
+    def colors_at(self, t, zone_count):
+        return [hex_to_rgb("ff0000" if int(t / self.step) % 2 else "0000ff")] + [hex_to_rgb("00ff00")] * (zone_count - 1)
+
+
+def test_only_changed_zones_are_written(backend, connect):
+    unit = backend.add_device("G213", ack_latency=0)
+    animator = Animator(connect("G213"), StepEffect(step=0.05), fps=100)
+
+    assert animator.run(duration=0.3)
+
+    stats = animator.stats()
+    assert stats["frames_rendered"] >= 10
+    assert stats["usb_writes"] == len(unit.frames)
+    assert 4 + 3 <= stats["usb_writes"] < 4 + stats["frames_rendered"] # Zones 2-5 once, zone 1 on its changes
+    assert stats["writes_skipped"] > 0
+
+
+def test_stop_ends_a_running_animation(backend, connect):
+    backend.add_device("G213", ack_latency=0)
+    animator = Animator(connect("G213"), StepEffect(step=0.05), fps=50)
+    animator.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    animator.stop()
+
+    assert time.monotonic() - started < 0.5
+    assert animator.frames_rendered > 0
+
+
+def test_a_failed_write_stops_the_animation(backend, connect):
+    unit = backend.add_device("G213", ack_latency=0)
+    animator = Animator(connect("G213"), StepEffect(step=0.02), fps=100)
+    threading.Timer(0.05, unit.unplug).start()
+
+    assert animator.run(duration=2.0) is False
@@ -0,0 +1,108 @@
+import time
+
+import G213Colors
+from G213Compositor import PRIORITY_BASE, Compositor, split_frames
+
+
+def color(product_name, zone, rgb):
+    return G213Colors.build_frame(product_name, "color", (zone, rgb))
+
+
+def test_split_frames_spreads_a_whole_device_color_over_the_zones():
+    mode, colors = split_frames("G213", [color("G213", 0, "ff0000"), color("G213", 2, "00ff00")])
+
+    assert mode is None
+    assert colors == {1: color("G213", 1, "ff0000"), 2: color("G213", 2, "00ff00"), 3: color("G213", 3, "ff0000"),
+                      4: color("G213", 4, "ff0000"), 5: color("G213", 5, "ff0000")}
+
+
+def test_split_frames_mode_frame_replaces_earlier_colors():
+    breathe = G213Colors.build_frame("G213", "breathe", ("0000ff", 2000))
+
+    assert split_frames("G213", [color("G213", 1, "ff0000").hex(), breathe]) == (breathe, {})
+    assert split_frames("G213", [breathe, color("G213", 1, "ff0000")]) == (None, {1: color("G213", 1, "ff0000")})
+
+
+def test_split_frames_keeps_zone_0_on_single_zone_products():
+    assert split_frames("G203", [color("G203", 0, "ff0000")]) == (None, {0: color("G203", 0, "ff0000")})
+
+
+def test_only_changed_zones_are_written(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    compositor.set_layer("base", [color("G213", 0, "ff0000")], PRIORITY_BASE)
+    compositor.set_layer("base", [color("G213", 0, "ff0000"), color("G213", 3, "00ff00")], PRIORITY_BASE)
+    compositor.set_layer("base", [color("G213", 0, "ff0000"), color("G213", 3, "00ff00")], PRIORITY_BASE)
+
+    assert unit.frames == [color("G213", 0, "ff0000"), color("G213", 3, "00ff00")]
+
+
+def test_one_color_on_every_zone_is_one_frame(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+
+    compositor.set_layer("base", [color("G213", zone, "0000ff") for zone in range(1, 6)], PRIORITY_BASE)
+
+    assert unit.frames == [color("G213", 0, "0000ff")]
+
+
+def test_every_zone_is_rewritten_after_a_mode(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    cycle = G213Colors.build_frame("G213", "cycle", (5000,))
+    frames = [color("G213", zone, rgb) for zone, rgb in zip((1, 2, 3, 4, 5), ("ff0000", "ff0000", "00ff00", "ff0000", "ff0000"))]
+    compositor.set_layer("base", [cycle], PRIORITY_BASE)
+
+    compositor.set_layer("base", frames, PRIORITY_BASE)
+
+    assert unit.frames == [cycle] + frames
+
+
+def test_mode_is_sent_once(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    breathe = G213Colors.build_frame("G213", "breathe", ("0000ff", 2000))
+
+    compositor.set_layer("base", [breathe], PRIORITY_BASE)
+    compositor.set_layer("schedule", [breathe], PRIORITY_BASE)
+
+    assert unit.frames == [breathe]
+
+
+def test_overlay_removal_restores_only_what_it_covered(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    compositor.set_layer("base", [color("G213", 0, "ff0000")], PRIORITY_BASE)
+    compositor.set_layer("alert", [color("G213", 5, "ffffff")])
+    compositor.remove_layer("alert")
+
+    assert unit.frames == [color("G213", 0, "ff0000"), color("G213", 5, "ffffff"), color("G213", 5, "ff0000")]
+    assert unit.zone_colors == {0: "ff0000", 5: "ff0000"}
+
+
+def test_expired_overlay_restores_the_layers_below(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    compositor.set_layer("base", [color("G213", 0, "00ff00")], PRIORITY_BASE)
+    compositor.set_layer("flash", [color("G213", 0, "ff0000")], ttl=0.05)
+    assert unit.frames[-1] == color("G213", 0, "ff0000")
+
+    deadline = time.monotonic() + 2
+    while len(unit.frames) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert unit.frames[2:] == [color("G213", 0, "00ff00")]
+    assert not compositor.has_overlays()
+    compositor.close()
+
+
+def test_redraw_after_a_replug_writes_the_whole_state(backend, pool):
+    unit = backend.add_device("G213")
+    compositor = Compositor("G213", pool=pool)
+    compositor.set_layer("base", [color("G213", 0, "ff0000"), color("G213", 2, "0000ff")], PRIORITY_BASE)
+    written = len(unit.frames)
+    unit.unplug()
+    unit.replug()
+
+    assert compositor.redraw()
+    assert unit.frames[written:] == [color("G213", zone, "0000ff" if zone == 2 else "ff0000") for zone in range(1, 6)]
@@ -0,0 +1,118 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import G213Colors
+import G213Daemon
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+@pytest.fixture
+def daemon(pool):
+    daemon_state = G213Daemon.LightingDaemon(pool)
+    yield daemon_state
+    daemon_state.close()
+
+
+def test_set_color_writes_the_unit_and_is_reported_in_state(backend, daemon):
+    unit = backend.add_device("G213")
+
+    assert daemon.handle({"op": "set_color", "product": "G213", "zone": 2, "color": "ff0000"}) == {"frames": 1, "ok": True}
+
+    assert unit.frames == [color(2, "ff0000")]
+    devices = daemon.handle({"op": "state"})["devices"]
+    assert [(d["product"], d["unit"], d["frames"]) for d in devices] == [("G213", None, [color(2, "ff0000").hex()])]
+
+
+@pytest.mark.parametrize("request_", [
+    ["set_color"],
+    {"op": "shutdown_everything"},
+    {"op": "set_color", "product": "G999", "color": "ff0000"},
+    {"op": "set_color", "product": "G213"},
+    {"op": "set_color", "product": "G213", "color": "not a color"},
+])
+def test_bad_requests_get_an_error_answer(backend, daemon, request_):
+    backend.add_device("G213")
+
+    response = daemon.handle(request_)
+
+    assert response["ok"] is False
+    assert response["error"]
+
+
+def test_unexpected_handler_errors_are_answered_too(backend, daemon, monkeypatch):
+    def broken(request):
+        raise RuntimeError("boom")
+    monkeypatch.setitem(daemon.handlers, "ping", broken)
+
+    assert daemon.handle({"op": "ping"}) == {"ok": False, "error": "ping failed: boom"}
+
+
+def test_a_missing_device_fails_the_request(backend, daemon):
+    response = daemon.handle({"op": "set_color", "product": "G213", "color": "ff0000"})
+
+    assert response["ok"] is False
+    assert "G213" in response["error"]
+
+
+def test_overlay_is_drawn_over_the_applied_colors_and_cleared(backend, daemon):
+    unit = backend.add_device("G213")
+    daemon.handle({"op": "set_color", "product": "G213", "color": "00ff00"})
+
+    assert daemon.handle({"op": "overlay", "product": "G213", "color": "ff0000", "zones": [5], "ttl": None})["ok"]
+    assert unit.frames[-1] == color(5, "ff0000")
+    assert daemon.handle({"op": "clear_overlay", "product": "G213"})["ok"]
+    assert unit.frames[-1] == color(5, "00ff00")
+
+
+def test_hotplug_restore_reuses_the_units_handle(backend, daemon):
+    unit = backend.add_device("G213")
+    daemon.handle({"op": "set_color", "product": "G213", "color": "ff0000"})
+    unit.unplug()
+    unit.replug()
+
+    started = time.monotonic()
+    assert daemon.restore("G213", "1-1", None)
+
+    assert time.monotonic() - started < 1.0 # Not queued behind a second handle of the same unit
+    assert unit.frames == [color(0, "ff0000")] * 2
+    assert len(daemon.handle({"op": "state"})["devices"]) == 1
+
+
+def test_client_talks_to_the_server(backend, daemon, tmp_path):
+    unit = backend.add_device("G213")
+    path = str(tmp_path / "daemon.sock")
+    server = G213Daemon.DaemonServer(path, daemon)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = G213Daemon.DaemonClient(path)
+    try:
+        assert client.is_running()
+        assert client.request("set_color", product="G213", color="0000ff")["ok"]
+        assert unit.frames == [color(0, "0000ff")]
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_client_tells_no_daemon_from_no_answer(tmp_path):
+    with pytest.raises(G213Daemon.DaemonUnavailable):
+        G213Daemon.DaemonClient(str(tmp_path / "missing.sock")).request("ping")
+
+    path = str(tmp_path / "silent.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1) # Takes the request but never answers, like a daemon busy past the timeout
+    client = G213Daemon.DaemonClient(path, timeout=0.1)
+    try:
+        with pytest.raises(OSError) as raised:
+            client.request("ping")
+        assert not isinstance(raised.value, G213Daemon.DaemonUnavailable)
+    finally:
+        client.close()
+        listener.close()
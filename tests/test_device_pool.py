@@ -0,0 +1,76 @@
+import threading
+import time
+
+import G213Colors
+import G213Lock
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+def send(frame):
+    return lambda device: device.send_batch([frame])[0].sent
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_calls_share_one_open_handle(backend, pool):
+    unit = backend.add_device("G213")
+
+    assert pool.call("G213", send(color(1, "ff0000")))
+    first = pool.acquire("G213")
+    pool.release("G213")
+    assert pool.call("G213", send(color(2, "00ff00")))
+
+    assert pool.acquire("G213") is first
+    pool.release("G213")
+    assert backend.find_calls == 1
+    assert not unit.kernel_driver_active # Still detached between calls
+    assert unit.frames == [color(1, "ff0000"), color(2, "00ff00")]
+
+
+def test_idle_handle_is_closed_and_the_driver_reattached(backend):
+    unit = backend.add_device("G213")
+    pool = G213Colors.DevicePool(idle_timeout=0.05)
+
+    assert pool.call("G213", send(color(0, "ff0000")))
+
+    assert wait_until(lambda: unit.kernel_driver_active)
+    pool.close_all()
+
+
+def test_stale_handle_is_reopened_and_the_call_retried(backend, pool):
+    unit = backend.add_device("G213")
+    assert pool.call("G213", send(color(0, "ff0000")))
+    unit.unplug()
+    unit.replug()
+
+    assert pool.call("G213", send(color(0, "0000ff")))
+    assert unit.frames[-1] == color(0, "0000ff")
+
+
+def test_missing_device_fails_the_call(backend, pool):
+    assert not pool.call("G213", send(color(0, "ff0000")))
+
+
+def test_idle_handle_is_given_up_for_a_waiting_process(backend, pool):
+    unit = backend.add_device("G213", port_numbers=(4,))
+    assert pool.call("G213", send(color(0, "ff0000")))
+    other = G213Lock.DeviceLock("G213@1-4")
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(other.acquire(timeout=5)))
+
+    started = time.monotonic()
+    waiter.start()
+    waiter.join()
+
+    assert acquired == [True]
+    assert time.monotonic() - started < pool.idle_timeout # Yielded well before the idle timeout
+    assert unit.kernel_driver_active
+    other.release()
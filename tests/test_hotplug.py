@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+import G213Colors
+import G213Hotplug
+from G213Profiles import DEFAULT_PROFILE, ProfileStore, unit_profile_name
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def watch(backend, tmp_path):
+    """watch(**options) starts a HotplugWatcher on a FakeEventSource with the profiles in tmp_path."""
+    watchers = []
+
+    def _watch(**options):
+        source = G213Hotplug.FakeEventSource()
+        watcher = G213Hotplug.HotplugWatcher(source, config_dir=str(tmp_path), system_conf_file=None, **options)
+        watcher.start()
+        watchers.append(watcher)
+        return source, watcher
+    yield _watch
+    for watcher in watchers:
+        watcher.stop()
+
+
+def save_profile(tmp_path, name, frames):
+    assert ProfileStore(str(tmp_path / "profiles.g2p")).save("G213", name, frames)
+
+
+def test_a_burst_of_events_reapplies_the_units_profile_once(backend, watch, tmp_path):
+    backend.add_device("G213", port_numbers=(1,))
+    unit = backend.add_device("G213", port_numbers=(2,))
+    save_profile(tmp_path, DEFAULT_PROFILE, [color(0, "ff0000")])
+    save_profile(tmp_path, unit_profile_name("1-2"), [color(0, "0000ff")])
+    source, watcher = watch()
+
+    for action in ("add", "bind", "add"):
+        source.emit(action, "G213", "1-2")
+
+    assert wait_until(lambda: watcher.reapplies == 1)
+    assert unit.frames == [color(0, "0000ff")]
+    assert watcher.events_seen == 3
+    assert backend.devices[0].frames == []
+
+
+def test_unplugging_again_before_the_debounce_cancels_the_reapply(backend, watch, tmp_path):
+    unit = backend.add_device("G213")
+    save_profile(tmp_path, DEFAULT_PROFILE, [color(0, "ff0000")])
+    source, watcher = watch(debounce=0.2)
+
+    source.emit("add", "G213", "1-1")
+    source.emit("remove", "G213", "1-1")
+
+    assert wait_until(lambda: watcher.events_seen == 2)
+    time.sleep(0.3)
+    assert watcher.reapplies == 0
+    assert unit.frames == []
+
+
+def test_lost_events_rescan_every_attached_unit(backend, watch):
+    backend.add_device("G213", port_numbers=(1,))
+    backend.add_device("G203", port_numbers=(2,))
+    applied = []
+    source, watcher = watch(apply_func=lambda product_name, unit, frames: applied.append((product_name, unit)) or True)
+
+    source.overflow()
+
+    assert wait_until(lambda: len(applied) == 2)
+    assert sorted(applied) == [("G203", "1-2"), ("G213", "1-1")]
+
+
+def test_a_failing_reapply_is_retried_then_given_up(backend, watch, monkeypatch):
+    monkeypatch.setattr(G213Hotplug, "RETRY_DELAY", 0.01)
+    results = []
+    source, watcher = watch(apply_func=lambda product_name, unit, frames: False,
+                            on_applied=lambda product_name, unit, ok: results.append(ok))
+
+    source.emit("add", "G213", "1-1")
+
+    assert wait_until(lambda: len(results) == G213Hotplug.MAX_ATTEMPTS)
+    time.sleep(0.05)
+    assert results == [False] * G213Hotplug.MAX_ATTEMPTS
+    assert watcher.reapplies == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from G213Ingest import HEADER, Packet, SENDER_RESTART_AFTER, SequenceTracker, decode_packet, encode_packet
+
+
+def test_decode_round_trips_encode():
+    data = encode_packet("G213", {1: "ff0000", 5: (0, 0, 255)}, 7, unit_index=2)
+
+    packet, end = decode_packet(data)
+
+    assert end == len(data)
+    assert (packet.product_name, packet.unit_index, packet.sequence) == ("G213", 2, 7)
+    assert packet.colors == [(1, b"\xff\x00\x00"), (5, b"\x00\x00\xff")]
+
+
+def test_decode_reads_packets_back_to_back():
+    data = encode_packet("G203", {0: "00ff00"}, 1) + encode_packet("G213", {0: "0000ff"}, 2)
+
+    first, offset = decode_packet(data)
+    second, end = decode_packet(data, offset)
+
+    assert (first.product_name, first.sequence, second.product_name, second.sequence) == ("G203", 1, "G213", 2)
+    assert end == len(data)
+
+
+def test_decode_waits_for_the_rest_of_a_partial_packet():
+    data = encode_packet("G213", {1: "ff0000", 2: "00ff00"}, 1)
+
+    assert decode_packet(data[:HEADER.size - 1]) == (None, 0)
+    assert decode_packet(data[:-1]) == (None, 0)
+
+
+@pytest.mark.parametrize("data", [
+    b"XX" + encode_packet("G213", {0: "ff0000"}, 1)[2:], # Bad magic
+    encode_packet("G213", {0: "ff0000"}, 1)[:2] + b"\x02" + encode_packet("G213", {0: "ff0000"}, 1)[3:], # Version
+    encode_packet("G213", {0: "ff0000"}, 1)[:3] + b"\x09" + encode_packet("G213", {0: "ff0000"}, 1)[4:], # Product
+    encode_packet("G203", {1: "ff0000"}, 1), # The G203 has no zone 1
+    HEADER.pack(b"GC", 1, 1, 0, 1, 0), # Empty zone mask
+])
+def test_decode_rejects_invalid_packets(data):
+    with pytest.raises(ValueError):
+        decode_packet(data)
+
+
+def packet(sequence, received=100.0, unit_index=0):
+    return Packet("G213", unit_index, sequence, [(0, b"\xff\x00\x00")], received)
+
+
+def test_tracker_counts_gaps_as_lost():
+    tracker = SequenceTracker()
+
+    assert tracker.accept("a", packet(1))
+    assert tracker.accept("a", packet(4))
+    assert (tracker.lost, tracker.stale) == (2, 0)
+
+
+def test_tracker_drops_repeated_and_older_packets():
+    tracker = SequenceTracker()
+    tracker.accept("a", packet(5))
+
+    assert not tracker.accept("a", packet(5))
+    assert not tracker.accept("a", packet(3))
+    assert tracker.accept("a", packet(6))
+    assert (tracker.lost, tracker.stale) == (0, 2)
+
+
+def test_tracker_handles_wraparound_and_keeps_senders_and_units_apart():
+    tracker = SequenceTracker()
+    tracker.accept("a", packet(0xffffffff))
+
+    assert tracker.accept("a", packet(0))
+    assert tracker.accept("b", packet(0))
+    assert tracker.accept("a", packet(0, unit_index=1))
+    assert (tracker.lost, tracker.stale) == (0, 0)
+
+
+def test_tracker_lets_a_silent_sender_start_over():
+    tracker = SequenceTracker()
+    tracker.accept("a", packet(50, received=100.0))
+
+    assert tracker.accept("a", packet(1, received=100.0 + SENDER_RESTART_AFTER + 0.1))
+    assert tracker.stale == 0
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import G213Colors
+import G213Lock
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def pending(lock):
+    with open(lock.pending_path, "rb") as f:
+        return f.read()
+
+
+def test_queued_applies_coalesce_into_the_newest(backend):
+    unit = backend.add_device("G213", port_numbers=(2,))
+    holder = G213Lock.DeviceLock("G213@1-2")
+    assert holder.acquire()
+    results = []
+
+    def apply(rgb):
+        results.append(G213Colors.LogitechDevice.apply_commands("G213", [color(0, rgb)]))
+    first = threading.Thread(target=apply, args=("ff0000",))
+    first.start()
+    assert wait_until(lambda: os.path.exists(holder.pending_path) and color(0, "ff0000").hex().encode() in pending(holder))
+    second = threading.Thread(target=apply, args=("0000ff",))
+    second.start()
+    assert wait_until(lambda: color(0, "0000ff").hex().encode() in pending(holder))
+    holder.release()
+    first.join()
+    second.join()
+
+    assert results == [True, True]
+    assert unit.frames == [color(0, "0000ff")] # The older request was dropped, not replayed
+    assert pending(holder) == b""
+
+
+def test_submit_gives_up_after_the_timeout_and_withdraws_its_frames(backend):
+    holder = G213Lock.DeviceLock("G213@1-1")
+    assert holder.acquire()
+    waiter = G213Lock.DeviceLock("G213@1-1")
+
+    assert waiter.submit([color(0, "ff0000")], timeout=0.05) is False
+    assert pending(holder) == b""
+    holder.release()
+
+
+def test_requeue_keeps_a_newer_pending_request(backend):
+    lock = G213Lock.DeviceLock("G213@1-1")
+    older, newer = [color(0, "ff0000")], [color(0, "00ff00")]
+    assert lock.submit(older) == older
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(G213Lock.DeviceLock("G213@1-1").submit(newer, timeout=5)))
+    waiter.start()
+    assert wait_until(lambda: newer[0].hex().encode() in pending(lock))
+
+    lock.requeue(older) # E.g. connect() failed after all
+    lock.release()
+    waiter.join()
+
+    assert results == [newer]
+
+
+def test_lock_files_are_not_world_writable(backend):
+    lock = G213Lock.DeviceLock("G213@1-1")
+    assert lock.submit([color(0, "ff0000")])
+    assert not lock.others_waiting()
+
+    for path in (lock.path, lock.waiting_path, lock.pending_path):
+        assert os.stat(path).st_mode & 0o777 == 0o660
+    lock.release()
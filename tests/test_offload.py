@@ -0,0 +1,54 @@
+import pytest
+
+import G213Colors
+import G213Offload
+from G213Animation import ChaseEffect, Effect, PulseEffect, hue_to_rgb
+
+
+class HueCycleEffect(Effect):
+    """Every zone the same hue, once round the color wheel per period; what the hardware cycle shows."""
+
+    def __init__(self, period):
+        self.period = period
+
+    def colors_at(self, t, zone_count):
+        return [hue_to_rgb(t / self.period)] * zone_count
+
+
+@pytest.mark.parametrize("product_name", ["G213", "G203"])
+def test_pulse_from_dark_is_offloaded_to_breathe(product_name):
+    offload_plan = G213Offload.plan(PulseEffect("ff8000", period=3.0), product_name)
+
+    assert offload_plan.path == "breathe"
+    assert offload_plan.frames == [G213Colors.build_frame(product_name, "breathe", ("ff8000", 3000))]
+    assert offload_plan.host_writes_per_second > 0
+
+
+def test_pulse_that_never_gets_dark_streams_from_the_host():
+    assert G213Offload.plan(PulseEffect("ff8000", period=3.0, floor=0.5), "G213").path == "host"
+
+
+def test_pulse_outside_the_speed_range_streams_from_the_host():
+    assert G213Offload.plan(PulseEffect("ff8000", period=0.2), "G213").path == "host"
+
+
+@pytest.mark.parametrize("product_name", ["G213", "G203"])
+def test_hue_cycle_is_offloaded_to_cycle(product_name):
+    offload_plan = G213Offload.plan(HueCycleEffect(period=6.0), product_name)
+
+    assert offload_plan.path == "cycle"
+    assert offload_plan.frames == [G213Colors.build_frame(product_name, "cycle", (6000,))]
+
+
+def test_zones_with_different_colors_stream_from_the_host():
+    offload_plan = G213Offload.plan(ChaseEffect("ff0000", period=1.0), "G213")
+
+    assert offload_plan.path == "host"
+    assert offload_plan.frames is None
+
+
+def test_unchanging_effect_becomes_color_frames():
+    offload_plan = G213Offload.plan(PulseEffect("00ff00", period=2.0, floor=1.0), "G213")
+
+    assert offload_plan.path == "static"
+    assert offload_plan.frames == [G213Colors.build_frame("G213", "color", (0, "00ff00"))]
@@ -0,0 +1,81 @@
+import zlib
+
+import G213Colors
+import G213Pipeline
+import G213Profiles
+from G213Profiles import ProfileStore
+
+
+def color(product_name, zone, rgb):
+    return G213Colors.build_frame(product_name, "color", (zone, rgb))
+
+
+def test_saved_profile_is_applied_as_stored(backend, tmp_path):
+    unit = backend.add_device("G213")
+    store = ProfileStore(str(tmp_path / "profiles.g2p"))
+    frames = [color("G213", 0, "ff0000"), color("G213", 4, "00ff00")]
+
+    assert store.save("G213", "work", [frame.hex() for frame in frames])
+    assert store.apply("G213", "work")
+
+    assert unit.frames == frames
+    assert store.names() == [("G213", "work")]
+    assert store.pipeline_version("G213", "work") == G213Pipeline.RAW_FRAMES
+
+
+def test_invalid_frames_are_not_saved(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles.g2p"))
+    store.save("G213", "good", [color("G213", 0, "ff0000")])
+
+    assert not store.save("G213", "bad", ["11ff0c3a0001ff0000"]) # Not a complete command
+    assert not store.save("G213", "other", [color("G203", 0, "ff0000")]) # Another product's command
+    assert not store.save("G213", "x" * 33, [color("G213", 0, "ff0000")])
+    assert store.names() == [("G213", "good")]
+
+
+def test_another_store_sees_saves_and_deletes(tmp_path):
+    path = str(tmp_path / "profiles.g2p")
+    reader = ProfileStore(path)
+    assert reader.get("G203", "night") is None
+
+    ProfileStore(path).save("G203", "night", [color("G203", 0, "000040")])
+    assert reader.get("G203", "night") == [color("G203", 0, "000040")]
+    ProfileStore(path).delete("G203", "night")
+    assert reader.get("G203", "night") is None
+
+
+def test_corrupt_store_is_refused(backend, tmp_path):
+    unit = backend.add_device("G213")
+    path = tmp_path / "profiles.g2p"
+    store = ProfileStore(str(path))
+    store.save("G213", "work", [color("G213", 0, "ff0000")])
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xff
+    path.write_bytes(bytes(data))
+
+    assert not ProfileStore(str(path)).apply("G213", "work")
+    assert unit.frames == []
+
+
+def test_version_1_store_is_read_as_raw_frames(tmp_path):
+    frame = color("G213", 0, "ffb4aa")
+    index = G213Profiles.ENTRY_V1.pack(b"G213", b"default", G213Profiles.HEADER.size + G213Profiles.ENTRY_V1.size, 1, len(frame))
+    body = index + frame
+    path = tmp_path / "profiles.g2p"
+    path.write_bytes(G213Profiles.HEADER.pack(G213Profiles.MAGIC, 1, 1, zlib.crc32(body)) + body)
+    store = ProfileStore(str(path))
+
+    assert store.get("G213", "default") == [frame]
+    assert store.pipeline_version("G213", "default") == G213Pipeline.RAW_FRAMES
+    assert store.save("G213", "night", [color("G213", 0, "000040")], G213Pipeline.PIPELINE_VERSION)
+    assert store.pipeline_version("G213", "default") == G213Pipeline.RAW_FRAMES
+    assert store.pipeline_version("G213", "night") == G213Pipeline.PIPELINE_VERSION
+
+
+def test_unit_profile_overrides_the_product_default(tmp_path):
+    store = ProfileStore(str(tmp_path / "profiles.g2p"))
+    store.save("G213", G213Profiles.DEFAULT_PROFILE, [color("G213", 0, "ff0000")])
+    store.save("G213", G213Profiles.unit_profile_name("1-2"), [color("G213", 0, "0000ff")])
+
+    assert G213Profiles.user_frames("G213", "1-2", str(tmp_path), store) == ("profile default@1-2", [color("G213", 0, "0000ff")])
+    assert G213Profiles.user_frames("G213", "1-3", str(tmp_path), store) == ("profile default", [color("G213", 0, "ff0000")])
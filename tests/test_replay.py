@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import G213Colors
+import G213Lock
+import G213Replay
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+def record(ports, frames):
+    spec = G213Colors.LogitechDevice.PRODUCT_SPECS["G213"]
+    return {"idVendor": G213Colors.LogitechDevice.ID_VENDOR, "idProduct": spec["idProduct"], "wValue": spec["wValue"],
+            "needs_ack": spec["needs_receive_after_color"], "bus": 1, "ports": ports, "gap": spec["minFrameGap"],
+            "frames": frames}
+
+
+@pytest.fixture
+def replay(backend, tmp_path, monkeypatch):
+    """replay(records) against the simulated units, taking the same lock files as the backend fixture."""
+    monkeypatch.setattr(G213Replay, "LOCK_DIR", str(tmp_path))
+    return lambda records: G213Replay.replay(records, lambda id_vendor, id_product: backend.find(id_vendor, id_product, find_all=True))
+
+
+def test_blob_round_trips_and_replays_to_its_unit(backend, replay, tmp_path):
+    backend.add_device("G213", port_numbers=(1,))
+    unit = backend.add_device("G213", port_numbers=(2,))
+    path = str(tmp_path / "replay.bin")
+    frames = [color(1, "ff0000"), color(2, "00ff00")]
+    G213Replay.update_blob(record((2,), [color(0, "0000ff")]), path)
+    G213Replay.update_blob(record((2,), frames), path)
+
+    records = G213Replay.collect_records([path])
+
+    assert records == [record((2,), frames)]
+    assert replay(records) == (1, 0)
+    assert unit.frames == frames
+    assert unit.kernel_driver_active
+    assert backend.devices[0].frames == []
+
+
+def test_records_with_unknown_commands_are_not_replayed(tmp_path):
+    path = str(tmp_path / "replay.bin")
+    G213Replay.write_blob(path, [record((1,), [bytes(20)]), record((2,), [color(0, "ff0000")])])
+
+    assert [r["ports"] for r in G213Replay.collect_records([path])] == [(2,)]
+
+
+def test_failed_units_count_as_failed_and_missing_ones_are_skipped(backend, replay):
+    backend.add_device("G213", port_numbers=(1,), error_rate=1.0)
+
+    assert replay([record((1,), [color(0, "ff0000")]), record((3,), [color(0, "ff0000")])]) == (0, 1)
+
+
+def test_replay_waits_for_the_units_lock(backend, replay):
+    unit = backend.add_device("G213", port_numbers=(1,))
+    holder = G213Lock.DeviceLock("G213@1-1")
+    assert holder.acquire()
+    results = []
+    replayer = threading.Thread(target=lambda: results.append(replay([record((1,), [color(0, "ff0000")])])))
+    replayer.start()
+    time.sleep(0.1)
+
+    assert unit.frames == []
+    holder.release()
+    replayer.join()
+    assert results == [(1, 0)]
+    assert unit.frames == [color(0, "ff0000")]
@@ -0,0 +1,104 @@
+import datetime
+import time
+
+import pytest
+
+import G213Colors
+import G213Schedule
+from G213Profiles import ProfileStore
+from G213Schedule import ScheduleRule, Scheduler
+
+
+def color(rgb):
+    return G213Colors.build_frame("G213", "color", (0, rgb))
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "profiles.g2p")
+    store = ProfileStore(path)
+    store.save("G213", "day", [color("ffffff")])
+    store.save("G213", "night", [color("000040")])
+    return path
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def minutes_ago(minutes):
+    return (datetime.datetime.now() - datetime.timedelta(minutes=minutes)).time().replace(second=0, microsecond=0)
+
+
+def run_scheduler(rules, store_path, **options):
+    applied = []
+    scheduler = Scheduler(rules, apply_func=lambda product_name, unit, frames: applied.append(frames) or True,
+                          store_path=store_path, **options)
+    scheduler.start()
+    return scheduler, applied
+
+
+def test_login_rule_fires_once_after_its_delay(store_path):
+    started = time.monotonic()
+    scheduler, applied = run_scheduler([ScheduleRule("G213", "night", login_delay=0.2)], store_path)
+
+    assert wait_until(lambda: applied)
+    elapsed = time.monotonic() - started
+    time.sleep(0.2)
+    scheduler.stop()
+
+    assert applied == [[color("000040")]]
+    assert 0.15 <= elapsed < 1.0
+
+
+def test_catch_up_applies_only_the_latest_rule_per_device(store_path):
+    rules = [ScheduleRule("G213", "day", at=minutes_ago(2)), ScheduleRule("G213", "night", at=minutes_ago(1))]
+
+    scheduler, applied = run_scheduler(rules, store_path)
+    assert wait_until(lambda: applied)
+    scheduler.stop()
+
+    assert applied == [[color("000040")]]
+
+
+def test_without_catch_up_nothing_is_applied_at_start(store_path):
+    scheduler, applied = run_scheduler([ScheduleRule("G213", "night", at=minutes_ago(1))], store_path, catch_up=False)
+    time.sleep(0.1)
+    scheduler.stop()
+
+    assert applied == []
+
+
+def test_missing_profile_is_not_applied(store_path):
+    scheduler, applied = run_scheduler([ScheduleRule("G213", "weekend", login_delay=0)], store_path)
+    time.sleep(0.1)
+    scheduler.stop()
+
+    assert applied == []
+    assert scheduler.applied == 0
+
+
+def test_stop_is_safe_before_start_and_after_the_end(store_path):
+    unstarted = Scheduler([], store_path=store_path)
+    unstarted.stop()
+
+    scheduler, _ = run_scheduler([], store_path)
+    scheduler.stop()
+    scheduler.stop()
+
+    assert not scheduler.is_alive()
+
+
+def test_without_timerfd_it_falls_back_to_sleeping(store_path, monkeypatch):
+    def no_timerfd():
+        raise OSError("timerfd_create failed")
+    monkeypatch.setattr(G213Schedule, "_TimerFd", no_timerfd)
+
+    scheduler, applied = run_scheduler([ScheduleRule("G213", "day", login_delay=0.1)], store_path)
+
+    assert wait_until(lambda: applied)
+    scheduler.stop()
+    assert applied == [[color("ffffff")]]
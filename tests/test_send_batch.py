@@ -0,0 +1,79 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import G213Colors
+
+ACK_TIMEOUT = G213Colors.LogitechDevice.ACK_TIMEOUT_MS / 1000
+
+
+def color_frames(product_name, colors):
+    return [G213Colors.build_frame(product_name, "color", (zone, color)) for zone, color in enumerate(colors, 1)]
+
+
+@pytest.mark.parametrize("ack_reader", [False, True])
+def test_each_frame_waits_for_its_ack(backend, connect, ack_reader):
+    unit = backend.add_device("G213", ack_latency=0.005)
+    device = connect("G213", ack_reader)
+    frames = color_frames("G213", ["ff0000", "00ff00", "0000ff"])
+
+    started = time.perf_counter()
+    results = device.send_batch(frames)
+    elapsed = time.perf_counter() - started
+
+    assert [(result.sent, result.acked) for result in results] == [(True, True)] * 3
+    assert unit.frames == frames
+    assert elapsed >= 3 * 0.004 # Paced by the acks, not by a fixed gap
+    assert elapsed < ACK_TIMEOUT
+
+
+@pytest.mark.parametrize("ack_reader", [False, True])
+def test_lost_ack_costs_the_timeout_and_widens_the_gap(backend, connect, ack_reader):
+    backend.add_device("G213", ack_loss=1.0)
+    device = connect("G213", ack_reader)
+    gap_before = device.get_frame_gap()
+
+    started = time.perf_counter()
+    results = device.send_batch(color_frames("G213", ["ff0000"]))
+    elapsed = time.perf_counter() - started
+
+    assert [(result.sent, result.acked) for result in results] == [(True, False)]
+    assert ACK_TIMEOUT * 0.9 <= elapsed < ACK_TIMEOUT * 3
+    assert device.get_frame_gap() > gap_before
+
+
+def test_wait_for_ack_gives_up_on_a_future_nobody_resolves(backend, connect):
+    backend.add_device("G213")
+    device = connect("G213")
+
+    started = time.perf_counter()
+    assert not device._wait_for_ack(Future())
+    assert time.perf_counter() - started < ACK_TIMEOUT * 3
+
+
+def test_unplug_stops_the_ack_reader_and_the_batch(backend, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213", ack_reader=True)
+    reader = device.ack_reader
+    unit.unplug()
+    reader.join(timeout=1)
+
+    assert not reader.is_alive()
+    assert device.ack_reader is None
+    results = device.send_batch(color_frames("G213", ["ff0000", "00ff00"]))
+    assert [result.sent for result in results] == [False]
+
+
+def test_frames_without_acks_keep_min_gap_apart(backend, connect):
+    unit = backend.add_device("G203")
+    device = connect("G203")
+    frames = [G213Colors.build_frame("G203", "color", (0, color)) for color in ("ff0000", "00ff00", "0000ff")]
+
+    started = time.perf_counter()
+    results = device.send_batch(frames, min_gap=0.02)
+    elapsed = time.perf_counter() - started
+
+    assert [(result.sent, result.acked) for result in results] == [(True, False)] * 3
+    assert unit.frames == frames
+    assert elapsed >= 2 * 0.02
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+
+import pytest
+
+import G213Colors
+from G213State import StateCache
+
+
+def color(zone, rgb):
+    return G213Colors.build_frame("G213", "color", (zone, rgb))
+
+
+@pytest.fixture
+def cache(backend, tmp_path):
+    backend.state_cache = StateCache(str(tmp_path / "state"))
+    os.mkdir(backend.state_cache.directory)
+    return backend.state_cache
+
+
+def write_other_user(cache, identity, slots):
+    """Leaves a state file like another user's process would, claiming it wrote identity just now."""
+    with open("/proc/sys/kernel/random/boot_id") as f:
+        boot_id = f.read().strip()
+    entry = {"slots": slots, "at": time.clock_gettime(time.CLOCK_BOOTTIME), "boot_id": boot_id, "suspended": 0.0}
+    with open(os.path.join(cache.directory, f"g213colors-state-{cache.uid + 1}.json"), "w") as f:
+        json.dump({identity: entry}, f)
+
+
+def test_applying_the_same_settings_again_sends_nothing(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    frames = [color(1, "ff0000"), color(3, "00ff00")]
+
+    assert device.apply_frames(frames)
+    assert device.apply_frames(frames)
+    assert device.apply_frames([color(1, "ff0000"), color(3, "0000ff")])
+
+    assert unit.frames == frames + [color(3, "0000ff")]
+
+
+def test_force_and_other_writes_make_it_send_again(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    frames = [color(0, "ff0000")]
+    device.apply_frames(frames)
+
+    assert device.apply_frames(frames, force=True)
+    device.send_color_command("00ff00") # Outside apply_frames: the cache no longer knows the state
+    assert device.apply_frames(frames)
+
+    assert unit.frames.count(frames[0]) == 3
+
+
+def test_a_later_write_by_another_user_makes_ours_stale(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    frames = [color(0, "ff0000")]
+    device.apply_frames(frames)
+    write_other_user(cache, device.state_identity, {"0": color(0, "0000ff").hex()})
+
+    assert device.apply_frames(frames)
+    assert device.apply_frames(frames)
+
+    assert unit.frames == frames * 2
+
+
+def test_another_users_older_entry_does_not_make_us_skip(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    write_other_user(cache, device.state_identity, {"0": color(0, "ff0000").hex()})
+
+    assert device.apply_frames([color(0, "ff0000")])
+
+    assert unit.frames == [color(0, "ff0000")]
+
+
+def test_invalidate_forgets_the_unit(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    frames = [color(0, "ff0000")]
+    device.apply_frames(frames)
+
+    cache.invalidate(device.state_identity)
+    assert device.apply_frames(frames)
+
+    assert unit.frames == frames * 2
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="needs to hand a file to another uid")
+def test_a_state_file_owned_by_someone_else_is_ignored(backend, cache, connect):
+    unit = backend.add_device("G213")
+    device = connect("G213")
+    frames = [color(0, "ff0000")]
+    device.apply_frames(frames)
+    os.chown(cache.path, 65534, 65534)
+
+    assert device.apply_frames(frames)
+
+    assert unit.frames == frames * 2
@@ -0,0 +1,47 @@
+import G213Colors
+import G213Trace
+
+
+def test_recorded_session_replays_to_the_same_zone_colors(backend, tmp_path):
+    unit = backend.add_device("G213", port_numbers=(2, 3), ack_latency=0.001)
+    path = tmp_path / "session.g2t"
+    recording = G213Trace.RecordingBackend(backend, str(path))
+    device = G213Colors.LogitechDevice("G213", backend=recording)
+    assert device.connect()
+    frames = [G213Colors.build_frame("G213", "color", (zone, rgb))
+              for zone, rgb in ((0, "ff0000"), (2, "00ff00"), (5, "0000ff"))]
+    assert all(result.acked for result in device.send_batch(frames))
+    device.disconnect()
+    recording.writer.close()
+
+    trace = G213Trace.read_trace(str(path))
+
+    assert [(d.id_vendor, d.id_product, d.bus, d.ports) for d in trace.devices.values()] == [
+        (G213Colors.LogitechDevice.ID_VENDOR, 0xc336, 1, (2, 3))
+    ]
+    controls = [event for event in trace.events if event.kind == G213Trace.KIND_CONTROL]
+    assert [event.payload for event in controls] == frames
+    assert all(event.result == len(event.payload) for event in controls)
+    assert sum(event.kind == G213Trace.KIND_READ for event in trace.events) == len(frames)
+
+    report = G213Trace.replay(trace, speed=0)
+
+    assert report["events"] == len(trace.events)
+    assert report["errors"] == 0
+    assert report["units"] == {"G213@1-2.3": {"zones": unit.zone_colors, "mode": "color", "frames": len(frames)}}
+
+
+def test_truncated_trace_keeps_the_complete_records(backend, tmp_path):
+    backend.add_device("G213")
+    path = tmp_path / "session.g2t"
+    recording = G213Trace.RecordingBackend(backend, str(path))
+    device = G213Colors.LogitechDevice("G213", backend=recording)
+    assert device.connect()
+    device.send_color_command("ff0000")
+    device.disconnect()
+    recording.writer.close()
+    path.write_bytes(path.read_bytes()[:-3])
+
+    trace = G213Trace.read_trace(str(path))
+
+    assert [event.kind for event in trace.events] == [G213Trace.KIND_CONTROL]